@@ -1,13 +1,15 @@
 import sys
 import os
 import json
+import asyncio
 from copy import copy
+from functools import partial
 from inspect import isclass, getfile
-from collections import OrderedDict
+from collections import OrderedDict, ChainMap
 from importlib import import_module
 
 import pulsar
-from pulsar import ImproperlyConfigured
+from pulsar import ImproperlyConfigured, get_event_loop, isfuture
 from pulsar.utils.httpurl import remove_double_slash
 from pulsar.apps.wsgi import (WsgiHandler, HtmlDocument, test_wsgi_environ,
                               LazyWsgi, wait_for_body_middleware,
@@ -19,7 +21,7 @@ from pulsar.apps.data import create_store
 from .commands import ConsoleParser, CommandError
 from .extension import Extension, Parameter, EventMixin
 from .wrappers import wsgi_request, HeadMeta, error_handler, as_async_wsgi
-from .engines import template_engine
+from .engines import template_engine, compile_template
 from .cms import CMS
 from .cache import create_cache
 
@@ -164,6 +166,7 @@ class Application(ConsoleParser, Extension, EventMixin):
     auth_backend = None
     cms = None
     _worker = None
+    _static_context = None
     _WsgiHandler = WsgiHandler
     _pubsub_store = None
     _config = [
@@ -226,6 +229,17 @@ class Application(ConsoleParser, Extension, EventMixin):
                    'supporting the cache protocol')),
         Parameter('DEFAULT_CACHE_TIMEOUT', 60,
                   'Default timeout for data stored in cache'),
+        Parameter('CACHE_SERIALIZER', 'json',
+                  'Name of the serializer used for values cached via '
+                  '``@cached``. One of json, pickle, msgpack, bytes, text '
+                  'or any serializer added via ``register_serializer``'),
+        Parameter('CACHE_COMPRESS_MIN_LENGTH', 0,
+                  'If a positive integer, serialised cache values longer '
+                  'than this number of bytes are compressed with zlib'),
+        Parameter('CACHE_LOCK_TIMEOUT', 10,
+                  'Maximum time in seconds a cache lock is held, and waited '
+                  'for, when recomputing a value cached with '
+                  '``@cached(lock=True)``'),
         Parameter('DEFAULT_FROM_EMAIL', '',
                   'Default email address to send email from'),
         Parameter('LOCALE', 'en_GB', 'Default locale', True),
@@ -259,6 +273,10 @@ class Application(ConsoleParser, Extension, EventMixin):
         self.meta.argv = callable._argv
         self.meta.script = callable._script
         self.auth_backend = self
+        self._template_paths = {}
+        self._templates = {}
+        self._cms_indexes = {}
+        self._cms_routes = {}
         self.config = self._build_config(callable._config_file)
         self.fire('on_config')
         if handler:
@@ -321,6 +339,8 @@ class Application(ConsoleParser, Extension, EventMixin):
     def get_handler(self):
         if self.handler is None:
             self._worker = pulsar.get_actor()
+            if self._worker:
+                self._worker.bind_event('stopping', self.on_stop)
             if not self.cms:
                 self.cms = CMS(self)
 
@@ -487,6 +507,24 @@ class Application(ConsoleParser, Extension, EventMixin):
     def on_start(self, server):
         self.fire('on_start', server)
 
+    def on_stop(self, worker=None, exc=None):
+        '''Fire the ``on_stop`` event when the ``worker`` serving this
+        application stops.
+
+        Handlers can return futures, the worker stops once they are done.
+        '''
+        waiting = []
+        for handler in (self.events or {}).get('on_stop', ()):
+            try:
+                result = handler(self)
+            except Exception:
+                self.logger.exception('Exception during "on_stop" event')
+            else:
+                if isfuture(result):
+                    waiting.append(result)
+        if waiting:
+            return asyncio.gather(*waiting, return_exceptions=True)
+
     def load_extension(self, dotted_path):
         '''Load an :class:`.Extension` class into this :class:`App`.
 
@@ -514,17 +552,22 @@ class Application(ConsoleParser, Extension, EventMixin):
         '''Return the template full path or None.
 
         Loops through all :attr:`extensions` in reversed order and
-        check for ``name`` within the ``templates`` directory
+        check for ``name`` within the ``templates`` directory.
+
+        Resolved paths are cached, unless the application is in
+        :attr:`debug` mode.
         '''
         if not isinstance(names, (list, tuple)):
             names = (names,)
+        key = tuple(names)
+        filename = self._template_paths.get(key)
+        if filename:
+            return filename
         for name in names:
-            for ext in reversed(tuple(self.extensions.values())):
-                filename = ext.get_template_full_path(self, name)
-                if os.path.exists(filename):
-                    return filename
-            filename = os.path.join(LUX_CORE, 'templates', name)
-            if os.path.exists(filename):
+            filename = self._find_template(name)
+            if filename:
+                if not self.debug:
+                    self._template_paths[key] = filename
                 return filename
         self.logger.error('Template %s not found' % name)
 
@@ -544,6 +587,35 @@ class Application(ConsoleParser, Extension, EventMixin):
                 return file.read()
         return ''
 
+    def compiled_template(self, name, engine=None):
+        '''Load and compile the template ``name`` with ``engine``.
+
+        Compiled templates are kept in memory so that the file system is
+        accessed once only. In :attr:`debug` mode the modification time of
+        the file is checked at every call and the template is recompiled
+        when it changes.
+
+        Return a callable accepting a ``context`` dictionary or ``None``
+        if the template is not found.
+        '''
+        engine = engine or self.config['DEFAULT_TEMPLATE_ENGINE']
+        names = name if isinstance(name, (list, tuple)) else (name,)
+        key = (tuple(names), engine)
+        entry = self._templates.get(key)
+        if entry and not self.debug:
+            return entry[2]
+        filename = self.template_full_path(names)
+        if not filename:
+            return
+        mtime = os.path.getmtime(filename) if self.debug else None
+        if entry and entry[:2] == (filename, mtime):
+            return entry[2]
+        with open(filename, 'r') as file:
+            text = file.read()
+        template = compile_template(self.template_engine(engine), text)
+        self._templates[key] = (filename, mtime, template)
+        return template
+
     def context(self, request, context=None):
         '''Load the ``context`` dictionary for a ``request``.
 
@@ -551,15 +623,28 @@ class Application(ConsoleParser, Extension, EventMixin):
         :meth:`render_template` method is used and a the wsgi ``request``
         is passed as key-valued parameter.
 
-        The initial ``context`` is updated with contribution from
+        The returned context is a :class:`~collections.ChainMap` with
+        ``context`` as first layer, followed by the request context and
+        the application static context. Changes are written in the first
+        layer only:
+
+        * the static context is built once from the :attr:`cms` context
+          and the ``static_context`` method of all :setting:`EXTENSIONS`
+          which expose it, layered over the :attr:`config` dictionary;
+        * the request context is created once per request.
+
+        The ``context`` is then updated with contribution from
         all :setting:`EXTENSIONS` which expose the ``context`` method.
         '''
         if not request.cache._in_application_context:
             request.cache._in_application_context = True
             try:
-                context = context if context is not None else {}
-                context.update(self.config)
-                context.update(self.cms.context(context))
+                base = request.cache.application_context
+                if base is None:
+                    base = self.static_context().new_child()
+                    request.cache.application_context = base
+                context = base.new_child(context if context is not None
+                                         else {})
                 for ext in self.extensions.values():
                     if hasattr(ext, 'context'):
                         context = ext.context(request, context) or context
@@ -567,14 +652,33 @@ class Application(ConsoleParser, Extension, EventMixin):
                 request.cache._in_application_context = False
         return context
 
+    def static_context(self):
+        '''The template context shared by all requests
+
+        A :class:`~collections.ChainMap` of the :attr:`cms` context, the
+        contributions from the ``static_context(app)`` method of
+        :setting:`EXTENSIONS` and the :attr:`config` dictionary.
+        Built the first time it is accessed.
+        '''
+        if self._static_context is None:
+            static = {}
+            for ext in self.extensions.values():
+                if hasattr(ext, 'static_context'):
+                    static.update(ext.static_context(self) or ())
+            context = ChainMap(static, self.config)
+            if self.cms:
+                # CMS partials do not depend on the request
+                context = context.new_child(self.cms.context(context) or {})
+            self._static_context = context
+        return self._static_context
+
     def render_template(self, name, context=None, request=None, engine=None):
         '''Render a template file ``name`` with ``context``
         '''
         if request:  # get application context only when request available
             context = self.context(request, context)
-        template = self.template(name)
-        rnd = self.template_engine(engine)
-        return rnd(template, context)
+        template = self.compiled_template(name, engine)
+        return template(context) if template else ''
 
     def template_engine(self, engine=None):
         engine = engine or self.config['DEFAULT_TEMPLATE_ENGINE']
@@ -681,7 +785,45 @@ class Application(ConsoleParser, Extension, EventMixin):
             pubsub = self._pubsub_store.pubsub()
         return pubsub
 
+    def stream(self, iterable):
+        '''Stream the chunks of a blocking ``iterable`` as response content
+
+        Each chunk is produced in the :attr:`green_pool` or, when
+        :setting:`THREAD_POOL` is on, in the event loop executor and
+        yielded as a :class:`~asyncio.Future` so that the event loop is
+        never blocked while the WSGI server writes the response.
+        Without a pool the ``iterable`` is iterated directly.
+        '''
+        iterator = iter(iterable)
+        if self.green_pool:
+            submit = self.green_pool.submit
+        elif self.config['THREAD_POOL']:
+            submit = partial(get_event_loop().run_in_executor, None)
+        else:
+            yield from iterator
+            return
+        done = False
+        try:
+            while not done:
+                future = submit(next, iterator, None)
+                yield future
+                chunk = future.result()
+                done = chunk is None
+        finally:
+            close = getattr(iterator, 'close', None)
+            if not done and close:
+                submit(close)
+
     # INTERNALS
+    def _find_template(self, name):
+        for ext in reversed(tuple(self.extensions.values())):
+            filename = ext.get_template_full_path(self, name)
+            if os.path.exists(filename):
+                return filename
+        filename = os.path.join(LUX_CORE, 'templates', name)
+        if os.path.exists(filename):
+            return filename
+
     def _build_config(self, module_name):
         # Check if an extension module is available
         module = import_module(module_name)
@@ -1,23 +1,36 @@
 import json
+import time
+import uuid
+import zlib
+import pickle
 import logging
 import threading
 from copy import copy
 from inspect import isfunction
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 from pulsar.apps.data import parse_store_url, create_store
 from pulsar.utils.importer import module_attribute
 from pulsar.utils.string import to_string
+from pulsar.utils.structures import mapping_iterator
 from pulsar import ImproperlyConfigured
 
 from .wrappers import WsgiRequest
 
 
-__all__ = ['cached', 'Cacheable', 'Cache', 'register_cache']
+__all__ = ['cached', 'Cacheable', 'Cache', 'LocalCache', 'LockError',
+           'Serializer', 'CacheMetrics', 'register_cache',
+           'register_serializer']
 
 
 logger = logging.getLogger('lux.cache')
 
 data_caches = {}
+serializers = {}
+COMPRESSED = b'\x00zlib:'
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1)
 
 
 def cached(*args, **kw):
@@ -36,6 +49,7 @@ class Cache:
     def __init__(self, app, name, url):
         self.app = app
         self.name = name
+        self.metrics = CacheMetrics()
 
     def ping(self):
         return True
@@ -56,31 +70,149 @@ class Cache:
     def hmget(self, key, *fields):
         pass
 
-    def set_json(self, key, value, timeout=None):
-        value = json.dumps(value)
+    def get_many(self, keys):
+        '''Return a list of values, one for each key in ``keys``.
+
+        Backends should override this method to fetch all keys in one
+        round trip
+        '''
+        return [self.get(key) for key in keys]
+
+    def set_many(self, mapping, timeout=None):
+        '''Set several key-value pairs with the same ``timeout``
+        '''
+        for key, value in mapping_iterator(mapping):
+            self.set(key, value, timeout=timeout)
+
+    def delete_many(self, keys):
+        '''Delete several keys, return the number of keys deleted
+        '''
+        return sum((self.delete(key) or 0 for key in keys))
+
+    def incr(self, key):
+        '''Increment the integer at ``key`` by one and return its value.
+
+        Backends should override this method with an atomic operation
+        '''
+        value = int(self.get(key) or 0) + 1
+        self.set(key, value)
+        return value
+
+    def tag_key(self, tag):
+        '''The key storing the version of ``tag``
+        '''
+        return ('%s:tag:%s' % (self.app.config['APP_NAME'], tag)).lower()
+
+    def tag_versions(self, tags):
+        '''Return a list with the current version of each tag in ``tags``
+        '''
+        if not tags:
+            return []
+        keys = [self.tag_key(tag) for tag in tags]
+        versions = self.get_many(keys)
+        missing = {}
+        for index, version in enumerate(versions):
+            if version is None:
+                version = new_tag_version()
+                missing[keys[index]] = version
+            versions[index] = to_string(version)
+        if missing:
+            self.set_many(missing)
+        return versions
+
+    def tagged_key(self, key, tags):
+        '''Append the current versions of ``tags`` to ``key``
+        '''
+        if not tags:
+            return key
+        return '%s:%s' % (key, '.'.join(self.tag_versions(tags)))
+
+    def invalidate_tags(self, *tags):
+        '''Invalidate all values stored with any of the ``tags``.
+
+        This operation increments the version of each tag, keys built with
+        the previous versions are no longer accessed and expire naturally.
+        A tag key lost by the cache server is given a new time based
+        version rather than restarting from 1, which may be a version
+        of values still stored.
+        '''
+        keys = [self.tag_key(tag) for tag in tags]
+        for key, version in zip(keys, self.get_many(keys)):
+            if version is None or self.incr(key) == 1:
+                self.set(key, new_tag_version())
+
+    def set_data(self, key, value, timeout=None, serializer=None):
+        '''Serialise ``value`` and store it at ``key``.
+
+        :param serializer: name of a registered :class:`.Serializer`, if not
+            given the :setting:`CACHE_SERIALIZER` is used
+        :return: the length of the stored payload
+        '''
+        value = self.serializer(serializer).dumps(value)
+        min_length = self.app.config['CACHE_COMPRESS_MIN_LENGTH']
+        if min_length and len(value) > min_length:
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            value = COMPRESSED + zlib.compress(value)
         self.set(key, value, timeout=timeout)
+        return len(value)
 
-    def get_json(self, key):
+    def get_data(self, key, serializer=None):
+        '''Retrieve the value at ``key`` and unserialise it
+        '''
         value = self.get(key)
         if value is not None:
             try:
-                return json.loads(to_string(value))
+                if (isinstance(value, bytes) and
+                        value.startswith(COMPRESSED)):
+                    value = zlib.decompress(value[len(COMPRESSED):])
+                return self.serializer(serializer).loads(value)
             except Exception:
-                self.app.logger.warning('Could not convert to JSON: %s',
-                                        value)
+                self.app.logger.warning('Could not unserialise: %s', value)
+
+    def set_json(self, key, value, timeout=None):
+        self.set_data(key, value, timeout=timeout, serializer='json')
+
+    def get_json(self, key):
+        return self.get_data(key, serializer='json')
+
+    def serializer(self, name=None):
+        '''Return the :class:`.Serializer` for ``name``
+        '''
+        return get_serializer(name or self.app.config['CACHE_SERIALIZER'])
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        '''Return a named lock.
 
-    def lock(self, name, timeout=None):
+        :param timeout: the lock is released automatically after
+            ``timeout`` seconds
+        :param blocking_timeout: maximum time in seconds to wait when
+            acquiring the lock
+        '''
         raise NotImplementedError
 
+    def sleep(self, seconds):
+        '''Sleep while waiting for a lock, yield to the green pool
+        if available
+        '''
+        if self.app.green_pool:
+            from pulsar.apps.greenio import wait
+            from asyncio import sleep
+            wait(sleep(seconds))
+        else:
+            time.sleep(seconds)
+
 
 class DummyCache(Cache):
 
     def __init__(self, app, name, url):
         super().__init__(app, name, url)
-        self._lock = threading.Lock()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
 
-    def lock(self, name, timeout=None):
-        return self._lock
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return MemoryLock(self, name, timeout=timeout,
+                          blocking_timeout=blocking_timeout)
 
 
 class RedisCache(Cache):
@@ -105,17 +237,636 @@ class RedisCache(Cache):
         return self._wait(self.client.delete(key))
 
     def hmset(self, key, iterable, timeout=None):
-        self._wait(self.client.hmset(key, iterable, timeout))
+        if timeout is None:
+            self._wait(self.client.hmset(key, iterable))
+        else:
+            pipe = self.client.pipeline()
+            pipe.hmset(key, iterable)
+            pipe.expire(key, timeout)
+            self._execute(pipe)
 
     def hmget(self, key, *fields):
-        return self._wait(self.client.hmset(key, *fields))
+        return self._wait(self.client.hmget(key, *fields))
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        return self._wait(self.client.mget(*keys))
 
-    def lock(self, name, **kwargs):
-        return self.client.lock(name, **kwargs)
+    def set_many(self, mapping, timeout=None):
+        mapping = dict(mapping_iterator(mapping))
+        if not mapping:
+            return
+        if timeout is None:
+            self._wait(self.client.mset(mapping))
+        else:
+            pipe = self.client.pipeline()
+            for key, value in mapping.items():
+                pipe.set(key, value, timeout)
+            self._execute(pipe)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return 0
+        return self._wait(self.client.delete(*keys))
+
+    def incr(self, key):
+        return self._wait(self.client.incr(key))
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        if self.app.green_pool:
+            return GreenLock(self, name, timeout=timeout,
+                             blocking_timeout=blocking_timeout)
+        return self.client.lock(name, timeout=timeout,
+                                blocking_timeout=blocking_timeout)
 
     def _wait(self, value):
         return value
 
+    def _execute(self, pipe):
+        if self.app.green_pool:
+            return self._wait(pipe.commit())
+        return pipe.execute()
+
+
+class GreenLock:
+    '''Wraps the asynchronous pulsar redis lock so that it can be used
+    from a greenlet
+    '''
+    def __init__(self, cache, name, timeout=None, blocking_timeout=None):
+        self.cache = cache
+        self.name = name
+        self.timeout = timeout
+        self.blocking_timeout = blocking_timeout
+        self._lock = None
+
+    def __enter__(self):
+        if self.acquire():
+            return self
+        raise LockError('Could not acquire lock "%s"' % self.name)
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self, blocking=True):
+        if blocking and self.blocking_timeout is not None:
+            blocking = self.blocking_timeout
+        self._lock = self.cache.client.lock(self.name, timeout=self.timeout,
+                                            blocking=blocking)
+        return self.cache._wait(self._lock.acquire())
+
+    def release(self):
+        lock, self._lock = self._lock, None
+        if lock is None:
+            raise LockError('Cannot release an unlocked lock')
+        self.cache._wait(lock.release())
+
+
+class LocalCache:
+    '''A bounded, thread-safe, in-process LRU dictionary with
+    per-key expiry.
+
+    Used as the first tier of the :class:`.LocalRedisCache` and as the
+    storage of the :class:`.MemoryCache`.
+
+    :param max_entries: maximum number of keys to keep. When exceeded the
+        least recently used key is evicted.
+    :param timeout: default time to live in seconds of a key, ``None``
+        for no expiry.
+    :param max_bytes: optional maximum size of all values, as given by
+        the ``size`` parameter in the :meth:`set` method. When exceeded
+        least recently used keys are evicted.
+    '''
+    def __init__(self, max_entries=1000, timeout=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        '''Return a two-elements tuple ``(found, value)``
+        '''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expiry, value, _ = entry
+                if expiry is None or expiry > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                self._pop(key)
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, timeout=None, size=0):
+        if timeout is None:
+            timeout = self.timeout
+        elif self.timeout is not None:
+            timeout = min(timeout, self.timeout)
+        expiry = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expiry, value, size)
+            self.bytes += size
+            while (len(self._data) > self.max_entries or
+                   (self.max_bytes and self.bytes > self.max_bytes)):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        '''Dictionary of hit/miss counters
+        '''
+        return {'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+            return True
+        return False
+
+
+class LocalRedisCache(RedisCache):
+    '''Two-tier cache: a :class:`.LocalCache` of decoded values in
+    front of a :class:`.RedisCache`.
+
+    Configured via the ``local+redis`` scheme, for example::
+
+        CACHE_SERVER = 'local+redis://127.0.0.1:6379/3?max_entries=5000'
+
+    Additional url parameters:
+
+    * ``max_entries`` maximum number of keys in the local tier (1000)
+    * ``local_timeout`` maximum time to live in seconds of a key in the
+      local tier (30)
+    * ``channel`` the redis pub/sub channel used for invalidating local
+      tiers across workers (``<APP_NAME>:cache``)
+
+    Only :meth:`get_data` and :meth:`get_json` are served from the local
+    tier. Values are shared between callers and must be treated as
+    read-only.
+    '''
+    local_params = ('max_entries', 'local_timeout', 'channel')
+
+    def __init__(self, app, name, url):
+        url, params = url_params(url, self.local_params)
+        super().__init__(app, name, url)
+        self.local = LocalCache(int(params.get('max_entries', 1000)),
+                                float(params.get('local_timeout', 30)))
+        self.channel = params.get('channel',
+                                  '%s:cache' % app.config['APP_NAME'])
+        self.origin = uuid.uuid4().hex
+        self._subscribe()
+
+    def set(self, key, value, timeout=None):
+        self.local.delete(key)
+        super().set(key, value, timeout)
+        self._invalidate(key)
+
+    def delete(self, key):
+        self.local.delete(key)
+        result = super().delete(key)
+        self._invalidate(key)
+        return result
+
+    def hmset(self, key, iterable, timeout=None):
+        self.local.delete(key)
+        super().hmset(key, iterable, timeout)
+        self._invalidate(key)
+
+    def set_many(self, mapping, timeout=None):
+        mapping = dict(mapping_iterator(mapping))
+        for key in mapping:
+            self.local.delete(key)
+        super().set_many(mapping, timeout)
+        if mapping:
+            self._invalidate(*mapping)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        for key in keys:
+            self.local.delete(key)
+        result = super().delete_many(keys)
+        if keys:
+            self._invalidate(*keys)
+        return result
+
+    def set_data(self, key, value, timeout=None, serializer=None):
+        size = super().set_data(key, value, timeout=timeout,
+                                serializer=serializer)
+        self.local.set(key, value, timeout)
+        return size
+
+    def get_data(self, key, serializer=None):
+        found, value = self.local.get(key)
+        if not found:
+            value = super().get_data(key, serializer=serializer)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def stats(self):
+        return self.local.stats()
+
+    def on_message(self, message):
+        '''Invalidation message from another worker
+        '''
+        try:
+            data = json.loads(to_string(message))
+            if data['origin'] != self.origin:
+                for key in data['keys']:
+                    self.local.delete(key)
+        except Exception:
+            logger.exception('Could not handle cache invalidation message')
+            self.local.clear()
+
+    def _invalidate(self, *keys):
+        message = json.dumps({'origin': self.origin, 'keys': keys})
+        self._wait(self.client.publish(self.channel, message))
+
+    def _subscribe(self):
+        if self.app.green_pool:
+            self.pubsub = self.client.store.pubsub()
+            self.pubsub.add_client(self._green_message)
+            self._wait(self.pubsub.subscribe(self.channel))
+        else:
+            self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(**{self.channel: self._sync_message})
+            self.listener = self.pubsub.run_in_thread(sleep_time=0.1)
+
+    def _green_message(self, channel, message):
+        self.on_message(message)
+
+    def _sync_message(self, message):
+        self.on_message(message['data'])
+
+
+class MemoryCache(Cache):
+    '''A cache living in the memory of the current process.
+
+    Configured via the ``memory`` scheme, for example::
+
+        CACHE_SERVER = 'memory://?max_entries=10000&max_bytes=67108864'
+
+    Values are stored as bytes, as a redis server would do, and keys
+    are evicted in least recently used order when either ``max_entries``
+    (10000 by default) or ``max_bytes`` (no limit by default) is exceeded.
+    The cache is not shared across processes.
+    '''
+    def __init__(self, app, name, url):
+        super().__init__(app, name, url)
+        _, params = url_params(url, ('max_entries', 'max_bytes'))
+        max_bytes = params.get('max_bytes')
+        max_bytes = int(max_bytes) if max_bytes else None
+        self.store = LocalCache(int(params.get('max_entries', 10000)),
+                                max_bytes=max_bytes)
+        self.encoding = app.config['ENCODING']
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def set(self, key, value, timeout=None):
+        value = self._to_bytes(value)
+        self.store.set(key, value, timeout, len(value))
+
+    def get(self, key):
+        return self.store.get(key)[1]
+
+    def delete(self, key):
+        return int(self.store.delete(key))
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self.get(key) or 0) + 1
+            self.set(key, value)
+        return value
+
+    def hmset(self, key, iterable, timeout=None):
+        fields = [(field, self._to_bytes(value))
+                  for field, value in mapping_iterator(iterable)]
+        with self._lock:
+            found, hash = self.store.get(key)
+            hash = dict(hash) if found and isinstance(hash, dict) else {}
+            hash.update(fields)
+            size = sum((len(f) + len(v) for f, v in hash.items()))
+            self.store.set(key, hash, timeout, size)
+
+    def hmget(self, key, *fields):
+        found, hash = self.store.get(key)
+        if found and isinstance(hash, dict):
+            if fields:
+                return [hash.get(f) for f in fields]
+            return hash.copy()
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return MemoryLock(self, name, timeout=timeout,
+                          blocking_timeout=blocking_timeout)
+
+    def stats(self):
+        return self.store.stats()
+
+    def _to_bytes(self, value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode(self.encoding)
+
+
+class MemoryLock:
+    '''A named lock for the :class:`.MemoryCache` and :class:`.DummyCache`.
+
+    Mimics the redis lock: the lock is released automatically after
+    ``timeout`` seconds and :meth:`acquire` gives up after
+    ``blocking_timeout`` seconds. It can be used as a context manager.
+    '''
+    sleep = 0.01
+
+    def __init__(self, cache, name, timeout=None, blocking_timeout=None):
+        self.cache = cache
+        self.name = name
+        self.timeout = timeout
+        self.blocking_timeout = blocking_timeout
+        self.token = None
+
+    def __enter__(self):
+        if self.acquire():
+            return self
+        raise LockError('Could not acquire lock "%s"' % self.name)
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self, blocking=True, blocking_timeout=None):
+        token = uuid.uuid4().hex
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        stop = None
+        if blocking_timeout is not None:
+            stop = time.monotonic() + blocking_timeout
+        while True:
+            if self._acquire(token):
+                self.token = token
+                return True
+            if not blocking or (stop is not None and
+                                time.monotonic() > stop):
+                return False
+            self.cache.sleep(self.sleep)
+
+    def release(self):
+        token, self.token = self.token, None
+        if token is None:
+            raise LockError('Cannot release an unlocked lock')
+        with self.cache._locks_lock:
+            current = self.cache._locks.get(self.name)
+            if current and current[0] == token:
+                self.cache._locks.pop(self.name)
+
+    def locked(self):
+        with self.cache._locks_lock:
+            return self._held_by() is not None
+
+    def _acquire(self, token):
+        with self.cache._locks_lock:
+            if self._held_by() is None:
+                expiry = None
+                if self.timeout is not None:
+                    expiry = time.monotonic() + self.timeout
+                self.cache._locks[self.name] = (token, expiry)
+                return True
+        return False
+
+    def _held_by(self):
+        current = self.cache._locks.get(self.name)
+        if current:
+            token, expiry = current
+            if expiry is None or expiry > time.monotonic():
+                return token
+            self.cache._locks.pop(self.name)
+
+
+class LockError(RuntimeError):
+    '''Raised when a cache lock cannot be acquired or released
+    '''
+
+
+class CacheMetrics:
+    '''Thread-safe counters, latency histograms and payload sizes of
+    ``@cached`` calls grouped by key family.
+
+    The family of a key is the ``<APP_NAME>:<Class>:<method>`` prefix of
+    the keys built by :class:`.CacheObject`.
+    '''
+    counters = ('hits', 'misses', 'stale', 'sets')
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or LATENCY_BUCKETS)
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def count(self, family, counter):
+        '''Increase by one the ``counter`` of ``family``
+        '''
+        with self._lock:
+            self._family(family)[counter] += 1
+
+    def error(self, family, operation):
+        '''Count a backend error during ``operation`` (get or set)
+        '''
+        with self._lock:
+            self._family(family)['errors'][operation] += 1
+
+    def observe(self, family, operation, latency, size=None):
+        '''Record the ``latency`` in seconds of a backend ``operation``
+        and optionally the ``size`` of the payload
+        '''
+        with self._lock:
+            data = self._family(family)
+            histogram = data['latency'][operation]
+            for index, bound in enumerate(self.buckets):
+                if latency <= bound:
+                    histogram['buckets'][index] += 1
+                    break
+            else:
+                histogram['buckets'][-1] += 1
+            histogram['sum'] += latency
+            histogram['count'] += 1
+            if size is not None:
+                data['bytes'] += size
+                data['max_bytes'] = max(data['max_bytes'], size)
+
+    def reset(self):
+        with self._lock:
+            self._families.clear()
+
+    def as_dict(self):
+        '''A JSON serializable copy of all metrics
+        '''
+        bounds = [str(b) for b in self.buckets] + ['+Inf']
+        result = {}
+        with self._lock:
+            for name, data in self._families.items():
+                data = data.copy()
+                data['errors'] = data['errors'].copy()
+                data['latency'] = dict(((op, {'sum': h['sum'],
+                                              'count': h['count'],
+                                              'buckets': list(zip(
+                                                  bounds, h['buckets']))})
+                                        for op, h in data['latency'].items()))
+                result[name] = data
+        return result
+
+    def prometheus(self, prefix='lux_cache'):
+        '''Metrics in the Prometheus text exposition format
+        '''
+        lines = []
+        families = self.as_dict()
+        for counter in self.counters:
+            name = '%s_%s_total' % (prefix, counter)
+            lines.append('# TYPE %s counter' % name)
+            for family, data in sorted(families.items()):
+                lines.append('%s{family="%s"} %s' % (name, family,
+                                                     data[counter]))
+        name = '%s_errors_total' % prefix
+        lines.append('# TYPE %s counter' % name)
+        for family, data in sorted(families.items()):
+            for op, value in sorted(data['errors'].items()):
+                lines.append('%s{family="%s",operation="%s"} %s' %
+                             (name, family, op, value))
+        name = '%s_payload_bytes' % prefix
+        lines.append('# TYPE %s summary' % name)
+        for family, data in sorted(families.items()):
+            lines.append('%s_sum{family="%s"} %s' % (name, family,
+                                                     data['bytes']))
+            lines.append('%s_count{family="%s"} %s' % (name, family,
+                                                       data['sets']))
+        name = '%s_latency_seconds' % prefix
+        lines.append('# TYPE %s histogram' % name)
+        for family, data in sorted(families.items()):
+            for op, histogram in sorted(data['latency'].items()):
+                labels = 'family="%s",operation="%s"' % (family, op)
+                total = 0
+                for bound, value in histogram['buckets']:
+                    total += value
+                    lines.append('%s_bucket{%s,le="%s"} %s' %
+                                 (name, labels, bound, total))
+                lines.append('%s_sum{%s} %s' % (name, labels,
+                                                histogram['sum']))
+                lines.append('%s_count{%s} %s' % (name, labels,
+                                                  histogram['count']))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def _family(self, family):
+        data = self._families.get(family)
+        if data is None:
+            size = len(self.buckets) + 1
+            data = dict(((c, 0) for c in self.counters))
+            data['bytes'] = 0
+            data['max_bytes'] = 0
+            data['errors'] = {'get': 0, 'set': 0}
+            data['latency'] = dict(((op, {'buckets': [0]*size,
+                                          'sum': 0,
+                                          'count': 0})
+                                    for op in ('get', 'set')))
+            self._families[family] = data
+        return data
+
+
+class Serializer:
+    '''Convert values to and from the bytes or string stored in a
+    :class:`.Cache`
+    '''
+    def dumps(self, value):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class JsonSerializer(Serializer):
+
+    def dumps(self, value):
+        return json.dumps(value)
+
+    def loads(self, data):
+        return json.loads(to_string(data))
+
+
+class PickleSerializer(Serializer):
+    '''Any picklable python object. Only use it with trusted cache
+    servers'''
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class MsgPackSerializer(Serializer):
+    '''Compact binary serializer, requires msgpack-python_.
+
+    .. _msgpack-python: https://pypi.python.org/pypi/msgpack-python
+    '''
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImproperlyConfigured('msgpack serializer requires the '
+                                       'msgpack-python package')
+        self.msgpack = msgpack
+
+    def dumps(self, value):
+        return self.msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, raw=False)
+
+
+class BytesSerializer(Serializer):
+    '''Store bytes or strings as they are, return bytes
+    '''
+    def dumps(self, value):
+        if not isinstance(value, (bytes, str)):
+            raise TypeError('bytes or string required, got %s' %
+                            type(value).__name__)
+        return value
+
+    def loads(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return data
+
+
+class TextSerializer(BytesSerializer):
+    '''Store bytes or strings as they are, return strings
+    '''
+    def loads(self, data):
+        return to_string(data)
+
 
 class Cacheable:
     '''An class which can create its how cache key
@@ -123,18 +874,43 @@ class Cacheable:
     def cache_key(self, app):
         return ''
 
+    def cache_tags(self, app):
+        '''Additional tags for values cached by methods of this object
+        '''
+        return ()
+
 
 class CacheObject:
     '''Object which implement cache functionality on callables.
 
     A callable can be either a method or a function
+
+    :param user: include the request user in the cache key
+    :param timeout: timeout in seconds or the name of a config parameter
+        holding the timeout. If not available the
+        :setting:`DEFAULT_CACHE_TIMEOUT` is used
+    :param lock: when ``True`` only one worker at a time recomputes an
+        expired value, the other workers wait for it (for a maximum of
+        :setting:`CACHE_LOCK_TIMEOUT` seconds)
+    :param stale_while_revalidate: number of seconds an expired value is
+        still served while a worker is recomputing it. Requires ``lock``
+        and a serializer supporting dictionaries.
+    :param serializer: name of the :class:`.Serializer` used for storing
+        the value, if not given the :setting:`CACHE_SERIALIZER` is used
+    :param tags: optional list of tags for the cached value. All values with
+        a given tag can be invalidated via :meth:`.Cache.invalidate_tags`
     '''
     instance = None
     callable = None
 
-    def __init__(self, user=False, timeout=None):
+    def __init__(self, user=False, timeout=None, lock=False,
+                 stale_while_revalidate=None, serializer=None, tags=None):
         self.user = user
         self.timeout = timeout
+        self.lock = lock
+        self.stale_while_revalidate = stale_while_revalidate
+        self.serializer = serializer
+        self.tags = tuple(tags or ())
 
     def cache_key(self, app):
         key = ''
@@ -147,13 +923,24 @@ class CacheObject:
             if self.user:
                 key = '%s:%s' % (key, app.cache.user)
 
+        base = self.family(app)
+        key = '%s:%s' % (base, key.lower()) if key else base
+        return key
+
+    def family(self, app):
+        '''The key family, ``<APP_NAME>:<Class>:<method>``, used as prefix
+        of keys and for grouping :class:`.CacheMetrics`
+        '''
         base = self.callable.__name__
         if self.instance:
             base = '%s:%s' % (type(self.instance).__name__, base)
+        return ('%s:%s' % (app.config['APP_NAME'], base)).lower()
 
-        base = '%s:%s' % (app.config['APP_NAME'], base)
-        key = '%s:%s' % (base, key) if key else base
-        return key.lower()
+    def cache_tags(self, app):
+        tags = self.tags
+        if isinstance(self.instance, Cacheable):
+            tags = tags + tuple(self.instance.cache_tags(app.app))
+        return tags
 
     def __call__(self, callable, *args, **kw):
         if self.callable is None:
@@ -178,31 +965,26 @@ class CacheObject:
         if self.instance:
             args = (self.instance,) + args
 
-        if app:
-            key = self.cache_key(app)
-            result = app.cache_server.get_json(key)
-            if result is not None:
-                return result
+        if not app:
+            return self.callable(*args, **kw)
 
-        result = self.callable(*args, **kw)
+        key = self.cache_key(app)
+        tags = self.cache_tags(app)
+        if tags:
+            key = app.cache_server.tagged_key(key, tags)
+        if self.lock:
+            return self._locked_call(app, key, args, kw)
 
-        if app:
-            timeout = self.timeout
-            if timeout in app.config:
-                timeout = app.config[timeout]
-            try:
-                int(timeout)
-            except Exception:
-                timeout = app.config['DEFAULT_CACHE_TIMEOUT']
-
-            try:
-                app.cache_server.set_json(key, result, timeout=timeout)
-            except TypeError:
-                app.logger.exception('Could not convert to JSON a value to '
-                                     'set in cache')
-            except Exception:
-                app.logger.exception('Critical exception while setting cache')
+        metrics = app.cache_server.metrics
+        family = self.family(app)
+        result, _ = self._get(app, key, family)
+        if result is not None:
+            metrics.count(family, 'hits')
+            return result
 
+        metrics.count(family, 'misses')
+        result = self.callable(*args, **kw)
+        self._set(app, key, result, family)
         return result
 
     def __get__(self, instance, objtype):
@@ -210,6 +992,132 @@ class CacheObject:
         obj.instance = instance
         return obj
 
+    def _locked_call(self, app, key, args, kw):
+        '''Single-flight call: only the worker holding the lock
+        recomputes the value
+        '''
+        cache = app.cache_server
+        family = self.family(app)
+        result, fresh = self._get(app, key, family)
+        if fresh:
+            cache.metrics.count(family, 'hits')
+            return result
+
+        timeout = app.config['CACHE_LOCK_TIMEOUT']
+        lock = cache.lock('%s:lock' % key, timeout=timeout,
+                          blocking_timeout=timeout)
+        if result is not None:
+            # Stale value available, serve it unless we can revalidate
+            if not lock.acquire(blocking=False):
+                cache.metrics.count(family, 'stale')
+                return result
+        elif lock.acquire():
+            # Another worker may have set the value while we were waiting
+            result, fresh = self._get(app, key, family)
+            if fresh:
+                self._release(app, lock)
+                cache.metrics.count(family, 'hits')
+                return result
+        else:
+            app.logger.warning('Could not acquire cache lock for "%s"', key)
+            lock = None
+
+        cache.metrics.count(family, 'misses')
+        try:
+            result = self.callable(*args, **kw)
+            self._set(app, key, result, family)
+        finally:
+            if lock:
+                self._release(app, lock)
+        return result
+
+    def _get(self, app, key, family):
+        '''Return a two-elements tuple ``(value, fresh)``
+        '''
+        cache = app.cache_server
+        start = time.monotonic()
+        try:
+            value = cache.get_data(key, serializer=self.serializer)
+        except Exception:
+            cache.metrics.error(family, 'get')
+            raise
+        cache.metrics.observe(family, 'get', time.monotonic() - start)
+        if value is not None and self._stale_timeout():
+            try:
+                value, stale = value['value'], value['stale']
+            except Exception:
+                return None, False
+            return value, stale > time.time()
+        return value, value is not None
+
+    def _set(self, app, key, result, family):
+        timeout = self.timeout
+        if timeout in app.config:
+            timeout = app.config[timeout]
+        try:
+            timeout = int(timeout)
+        except Exception:
+            timeout = app.config['DEFAULT_CACHE_TIMEOUT']
+
+        stale_timeout = self._stale_timeout()
+        if stale_timeout:
+            result = {'value': result, 'stale': time.time() + timeout}
+            timeout += stale_timeout
+
+        cache = app.cache_server
+        start = time.monotonic()
+        try:
+            size = cache.set_data(key, result, timeout=timeout,
+                                  serializer=self.serializer)
+        except (TypeError, ValueError, pickle.PicklingError):
+            cache.metrics.error(family, 'set')
+            app.logger.exception('Could not serialise a value to '
+                                 'set in cache')
+        except Exception:
+            cache.metrics.error(family, 'set')
+            app.logger.exception('Critical exception while setting cache')
+        else:
+            cache.metrics.count(family, 'sets')
+            cache.metrics.observe(family, 'set', time.monotonic() - start,
+                                  size)
+
+    def _stale_timeout(self):
+        if self.lock and self.stale_while_revalidate:
+            return int(self.stale_while_revalidate)
+
+    def _release(self, app, lock):
+        try:
+            lock.release()
+        except Exception:
+            app.logger.warning('Could not release cache lock', exc_info=True)
+
+
+def new_tag_version():
+    '''A time based version for tags without a stored version, so that a
+    tag key lost by the cache server cannot revive values of a previous
+    version
+    '''
+    return int(time.time()*1000000)
+
+
+def url_params(url, names):
+    '''Remove query parameters in ``names`` from ``url``.
+
+    Return a two-elements tuple containing the new url, without the
+    ``xxx+`` prefix in the scheme, and a dictionary of removed parameters.
+    '''
+    bits = urlsplit(url)
+    query, params = [], {}
+    for key, value in parse_qsl(bits.query):
+        if key in names:
+            params[key] = value
+        else:
+            query.append((key, value))
+    scheme = bits.scheme.split('+', 1)[-1]
+    url = urlunsplit((scheme, bits.netloc, bits.path, urlencode(query),
+                      bits.fragment))
+    return url, params
+
 
 def create_cache(app, url):
     if isinstance(url, Cache):
@@ -231,5 +1139,29 @@ def register_cache(name, dotted_path):
     data_caches[name] = dotted_path
 
 
+def get_serializer(name):
+    serializer = serializers.get(name)
+    if serializer is None:
+        raise ImproperlyConfigured('%s serializer not available' % name)
+    if not isinstance(serializer, Serializer):
+        serializer = module_attribute(serializer)()
+        serializers[name] = serializer
+    return serializer
+
+
+def register_serializer(name, dotted_path):
+    '''Register a new :class:`.Serializer` with ``name`` which
+    can be found at the python ``dotted_path``.
+    '''
+    serializers[name] = dotted_path
+
+
 register_cache('dummy', 'lux.core.cache.DummyCache')
 register_cache('redis', 'lux.core.cache.RedisCache')
+register_cache('local+redis', 'lux.core.cache.LocalRedisCache')
+register_cache('memory', 'lux.core.cache.MemoryCache')
+register_serializer('json', 'lux.core.cache.JsonSerializer')
+register_serializer('pickle', 'lux.core.cache.PickleSerializer')
+register_serializer('msgpack', 'lux.core.cache.MsgPackSerializer')
+register_serializer('bytes', 'lux.core.cache.BytesSerializer')
+register_serializer('text', 'lux.core.cache.TextSerializer')
@@ -2,10 +2,10 @@ from pulsar.apps.wsgi import Route, Html
 from pulsar.utils.structures import AttributeDictionary
 
 from .content import static_context
-from .cache import cached
+from .cache import cached, LocalCache
 
 
-__all__ = ['CMS']
+__all__ = ['CMS', 'RouteIndex']
 
 
 class Page(AttributeDictionary):
@@ -17,6 +17,73 @@ class Page(AttributeDictionary):
     '''
 
 
+class RouteIndex:
+    '''A compiled index of the pages in a sitemap.
+
+    Pages with a static path (without variables) are stored in a
+    dictionary keyed by path, the remaining pages are grouped by
+    the first segment of their path. Routes are compiled once and
+    matched paths are memoized in a bounded :class:`.LocalCache`.
+
+    Matching returns the same page as a linear scan of the sitemap, that
+    is, the first page in the sitemap which matches the path.
+    '''
+    def __init__(self, sitemap, max_entries=10000, routes=None):
+        self.sitemap = sitemap
+        self.static = {}
+        self.dynamic = {}
+        self.wildcard = []
+        self.routes = []
+        self.matched = LocalCache(max_entries)
+        routes = routes if routes is not None else {}
+        for position, page in enumerate(sitemap):
+            path = page['path']
+            route = routes.get(path)
+            if route is None:
+                route = routes[path] = Route(path)
+            entry = (position, route, page)
+            self.routes.append(entry)
+            if not route.variables:
+                self.static.setdefault(route.rule, entry)
+                continue
+            segment = route.rule.split('/', 1)[0]
+            if '<' in segment:
+                self.wildcard.append(entry)
+            else:
+                self.dynamic.setdefault(segment, []).append(entry)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def match(self, path):
+        if isinstance(path, Route):
+            for _, route, page in self.routes:
+                if path == route:
+                    return page
+            return
+        found, page = self.matched.get(path)
+        if not found:
+            page = self._match(path)
+            self.matched.set(path, page)
+        return page
+
+    def _match(self, path):
+        static = self.static.get(path)
+        position = static[0] if static else len(self.routes)
+        candidates = self.dynamic.get(path.split('/', 1)[0], ())
+        if self.wildcard:
+            candidates = sorted(self.wildcard + list(candidates),
+                                key=lambda entry: entry[0])
+        for index, route, page in candidates:
+            if index > position:
+                break
+            matched = route.match(path)
+            if matched is not None and '__remaining__' not in matched:
+                return page
+        if static:
+            return static[2]
+
+
 class CMS:
     '''Lux CMS base class.
 
@@ -54,26 +121,48 @@ class CMS:
             html = html.render(request)
         return html
 
-    def match(self, path, sitemap=None):
+    def match(self, path, sitemap=None, version=None):
         '''Match a path with a page form ``sitemap``
 
         If no sitemap is given, use the default sitemap
-        form the :meth:`site_map` method.
+        form the :meth:`versioned_site_map` method.
 
         If no page is matched returns Nothing.
         '''
         if sitemap is None:
-            sitemap = self.site_map(self.app)
+            version, sitemap = self.versioned_site_map(self.app)
+        return self.route_index(sitemap, version).match(path)
 
-        for page in sitemap:
-            route = Route(page['path'])
-            if isinstance(path, Route):
-                if path == route:
-                    return page
-            else:
-                matched = route.match(path)
-                if matched is not None and '__remaining__' not in matched:
-                    return page
+    def route_index(self, sitemap, version=None):
+        '''The :class:`.RouteIndex` for ``sitemap``
+
+        Indexes are kept at application level, for each CMS :attr:`key`,
+        and are keyed by the sitemap ``version``, so that a sitemap
+        loaded again from a cache or a database reuses its index.
+        Without a ``version`` the index is reused only for the same
+        ``sitemap`` object. Compiled routes are shared between indexes.
+        '''
+        indexes = self.app._cms_indexes.get(self.key)
+        if indexes is None:
+            indexes = self.app._cms_indexes.setdefault(self.key,
+                                                       LocalCache(8))
+        key = version if version is not None else id(sitemap)
+        found, index = indexes.get(key)
+        if not found or (version is None and index.sitemap is not sitemap):
+            index = RouteIndex(sitemap, routes=self.app._cms_routes)
+            indexes.set(key, index)
+        return index
+
+    def versioned_site_map(self, app):
+        '''Return a two-elements tuple ``(version, sitemap)``.
+
+        The ``version`` identifies the content of the sitemap, it must
+        change when the sitemap changes. Sitemaps from the
+        :setting:`HTML_TEMPLATES` setting never change.
+        '''
+        if type(self).site_map is CMS.site_map:
+            return 'templates', self.site_map(app)
+        return None, self.site_map(app)
 
     def site_map(self, app):
         if self._sitemap is None:
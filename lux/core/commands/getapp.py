@@ -10,7 +10,13 @@ class Command(lux.Command):
         datastores = self.app.config.get('DATASTORE')
         if datastores:
             for k, v in datastores.items():
-                v = v.replace('+green', '')
+                if isinstance(v, dict):
+                    v = dict(v)
+                    v['primary'] = v['primary'].replace('+green', '')
+                    v['replicas'] = [r.replace('+green', '')
+                                     for r in v.get('replicas', ())]
+                else:
+                    v = v.replace('+green', '')
                 datastores[k] = v
         return super().__call__(options, **params)
 
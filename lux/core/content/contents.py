@@ -218,12 +218,11 @@ class Content(Cacheable):
             context = self.context(context)
             content = self._engine(self._content, context)
             if self.template:
-                template = self._app.template_full_path(self.template)
+                template = self._app.compiled_template(self.template,
+                                                       self.template_engine)
                 if template:
                     context[self.key('main')] = content
-                    with open(template, 'r') as file:
-                        template_str = file.read()
-                    content = self._engine(template_str, context)
+                    content = template(context)
             return content
         else:
             return self._content
@@ -2,7 +2,7 @@ from string import Template
 
 from pulsar import ImproperlyConfigured
 
-__all__ = ['register_template_engine', 'template_engine']
+__all__ = ['register_template_engine', 'template_engine', 'compile_template']
 
 default_engine = 'python'
 template_engines = {}
@@ -18,11 +18,52 @@ def template_engine(name=None):
 
 
 def register_template_engine(name, engine):
+    '''Register a template ``engine`` with ``name``.
+
+    An engine is a callable accepting ``text`` and ``context`` and returning
+    the rendered string. Engines can optionally expose a ``compile`` method
+    which accepts ``text`` and returns a callable accepting ``context``.
+    '''
     template_engines[name] = engine
 
 
-def render(text, context):
-    return Template(text).safe_substitute(context) if context else text
+def compile_template(engine, text):
+    '''Compile ``text`` with ``engine``.
+
+    Return a callable accepting the ``context`` dictionary. Engines without
+    a ``compile`` method are called with the ``text`` at every rendering.
+    '''
+    compile = getattr(engine, 'compile', None)
+    if compile:
+        return compile(text)
+    else:
+        return lambda context: engine(text, context)
+
+
+class CompiledTemplate:
+    __slots__ = ('text', 'template')
+
+    def __init__(self, text):
+        self.text = text
+        self.template = Template(text)
+
+    def __call__(self, context):
+        if context:
+            return self.template.safe_substitute(context)
+        return self.text
+
+
+class PythonEngine:
+    '''The default engine, based on :class:`string.Template`
+    '''
+    def __call__(self, text, context):
+        return Template(text).safe_substitute(context) if context else text
+
+    def compile(self, text):
+        return CompiledTemplate(text)
+
+
+render = PythonEngine()
 
 
 register_template_engine(default_engine, render)
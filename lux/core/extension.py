@@ -13,6 +13,7 @@ __all__ = ['Extension', 'Parameter']
 ALL_EVENTS = ('on_config',  # Config ready.
               'on_loaded',  # Wsgi handler ready.
               'on_start',  # Wsgi server starts. Extra args: server
+              'on_stop',  # Worker serving the application stops
               'on_request',  # Fired when a new request arrives
               'on_html_document',  # Html doc built. Extra args: request, html
               'on_form',  # Form constructed. Extra args: form
@@ -12,7 +12,8 @@ from lux import Parameter
 from lux.extensions import rest
 
 from .backends import (TokenBackend, SessionBackend, BrowserBackend,
-                       ApiSessionBackend)
+                       ApiSessionBackend, PERMISSIONS_TAG, revoke_tokens,
+                       user_key)
 from .views import Authorization, ComingSoon
 
 
@@ -26,12 +27,40 @@ class Extension(lux.Extension):
         Parameter('ANONYMOUS_GROUP', 'anonymous',
                   'Name of the group for all anonymous users'),
         Parameter('DEFAULT_PERMISSION_LEVEL', rest.READ,
-                  'Default permission level')
+                  'Default permission level'),
+        Parameter('TOKEN_STATELESS', False,
+                  'Validate tokens without querying the token table. '
+                  'Revoked tokens are stored in the cache server, which '
+                  'cannot be the dummy cache, and the last access of '
+                  'tokens is updated in batches'),
+        Parameter('TOKEN_ACCESS_FLUSH', 10,
+                  'Seconds between batched updates of the last access of '
+                  'tokens when TOKEN_STATELESS is on'),
+        Parameter('USER_CACHE_TIMEOUT', 30,
+                  'Seconds a snapshot of a user fetched by id is kept in the '
+                  'cache server. Set to 0 to disable the user cache')
     ]
 
     def on_config(self, app):
         app.require('lux.extensions.odm')
 
+    def on_after_commit(self, app, session, changes):
+        '''Invalidate cached permission sets when groups or permissions
+        change, cached users when they change and revoke deleted tokens
+        '''
+        odm = app.odm()
+        models = (odm.group, odm.permission)
+        if any((isinstance(target, models) for target, _ in changes.values())):
+            app.cache_server.invalidate_tags(PERMISSIONS_TAG)
+        users = [user_key(app, target.id) for target, _ in changes.values()
+                 if isinstance(target, odm.user)]
+        if users:
+            app.cache_server.delete_many(users)
+        if app.config['TOKEN_STATELESS']:
+            revoke_tokens(app, [target for target, op in changes.values()
+                                if op == 'delete' and
+                                isinstance(target, odm.token)])
+
     def on_token(self, app, request, token, user):
         if user.is_authenticated():
             token['username'] = user.username
@@ -1,24 +1,83 @@
 import uuid
 
+from sqlalchemy import inspect, case
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
 
-from lux import cached, Parameter
+from pulsar import ImproperlyConfigured
+
+from lux import Parameter
+from lux.core.cache import DummyCache
 from lux.utils.crypt import digest
 from lux.extensions.rest import (PasswordMixin, backends, normalise_email,
                                  AuthenticationError)
-from lux.extensions.rest.policy import has_permission
+from lux.extensions.rest.policy import has_permission, user_policy_set
 
 from .views import Authorization, SignUp
 
 
+PERMISSIONS_TAG = 'permissions'
+
+
+def user_key(app, user_id):
+    '''Cache key of a user snapshot
+    '''
+    return ('%s:user:%s' % (app.config['APP_NAME'], user_id)).lower()
+
+
+def user_snapshot(user):
+    '''Dictionary with the column values and the group ids of ``user``,
+    which must be attached to a session
+    '''
+    data = dict(((attr.key, getattr(user, attr.key))
+                 for attr in inspect(user).mapper.column_attrs))
+    data['group_ids'] = sorted((group.id for group in user.groups))
+    return data
+
+
+def detached_user(odm, data):
+    '''A detached user from a :func:`user_snapshot`, relationships
+    are not loaded
+    '''
+    data = data.copy()
+    group_ids = data.pop('group_ids')
+    user = odm.user(**data)
+    make_transient_to_detached(user)
+    user.group_ids = group_ids
+    return user
+
+
+def revoked_key(app, token_id):
+    '''Cache key of a revoked token
+    '''
+    return ('%s:revoked:%s' % (app.config['APP_NAME'], token_id)).lower()
+
+
+def revoke_tokens(app, tokens):
+    '''Add ``tokens`` to the revoked tokens in the cache server, until
+    they expire
+    '''
+    cache = app.cache_server
+    now = datetime.now()
+    for token in tokens:
+        timeout = None
+        if token.expiry:
+            timeout = int((token.expiry - now).total_seconds()) + 1
+            if timeout <= 0:
+                continue
+        cache.set(revoked_key(app, token.id.hex), 1, timeout=timeout)
+
+
 class AuthMixin(PasswordMixin):
     '''Mixin to implement authentication backend based on
     SQLAlchemy models
     '''
     _config = [Parameter('GENERAL_MAILING_LIST_TOPIC', 'general',
                          "topic for general mailing list")]
+    _token_access = None
+    _token_flush = None
 
     def api_sections(self, app):
         '''At the authorization router to the api
@@ -26,14 +85,22 @@ class AuthMixin(PasswordMixin):
         yield Authorization()
 
     def get_user(self, request, user_id=None, token_id=None, username=None,
-                 email=None, auth_key=None, **kw):
+                 email=None, auth_key=None, live=False, **kw):
         '''Securely fetch a user by id, username or email
 
+        Users fetched by id are obtained from the user cache unless
+        ``live`` is ``True``.
+
         Returns user or nothing
         '''
         odm = request.app.odm()
 
-        if token_id and user_id:
+        if token_id and user_id and request.config['TOKEN_STATELESS']:
+            # signature and expiry were verified when decoding the token
+            if self.token_revoked(request, token_id):
+                return
+            self.token_accessed(request, token_id)
+        elif token_id and user_id:
             with odm.begin() as session:
                 query = session.query(odm.token)
                 query = query.filter_by(user_id=user_id, id=token_id)
@@ -50,6 +117,8 @@ class AuthMixin(PasswordMixin):
                     user_id = reg.user_id
                 else:
                     return
+        elif user_id and not live and request.config['USER_CACHE_TIMEOUT']:
+            return self.get_cached_user(request, user_id)
 
         with odm.begin() as session:
             query = session.query(odm.user)
@@ -67,6 +136,29 @@ class AuthMixin(PasswordMixin):
 
         return user
 
+    def get_cached_user(self, request, user_id):
+        '''Detached snapshot of the user with ``user_id`` from the
+        user cache
+
+        Snapshots expire after :setting:`USER_CACHE_TIMEOUT` seconds and
+        are invalidated when the user changes.
+        '''
+        cache = request.cache_server
+        key = user_key(request.app, user_id)
+        odm = request.app.odm()
+        data = cache.get_data(key, serializer='pickle')
+        if data is not None:
+            return detached_user(odm, data)
+        with odm.begin() as session:
+            user = session.query(odm.user).get(user_id)
+            if user is None:
+                return
+            data = user_snapshot(user)
+        user.group_ids = data['group_ids']
+        cache.set_data(key, data, timeout=request.config['USER_CACHE_TIMEOUT'],
+                       serializer='pickle')
+        return user
+
     def authenticate(self, request, user_id=None, username=None, email=None,
                      user=None, password=None, **kw):
         odm = request.app.odm()
@@ -102,8 +194,9 @@ class AuthMixin(PasswordMixin):
         if user.is_superuser():
             return True
         else:
-            permissions = self.get_permissions(request)
-            return has_permission(request, permissions, name, level)
+            policies = user_policy_set(
+                request, lambda: self.get_permissions(request))
+            return has_permission(request, policies, name, level)
 
     def create_user(self, request, username=None, password=None, email=None,
                     first_name=None, last_name=None, active=False,
@@ -159,6 +252,73 @@ class AuthMixin(PasswordMixin):
         session.close()
         return token
 
+    def token_revoked(self, request, token_id):
+        '''Check if the token with ``token_id`` has been revoked
+        '''
+        return bool(request.cache_server.get(revoked_key(request.app,
+                                                         token_id)))
+
+    def token_accessed(self, request, token_id):
+        '''Record the access of a token, the last access of tokens is
+        updated every :setting:`TOKEN_ACCESS_FLUSH` seconds by
+        :meth:`flush_token_access`, outside the request
+        '''
+        if self._token_access is None:
+            self._token_access = {}
+        self._token_access[token_id] = datetime.utcnow()
+
+    def flush_token_access(self, app):
+        '''Update the last access of tokens accessed since the last flush
+        with a single query
+        '''
+        access, self._token_access = self._token_access, {}
+        if not access:
+            return
+        odm = app.odm()
+        token = odm.token
+        try:
+            with odm.begin() as session:
+                query = session.query(token)
+                query = query.filter(token.id.in_(list(access)))
+                query.update({'last_access': case(access, value=token.id)},
+                             synchronize_session=False)
+        except Exception:
+            app.logger.exception('Could not update last access of tokens')
+
+    def on_loaded(self, app):
+        if app.config['TOKEN_STATELESS']:
+            if isinstance(app.cache_server, DummyCache):
+                raise ImproperlyConfigured('TOKEN_STATELESS requires a '
+                                           'CACHE_SERVER, revoked tokens '
+                                           'cannot be stored in the dummy '
+                                           'cache')
+            self._schedule_token_flush(app)
+
+    def on_stop(self, app):
+        super().on_stop(app)
+        if self._token_flush:
+            self._token_flush.cancel()
+            self._token_flush = None
+        if self._token_access:
+            return self._submit_token_flush(app)
+
+    def _schedule_token_flush(self, app):
+        loop = app._loop
+        if loop:
+            self._token_flush = loop.call_later(
+                app.config['TOKEN_ACCESS_FLUSH'], self._periodic_token_flush,
+                app)
+
+    def _periodic_token_flush(self, app):
+        if self._token_access:
+            self._submit_token_flush(app)
+        self._schedule_token_flush(app)
+
+    def _submit_token_flush(self, app):
+        if app.green_pool:
+            return app.green_pool.submit(self.flush_token_access, app)
+        return app._loop.run_in_executor(None, self.flush_token_access, app)
+
     def create_auth_key(self, request, user, expiry=None, **kw):
         '''Create a registration entry and return the registration id
         '''
@@ -190,21 +350,50 @@ class AuthMixin(PasswordMixin):
                 session.delete(reg)
                 return True
 
-    @cached(user=True)
     def get_permissions(self, request):
+        '''Permissions of the request user, the permission set of
+        the user groups
+        '''
         odm = request.app.odm()
         user = request.cache.user
-        perms = {}
-        with odm.begin() as session:
-            if user.is_authenticated():
-                session.add(user)
-                groups = set(user.groups)
-            else:
-                cfg = request.config
-                query = session.query(odm.group)
-                groups = set(query.filter_by(name=cfg['ANONYMOUS_GROUP']))
-            for group in groups:
-                perms.update(((p.name, p.policy) for p in group.permissions))
+        # group ids of users from the user cache
+        groups = getattr(user, 'group_ids', None)
+        if groups is None:
+            with odm.begin() as session:
+                query = session.query(odm.group.id)
+                if user.is_authenticated():
+                    query = query.join(odm.group.users).filter(
+                        odm.user.id == user.id)
+                else:
+                    cfg = request.config
+                    query = query.filter_by(name=cfg['ANONYMOUS_GROUP'])
+                groups = sorted(set((group for group, in query)))
+        return self.get_permission_set(request, groups)
+
+    def get_permission_set(self, request, groups):
+        '''Permissions of a sorted list of ``groups`` ids
+
+        Permission sets are cached and shared by all users in the same
+        groups. They are invalidated when groups or permissions change.
+        '''
+        if not groups:
+            return {}
+        cache = request.cache_server
+        key = '%s:permissions:%s' % (request.config['APP_NAME'],
+                                     '.'.join((str(g) for g in groups)))
+        key = cache.tagged_key(key.lower(), (PERMISSIONS_TAG,))
+        perms = cache.get_json(key)
+        if perms is None:
+            odm = request.app.odm()
+            with odm.begin() as session:
+                query = session.query(odm.permission.name,
+                                      odm.permission.policy)
+                query = query.join(odm.permission.groups).filter(
+                    odm.group.id.in_(groups)).order_by(odm.group.id,
+                                                       odm.permission.id)
+                perms = dict(query)
+            cache.set_json(key, perms,
+                           timeout=request.config['DEFAULT_CACHE_TIMEOUT'])
         return perms
 
 
@@ -221,10 +410,14 @@ class SessionBackend(AuthMixin, backends.SessionBackend):
         '''Retrieve a session from its key
         '''
         odm = request.app.odm()
-        token = odm.token
         with odm.begin() as session:
-            query = session.query(token).options(joinedload(token.user))
-            return query.get(key)
+            token = session.query(odm.token).get(key)
+        if token is not None:
+            user = None
+            if token.user_id:
+                user = self.get_user(request, user_id=token.user_id)
+            set_committed_value(token, 'user', user)
+        return token
 
     def create_session(self, request, user=None):
         session = super().create_session(request, user=user)
@@ -10,6 +10,13 @@ When the :setting:`SERVE_STATIC_FILES` parameter is set to ``True``,
 this extension adds middleware for serving static files from
 :setting:`MEDIA_URL`.
 In addition, a :setting:`FAVICON` location can also be specified.
+
+Cache Metrics
+======================
+When the :setting:`CACHE_METRICS_URL` parameter is set, this extension adds
+a :class:`.CacheMetricsRouter` exposing hits, misses, latencies and payload
+sizes of ``@cached`` values, in JSON or in the Prometheus text format.
+The router is not authenticated, mount it on an internal url only.
 '''
 import hashlib
 from urllib.parse import urlparse
@@ -21,9 +28,10 @@ import lux
 from lux import Parameter, RedirectRouter
 
 from .media import FileRouter, MediaRouter
+from .metrics import CacheMetricsRouter
 
 
-__all__ = ['FileRouter', 'MediaRouter']
+__all__ = ['FileRouter', 'MediaRouter', 'CacheMetricsRouter']
 
 
 class Extension(lux.Extension):
@@ -41,7 +49,9 @@ class Extension(lux.Extension):
                   'if ``True`` add middleware to serve static files.'),
         Parameter('FAVICON', None,
                   'Adds tag of type ``image/x-icon`` in the head section of'
-                  ' the Html document')]
+                  ' the Html document'),
+        Parameter('CACHE_METRICS_URL', None,
+                  'If set, the url of a router exposing the cache metrics')]
 
     def middleware(self, app):
         '''Add two middleware handlers if configured to do so.'''
@@ -55,6 +65,9 @@ class Extension(lux.Extension):
         if app.config['REDIRECTS']:
             for url, to in app.config['REDIRECTS'].items():
                 middleware.append(RedirectRouter(url, to))
+        if app.config['CACHE_METRICS_URL']:
+            middleware.append(
+                CacheMetricsRouter(app.config['CACHE_METRICS_URL']))
 
         return middleware
 
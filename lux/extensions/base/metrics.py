@@ -0,0 +1,23 @@
+from pulsar.apps.wsgi import Json
+
+import lux
+
+
+class CacheMetricsRouter(lux.Router):
+    '''Expose the :class:`.CacheMetrics` of the application cache server.
+
+    The response is a JSON document unless the client accepts
+    ``text/plain`` only, or the ``format=prometheus`` url parameter is
+    given, in which case the Prometheus text format is returned.
+    '''
+    response_content_types = ('application/json', 'text/plain')
+
+    def get(self, request):
+        metrics = request.cache_server.metrics
+        response = request.response
+        if (request.url_data.get('format') == 'prometheus' or
+                response.content_type == 'text/plain'):
+            response.content_type = 'text/plain'
+            response.content = metrics.prometheus()
+            return response
+        return Json(metrics.as_dict()).http_response(request)
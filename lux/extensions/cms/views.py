@@ -1,4 +1,5 @@
 import json
+import uuid
 
 from pulsar import Http404
 from pulsar.utils.slugify import slugify
@@ -98,22 +99,32 @@ class CMS(lux.CMS):
         page = self.match(path)
         if not page:
             sitemap = super().site_map(self.app)
-            page = self.match(path, sitemap)
+            page = self.match(path, sitemap, 'templates')
         return Page(page or ())
 
-    @cached
     def site_map(self, app):
+        return self.site_map_data(app)['pages']
+
+    def versioned_site_map(self, app):
+        data = self.site_map_data(app)
+        return data['version'], data['pages']
+
+    @cached
+    def site_map_data(self, app):
+        '''The sitemap from the database, with a version set at load time
+        '''
         key = self.key or ''
+        pages = []
         response = app.api.get('html_pages?root=%s' % key)
         if response.status_code == 200:
             data = response.json()
-            return data['result']
+            pages = data['result']
         else:
             try:
                 response.raise_for_status()
             except Exception:
                 app.logger.exception('Could not load sitemap')
-            return []
+        return {'version': uuid.uuid4().hex, 'pages': pages}
 
     @cached
     def inner_html(self, request, page, self_comp=''):
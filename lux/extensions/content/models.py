@@ -6,11 +6,13 @@ from dulwich.porcelain import rm, add, init, commit, open_repo
 from dulwich.file import GitFile
 from dulwich.errors import NotGitRepository
 
+from pulsar import BadRequest
 from pulsar.utils.httpurl import remove_double_slash
 
-from lux import cached, get_reader
+from lux import cached, get_reader, Cacheable
 from lux.extensions import rest
 from lux.extensions.rest import RestColumn
+from lux.extensions.rest.models import FALSE_VALUES
 from lux.utils.files import get_rel_dir
 
 
@@ -38,8 +40,44 @@ OPERATORS = {
     'gt': lambda x, y: x > y,
     'ge': lambda x, y: x >= y,
     'lt': lambda x, y: x < y,
-    'le': lambda x, y: x <= y
+    'le': lambda x, y: x <= y,
+    'ne': lambda x, y: x != y,
+    'startswith': lambda x, y: x.startswith(y),
+    'contains': lambda x, y: y in x,
+    'isnull': lambda x, y: (x is None) == (y.lower() not in FALSE_VALUES)
     }
+MULTI_VALUE_OPERATORS = frozenset(('in', 'range'))
+
+
+def filter_predicate(op, value):
+    '''Predicate on content values for the filter operator ``op``
+
+    ``value`` is validated before any content is filtered, as by the
+    odm model, and :class:`~pulsar.BadRequest` is raised when malformed.
+    '''
+    if op not in OPERATORS and op not in MULTI_VALUE_OPERATORS:
+        raise BadRequest('Unknown filter operator %s' % op)
+    values = value if isinstance(value, list) else [value]
+    if not values or not all(isinstance(v, str) for v in values):
+        raise BadRequest('Invalid value for filter operator %s' % op)
+    if op in MULTI_VALUE_OPERATORS:
+        values = [v for vs in values for v in vs.split(',')]
+        if op == 'in':
+            return lambda x: x in values
+        if len(values) != 2:
+            raise BadRequest('range filter requires two values')
+        low, high = values
+        if not (low or high):
+            raise BadRequest('range filter requires at least one bound')
+        return lambda x: _in_range(x, low, high)
+    elif op == 'eq' and len(values) > 1:
+        return lambda x: x in values
+    operator = OPERATORS[op]
+    return lambda x: all(operator(x, v) for v in values)
+
+
+def _in_range(value, low, high):
+    return (not low or value >= low) and (not high or value <= high)
 
 
 class Content(rest.RestModel):
@@ -66,12 +104,17 @@ class Content(rest.RestModel):
         columns = columns or COLUMNS[:]
         super().__init__(name, columns=columns, **kwargs)
 
-    def session(self, request):
+    def session(self, request, read_only=False):
         return Query(request, self)
 
     def query(self, request, session, *filters):
         return session
 
+    def cache_tag(self):
+        '''Tag of all values cached from this content
+        '''
+        return 'content:%s' % self.name
+
     def get_target(self, request, **extra_data):
         '''Get a target for a form
 
@@ -117,6 +160,7 @@ class Content(rest.RestModel):
         add(self.repo, [filename])
         committer = user.username if user.is_authenticated() else 'anonymous'
         commit_hash = commit(self.repo, _b(message), committer=_b(committer))
+        request.cache_server.invalidate_tags(self.cache_tag())
 
         return dict(hash=commit_hash.decode('utf-8'),
                     body=content,
@@ -150,8 +194,10 @@ class Content(rest.RestModel):
             if not message:
                 message = 'Deleted %s' % ';'.join(filenames)
 
-            return commit(self.repo, _b(message),
-                          committer=_b(user.username))
+            commit_hash = commit(self.repo, _b(message),
+                                 committer=_b(user.username))
+            request.cache_server.invalidate_tags(self.cache_tag())
+            return commit_hash
 
     def exist(self, request, name):
         '''Check if a resource ``name`` exists
@@ -231,7 +277,7 @@ class Content(rest.RestModel):
         return query.filter(field, op, value)
 
 
-class Query:
+class Query(Cacheable):
     _data = None
     _limit = None
     _offset = None
@@ -254,6 +300,9 @@ class Query:
         self._offset = v
         return self
 
+    def cache_tags(self, app):
+        return (self.model.cache_tag(),)
+
     def count(self):
         return len(self._get_data())
 
@@ -267,16 +316,15 @@ class Query:
         return self
 
     def filter(self, field, op, value):
+        predicate = filter_predicate(op, value)
         data = []
-        op = OPERATORS.get(op)
-        if op:
-            for content in self._get_data():
-                val = content.get(field)
-                try:
-                    if op(val, value):
-                        data.append(content)
-                except Exception:
-                    pass
+        for content in self._get_data():
+            try:
+                if predicate(content.get(field)):
+                    data.append(content)
+            except (TypeError, AttributeError):
+                # content values of a different type do not match
+                pass
         self._data = data
         return self
 
@@ -203,6 +203,7 @@ class CMS(lux.CMS):
         super().__init__(app)
         self.sitemaps = [CMSmap('/sitemap.xml', cms=self)]
         self._middleware = []
+        self._resolved = lux.LocalCache(10000)
 
     def add_router(self, router, sitemap=True):
         if isinstance(router, Content):
@@ -218,6 +219,7 @@ class CMS(lux.CMS):
             self.sitemaps.append(sitemap)
 
         self._middleware.append(router)
+        self._resolved.clear()
 
     def middleware(self):
         all = self.sitemaps[:]
@@ -230,16 +232,29 @@ class CMS(lux.CMS):
         path = request.path[1:]
 
         try:
-            for router in self._middleware:
-                router_args = router.resolve(path)
-                if router_args:
-                    router, args = router_args
-                    path = tuple(args.values())[0] if args else 'index'
-                    try:
-                        return router.render_file(request, path)
-                    except Http404:
-                        return html
+            router_args = self.resolve(path)
+            if router_args:
+                router, args = router_args
+                path = tuple(args.values())[0] if args else 'index'
+                try:
+                    return router.render_file(request, path)
+                except Http404:
+                    return html
 
             return html
         finally:
             request.cache.pop('html_main')
+
+    def resolve(self, path):
+        '''Resolve ``path`` with the content routers
+
+        Resolutions are memoized per path.
+        '''
+        found, router_args = self._resolved.get(path)
+        if not found:
+            for router in self._middleware:
+                router_args = router.resolve(path)
+                if router_args:
+                    break
+            self._resolved.set(path, router_args)
+        return router_args
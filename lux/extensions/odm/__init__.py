@@ -19,10 +19,12 @@ from .mapper import Mapper, model_base
 from .views import CRUD, RestRouter
 from .models import RestModel, RestColumn, ModelColumn
 from .forms import RelationshipField, UniqueField
+from .search import SearchEngine, register_search_engine
 
 
 __all__ = ['model_base', 'CRUD', 'RestRouter', 'RestModel', 'RestColumn',
-           'ModelColumn', 'RelationshipField', 'UniqueField']
+           'ModelColumn', 'RelationshipField', 'UniqueField',
+           'SearchEngine', 'register_search_engine']
 
 
 class Extension(lux.Extension):
@@ -32,11 +34,28 @@ class Extension(lux.Extension):
     '''
     _config = [
         Parameter('DATASTORE', None,
-                  'Dictionary for mapping models to their back-ends database'),
+                  'Dictionary for mapping models to their back-ends database. '
+                  'A back-end can be a dictionary with the "primary" url '
+                  'and a list of "replicas" urls of read replicas'),
+        Parameter('DATASTORE_REPLICA_POLICY', 'round_robin',
+                  'Selection of read replicas, "round_robin" or "latency" '
+                  'for the replica with the lowest query latency'),
+        Parameter('DATASTORE_STICKY_WINDOW', 0,
+                  'Seconds after a write during which the reads of a user '
+                  'are routed to the primary database rather than to read '
+                  'replicas. Set to 0 to disable. Writes are recorded in '
+                  'the cache server, so that all workers see them when the '
+                  'cache server is shared, and in a per-process cache of '
+                  'DATASTORE_STICKY_ENTRIES keys'),
+        Parameter('DATASTORE_STICKY_ENTRIES', 10000,
+                  'Maximum number of keys in the per-process cache of '
+                  'recent writers for DATASTORE_STICKY_WINDOW'),
         Parameter('DATABASE_SESSION_SIGNALS', True,
                   'Register event handlers for database session'),
         Parameter('MIGRATIONS', None,
-                  'Dictionary for mapping alembic settings')
+                  'Dictionary for mapping alembic settings'),
+        Parameter('SEARCH_LANGUAGE', 'english',
+                  'Text search configuration of PostgreSQL full text search')
     ]
 
     def on_config(self, app):
@@ -4,13 +4,15 @@ from pulsar import Setting
 
 import lux
 from lux.core.commands import CommandError
+from lux.extensions.odm.search import search_columns
 
 
 class Command(lux.Command):
     help = 'Alembic commands for migrating database.'
 
     commands = ['auto', 'branches', 'current', 'downgrade', 'heads', 'history',
-                'init', 'merge', 'revision', 'show', 'stamp', 'upgrade']
+                'init', 'merge', 'revision', 'search', 'show', 'stamp',
+                'upgrade']
 
     option_list = (
         Setting('command', nargs='*', default=None, desc='Alembic command'),
@@ -35,7 +37,7 @@ class Command(lux.Command):
             cmd = opt.command[0]
             if cmd not in self.commands:
                 raise CommandError('Unrecognized command %s' % opt.command[0])
-            if cmd in ('auto', 'revision', 'merge') and not opt.msg:
+            if cmd in ('auto', 'revision', 'merge', 'search') and not opt.msg:
                 raise CommandError('Missing [-m] parameter for %s' % cmd)
             self.run_alembic_cmd(opt)
             return True
@@ -149,6 +151,15 @@ class Command(lux.Command):
         elif cmd == 'auto':
             alembic_cmd.revision(config, autogenerate=True, message=opt.msg,
                                  branch_label=opt.branch)
+        # revision creating full text search indexes
+        elif cmd == 'search':
+            from alembic.script import ScriptDirectory
+            from alembic.util import rev_id
+            script = ScriptDirectory.from_config(config)
+            script.generate_revision(rev_id(), opt.msg, head='head',
+                                     branch_labels=opt.branch,
+                                     config=config,
+                                     **self.search_migrations())
         # this commands required revision name, but do not take any message or
         # branch labels
         elif cmd in ('show', 'stamp', 'upgrade', 'downgrade'):
@@ -159,6 +170,37 @@ class Command(lux.Command):
             # execute commands without any additional params
             getattr(alembic_cmd, cmd)(config)
 
+    def search_migrations(self):
+        '''
+        Template arguments for a revision creating the full text search
+        indexes of models declaring searchable columns, for each database.
+        '''
+        odm = self.app.odm()
+        language = self.app.config['SEARCH_LANGUAGE']
+        imports = ('from lux.extensions.odm.search import '
+                   'create_search_index, drop_search_index')
+        args = {'imports': imports}
+
+        for key, db_engine in odm.keys_engines():
+            if not key:
+                key = 'default'
+            upgrades = []
+            downgrades = []
+            for table, engine in sorted(odm.binds.items(),
+                                        key=lambda t: t[0].name):
+                columns = search_columns(table)
+                if engine != db_engine or not columns:
+                    continue
+                pkey, = table.primary_key.columns.keys()
+                params = '%r, %r, pkey=%r, language=%r' % (
+                    table.name, columns, pkey, language)
+                upgrades.append('create_search_index(%s)' % params)
+                downgrades.append('drop_search_index(%s)' % params)
+            if upgrades:
+                args['%s_upgrades' % key] = '\n    '.join(upgrades)
+                args['%s_downgrades' % key] = '\n    '.join(downgrades)
+        return args
+
     def get_metadata(self, config):
         '''
         MetaData object stored in odm extension contains aggregated data
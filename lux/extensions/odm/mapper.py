@@ -1,10 +1,18 @@
-from sqlalchemy import Table
+import time
+from itertools import cycle
+
+from sqlalchemy import Table, event, inspect
 from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.sql.expression import UpdateBase
 
 import odm
 
 from pulsar import ImproperlyConfigured
 
+from lux import LocalCache
+
+from .search import search_ddl
+
 
 model_base = odm.model_base
 cache_name = '__odm_models__'
@@ -14,13 +22,50 @@ def is_model(cls):
     return isinstance(cls, (Table, DeclarativeMeta))
 
 
+def split_binds(binds):
+    '''Split the ``binds`` of the :setting:`DATASTORE` setting into
+    primary urls and read replica urls
+    '''
+    if not isinstance(binds, dict):
+        return binds, {}
+    primaries, replicas = {}, {}
+    for name, bind in binds.items():
+        if isinstance(bind, dict):
+            primaries[name] = bind['primary']
+            if bind.get('replicas'):
+                replicas[name] = bind['replicas']
+        else:
+            primaries[name] = bind
+    return primaries, replicas
+
+
 class Mapper(odm.Mapper):
     '''SQLAlchemy wrapper for lux applications
+
+    .. attribute:: replicas
+
+        Dictionary mapping primary engines to their :class:`.ReplicaSet`
     '''
 
     def __init__(self, app, binds):
         self.app = app
+        binds, replicas = split_binds(binds)
         super().__init__(binds)
+        cfg = app.config
+        self.replicas = {}
+        for name, urls in replicas.items():
+            primary = self.get_engine(None if name == 'default' else name)
+            engines = [odm.create_engine(url) for url in urls]
+            for engine in engines:
+                if getattr(engine.dialect, 'is_green', False):
+                    self.is_green = True
+            self.replicas[primary] = ReplicaSet(
+                engines, cfg['DATASTORE_REPLICA_POLICY'])
+        window = cfg['DATASTORE_STICKY_WINDOW']
+        self.sticky = None
+        if window:
+            self.sticky = LocalCache(cfg['DATASTORE_STICKY_ENTRIES'],
+                                     timeout=window)
         for model in self.app.module_iterator('models', is_model, cache_name):
             self.register(model)
         if self.is_green and not app.config['GREEN_POOL']:
@@ -31,19 +76,143 @@ class Mapper(odm.Mapper):
     def copy(self, binds):
         return self.__class__(self.app, binds)
 
-    def session(self, **options):
+    def register(self, model):
+        model = super().register(model)
+        if model is not None:
+            search_ddl(model, self.app.config['SEARCH_LANGUAGE'])
+        return model
+
+    def session(self, read_only=False, sticky=None, **options):
+        '''Create a new session
+
+        :param read_only: route queries to read replicas, if available
+        :param sticky: optional key, usually the user id, whose writes
+            route read only sessions to the primary databases for
+            :setting:`DATASTORE_STICKY_WINDOW` seconds
+        '''
         options['binds'] = self.binds
-        return LuxSession(self, **options)
+        if read_only:
+            read_only = bool(self.replicas) and not self.wrote(sticky)
+        return LuxSession(self, read_only=read_only, sticky=sticky,
+                          **options)
+
+    def wrote(self, sticky):
+        '''Check if ``sticky`` wrote to the database within the
+        stickiness window.
+
+        Writes of this process are checked first, then writes recorded
+        in the cache server by other workers
+        '''
+        if self.sticky is not None and sticky is not None:
+            if self.sticky.get(sticky)[0]:
+                return True
+            key = self.sticky_key(sticky)
+            return bool(self.app.cache_server.get(key))
+        return False
+
+    def write(self, sticky):
+        '''Record a write of ``sticky`` for the stickiness window
+        '''
+        if self.sticky is not None and sticky is not None:
+            self.sticky.set(sticky, True)
+            self.app.cache_server.set(self.sticky_key(sticky), 1,
+                                      timeout=self.sticky.timeout)
+
+    def sticky_key(self, sticky):
+        return ('%s:sticky:%s' % (self.app.config['APP_NAME'],
+                                  sticky)).lower()
+
+    def close(self):
+        super().close()
+        for replicas in self.replicas.values():
+            for engine in replicas.engines:
+                engine.dispose()
+
+
+class ReplicaSet:
+    '''Read replicas of a primary database
+
+    :param engines: list of replica engines
+    :param policy: replica selection policy, ``round_robin`` or
+        ``latency`` for the replica with the lowest moving average of
+        query execution times
+    '''
+    smoothing = 0.2
+    '''Weight of the last query in the moving average of latencies'''
+
+    def __init__(self, engines, policy='round_robin'):
+        if policy not in ('round_robin', 'latency'):
+            raise ImproperlyConfigured('Unknown replica policy %s' % policy)
+        self.engines = engines
+        self.policy = policy
+        self.latency = dict.fromkeys(engines, 0.0)
+        self._cycle = cycle(engines)
+        if policy == 'latency':
+            for engine in engines:
+                event.listen(engine, 'before_cursor_execute', self._start)
+                event.listen(engine, 'after_cursor_execute', self._end)
+
+    def engine(self):
+        '''Select a replica engine
+        '''
+        if self.policy == 'latency':
+            return min(self.engines, key=self.latency.__getitem__)
+        return next(self._cycle)
+
+    def _start(self, conn, *args):
+        conn.info['lux_query_start'] = time.time()
+
+    def _end(self, conn, *args):
+        start = conn.info.pop('lux_query_start', None)
+        if start is not None and conn.engine in self.latency:
+            latency = self.latency[conn.engine]
+            self.latency[conn.engine] = (latency + self.smoothing *
+                                         (time.time() - start - latency))
 
 
 class LuxSession(odm.OdmSession):
+    '''Session routing queries of read only sessions to read replicas
+
+    Flushes and ``INSERT``, ``UPDATE`` and ``DELETE`` statements always
+    use the primary databases.
+    '''
+    def __init__(self, mapper, read_only=False, sticky=None, **options):
+        self.read_only = read_only
+        self.sticky = sticky
+        self._replica_binds = {}
+        super().__init__(mapper, **options)
 
     @property
     def app(self):
         return self.mapper.app
 
+    def get_bind(self, mapper=None, clause=None, **kw):
+        bind = super().get_bind(mapper, clause, **kw)
+        if (self.read_only and not self._flushing and
+                not isinstance(clause, UpdateBase)):
+            replicas = self.mapper.replicas.get(bind)
+            if replicas:
+                # one replica per primary for the lifetime of the session
+                if bind not in self._replica_binds:
+                    self._replica_binds[bind] = replicas.engine()
+                return self._replica_binds[bind]
+        return bind
+
+    def record_changes(self, targets, operation):
+        '''Record ``operation`` on ``targets`` which are not tracked by the
+        unit of work, for example rows written with bulk operations,
+        so that they are signaled on commit as any other change
+        '''
+        changes = self._model_changes
+        for target in targets:
+            state = inspect(target)
+            key = state.identity_key if state.has_identity else id(target)
+            changes[key] = (target, operation)
+
     @classmethod
     def signal(cls, session, changes, event):
         '''Signal changes on session
         '''
+        if event == 'on_after_commit':
+            session.mapper.write(session.sticky)
         session.app.fire(event, session, changes)
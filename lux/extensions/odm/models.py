@@ -1,18 +1,35 @@
 import json
 from datetime import date, datetime
 from enum import Enum
+from functools import partial
 
 import pytz
+from dateutil.parser import parse as parse_date
 
-from sqlalchemy import Column, desc
-from sqlalchemy.orm import class_mapper, load_only
+from sqlalchemy import (Column, desc, and_, or_, false, TypeDecorator,
+                        DateTime, Date, Integer, Boolean, String, Float)
+from sqlalchemy import Enum as EnumType
+from sqlalchemy.orm import class_mapper, load_only, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 
-from pulsar import PermissionDenied
+try:
+    from sqlalchemy.orm import selectinload
+except ImportError:     # pragma    nocover
+    from sqlalchemy.orm import subqueryload as selectinload
+
+from pulsar import PermissionDenied, BadRequest
 from pulsar.utils.html import nicename
 
 from odm.utils import get_columns
 
+from lux import LocalCache
 from lux.extensions import rest
+from lux.extensions.rest.models import FALSE_VALUES
+
+from .search import search_engine
+
+
+SEARCH_RANK = 'rank'
 
 
 def is_same_model(model1, model2):
@@ -34,18 +51,34 @@ class RestModel(rest.RestModel):
     '''
     _db_columns = None
     _rest_columns = None
-
-    def session(self, request):
+    _plans = None
+    max_plans = 100
+    '''Maximum number of cached serializer plans'''
+    exact_total_below = 1000
+    '''The ``estimated`` total strategy counts rows exactly when the
+    planner estimate is below this value'''
+
+    def session(self, request, read_only=False):
         '''Obtain a session
+
+        Queries of ``read_only`` sessions are routed to read replicas,
+        if configured, unless the user wrote to the database within
+        the :setting:`DATASTORE_STICKY_WINDOW`
         '''
-        return request.app.odm().begin()
+        user = request.cache.user
+        sticky = user.get_id() if user and user.is_authenticated() else None
+        return request.app.odm().begin(read_only=read_only, sticky=sticky)
 
     def query(self, request, session, *filters):
         """
         Returns a query object for the model.
 
         The loading of columns the user does not have read
-        access to is deferred. This is only a performance enhancement.
+        access to, or which are not in the requested
+        :meth:`~.RestModel.fields`, is deferred.
+        Related models of :class:`.ModelColumn` the user can read are
+        eagerly loaded, so that serialising a list of models issues
+        a constant number of queries.
 
         :param request:     request object
         :param session:     SQLAlchemy session
@@ -54,33 +87,80 @@ class RestModel(rest.RestModel):
         entities = self.columns_with_permission(request, rest.READ)
         if not entities:
             raise PermissionDenied
+        entities = self.select_columns(request, entities)
+        if not entities:
+            raise BadRequest('No valid fields')
         db_model = self.db_model()
         db_columns = self.db_columns(self.column_fields(entities))
         query = session.query(db_model).options(load_only(*db_columns))
+        query = query.options(*self.eager_load(request, entities))
         if filters:
             query = query.filter(*filters)
         return query
 
+    def eager_load(self, request, entities):
+        '''Generator of loading options for related models in ``entities``
+
+        Collections are loaded with ``selectinload`` (``subqueryload`` for
+        older versions of sqlalchemy), scalar relationships with
+        ``joinedload``. Only the id and repr columns of related models are
+        loaded.
+        '''
+        db_model = self.db_model()
+        for entity in entities:
+            column = self._rest_columns.get(entity['name'])
+            if not isinstance(column, ModelColumn):
+                continue
+            attr = getattr(db_model, column.name, None)
+            prop = getattr(attr, 'property', None)
+            if getattr(prop, 'uselist', None) is None:
+                continue
+            related = column.model(request.app)
+            related.columns(request.app)
+            fields = related.db_columns(set((related.id_field,
+                                             related.repr_field)))
+            option = selectinload(attr) if prop.uselist else joinedload(attr)
+            if fields:
+                option = option.load_only(*fields)
+            yield option
+
     def serialise_model(self, request, data, **kw):
         """
         Makes a model instance JSON-friendly. Removes fields that the
-        user does not have read access to.
+        user does not have read access to or did not request.
 
         :param request:     request object
         :param data:        data
         :param kw:          not used
         :return:            dict
         """
-        exclude = self.columns_without_permission(request, rest.READ)
-        exclude = self.column_fields(exclude, 'name')
+        exclude = self.read_exclude(request)
         return self.tojson(request, data, exclude=exclude)
 
+    def search_engine(self, session):
+        '''The :class:`.SearchEngine` for the database of this model,
+        ``None`` if the model does not declare searchable columns
+        '''
+        db_model = self.db_model()
+        dialect = session.get_bind(class_mapper(db_model)).dialect.name
+        return search_engine(db_model, dialect,
+                             self._app.config['SEARCH_LANGUAGE'])
+
+    def sortby(self, request, query, sortby=None):
+        '''Results of a full text search are sorted by rank unless
+        a different ordering is requested
+        '''
+        if not sortby and self.search_text(request):
+            sortby = SEARCH_RANK
+        return super().sortby(request, query, sortby)
+
     def meta(self, request, *filters, exclude=None):
         meta = super().meta(request, exclude=exclude)
-        odm = request.app.odm()
-        with odm.begin() as session:
+        with self.session(request, read_only=True) as session:
             query = self.query(request, session, *filters)
-            meta['total'] = query.count()
+            total = self.total(request, query)
+            if total is not None:
+                meta['total'] = total
         return meta
 
     def load_related(self,  instance):
@@ -145,44 +225,48 @@ class RestModel(rest.RestModel):
     def tojson(self, request, obj, exclude=None):
         '''Override the method from the base class.
 
-        It uses sqlalchemy model information about columns
+        It uses the :meth:`serializer_plan` for ``exclude``
         '''
-        exclude = set(exclude or ())
-        exclude.update(self._exclude)
-        columns = self.columns(request.app)
+        plan = self.serializer_plan(request, exclude)
+        return self._serialise_plan(request, plan, obj)
 
-        fields = {}
-        for col in columns:
-            name = col['name']
-            restcol = self._rest_columns[name]
-            if name in exclude:
-                continue
-            try:
-                data = obj.__getattribute__(name)
-                if hasattr(data, '__call__'):
-                    data = data()
-                if isinstance(data, date):
-                    if isinstance(data, datetime) and not data.tzinfo:
-                        data = pytz.utc.localize(data)
-                    data = data.isoformat()
-                elif isinstance(data, Enum):
-                    data = data.name
-                elif isinstance(restcol, ModelColumn):
-                    related = restcol.model(request.app)
-                    data = self._related_model(request, related, data)
-                else:   # Test Json
-                    json.dumps(data)
-            except TypeError:
-                try:
-                    data = str(data)
-                except Exception:
-                    continue
-            if data is not None:
-                if isinstance(data, list):
-                    name = '%s[]' % name
-                fields[name] = data
-        # a json-encodable dict
-        return fields
+    def serializer_plan(self, request, exclude=None):
+        '''A list of ``(name, converter, column)`` triplets for serialising
+        model instances into JSON-friendly dictionaries.
+
+        Converters are selected once from the sqlalchemy column types and
+        plans are cached by the set of ``exclude`` columns, that is,
+        by the user permissions and the requested fields.
+        '''
+        exclude = frozenset(exclude or ())
+        plans = self._plans
+        if plans is None:
+            plans = self._plans = LocalCache(self.max_plans)
+        found, plan = plans.get(exclude)
+        if not found:
+            plan = self._build_plan(request, exclude)
+            plans.set(exclude, plan)
+        return plan
+
+    def read_exclude(self, request):
+        '''Names of columns not serialised, the columns the user cannot
+        read or which are not in the requested :meth:`~.RestModel.fields`
+        '''
+        columns = self.select_columns(
+            request, self.columns_with_permission(request, rest.READ))
+        names = set(self.column_fields(columns, 'name'))
+        return [col['name'] for col in self.columns(request)
+                if col['name'] not in names]
+
+    def serialise(self, request, data, **kw):
+        cls = type(self)
+        if (isinstance(data, list) and
+                cls.serialise_model is RestModel.serialise_model and
+                cls.tojson is RestModel.tojson):
+            plan = self.serializer_plan(request, self.read_exclude(request))
+            serialise = self._serialise_plan
+            return [serialise(request, plan, obj) for obj in data]
+        return super().serialise(request, data, **kw)
 
     def id_repr(self, request, obj):
         if obj:
@@ -220,6 +304,58 @@ class RestModel(rest.RestModel):
         with odm.begin(session=session) as session:
             session.delete(instance)
 
+    def bulk_create(self, request, items, session):
+        '''Create models from a list of validated data ``items`` in
+        ``session`` and return the list of their ids.
+
+        Rows are inserted with ``bulk_insert_mappings`` unless
+        :meth:`create_model` is overridden or ``items`` contain values
+        which cannot be mapped into columns of the database table.
+        Bulk inserted rows are recorded as session changes so that
+        ``on_after_commit`` handlers see them.
+        '''
+        mappings = None
+        if type(self).create_model is RestModel.create_model:
+            mappings = self._bulk_mappings(items)
+        if mappings is None:
+            instances = [self.create_model(request, data, session=session)
+                         for data in items]
+            return [getattr(obj, self.id_field) for obj in instances]
+        session.bulk_insert_mappings(self.db_model(), mappings,
+                                     return_defaults=True)
+        session.record_changes([self._bulk_instance(mapping)
+                                for mapping in mappings], 'insert')
+        return [mapping[self.id_field] for mapping in mappings]
+
+    def bulk_update(self, request, items, session):
+        '''Update models from a list of ``(instance, data)`` pairs
+        in ``session``.
+
+        Rows are updated with ``bulk_update_mappings`` unless
+        :meth:`update_model` is overridden or the data contain values
+        which cannot be mapped into columns of the database table.
+        Bulk updated instances are expired and recorded as session changes
+        so that ``on_after_commit`` handlers see them.
+        '''
+        mappings = None
+        if type(self).update_model is RestModel.update_model:
+            mappings = self._bulk_mappings((data for _, data in items))
+        if mappings is None:
+            for instance, data in items:
+                self.update_model(request, instance, data)
+            return
+        updates, instances = [], []
+        for mapping, (instance, _) in zip(mappings, items):
+            if mapping:
+                mapping[self.id_field] = getattr(instance, self.id_field)
+                updates.append(mapping)
+                instances.append(instance)
+        if updates:
+            session.bulk_update_mappings(self.db_model(), updates)
+            for instance in instances:
+                session.expire(instance)
+            session.record_changes(instances, 'update')
+
     def _load_columns(self, app):
         '''List of column definitions
         '''
@@ -255,28 +391,109 @@ class RestModel(rest.RestModel):
             info['hidden'] = True
         columns.append(info)
 
+    def _bulk_instance(self, mapping):
+        '''A transient instance with the column values of a bulk
+        inserted ``mapping``
+        '''
+        manager = class_mapper(self.db_model()).class_manager
+        instance = manager.new_instance()
+        for name, value in mapping.items():
+            set_committed_value(instance, name, value)
+        return instance
+
+    def _bulk_mappings(self, items):
+        '''Convert validated data ``items`` into dictionaries of column
+        values, ``None`` if this is not possible
+        '''
+        mapper = class_mapper(self.db_model())
+        keys = [mapper.get_property_by_column(c).key
+                for c in mapper.primary_key]
+        if keys != [self.id_field]:
+            return
+        db_columns = self._db_columns
+        mappings = []
+        for data in items:
+            mapping = {}
+            for name, value in data.items():
+                col = self._rest_columns.get(name)
+                if name in db_columns:
+                    mapping[name] = value
+                elif (isinstance(col, ModelColumn) and col.field and
+                        col.field in db_columns and
+                        not isinstance(value, (list, tuple, set))):
+                    if value is not None:
+                        related = col.model(self._app)
+                        value = getattr(value, related.id_field)
+                    mapping[col.field] = value
+                else:
+                    return
+            mappings.append(mapping)
+        return mappings
+
+    def _build_plan(self, request, exclude):
+        exclude = exclude.union(self._exclude)
+        app = request.app
+        db_columns = self._db_columns
+        plan = []
+        for col in self.columns(app):
+            name = col['name']
+            if name in exclude:
+                continue
+            restcol = self._rest_columns[name]
+            if isinstance(restcol, ModelColumn):
+                related = restcol.model(app)
+                plan.append((name, partial(self._related_value, related),
+                             False))
+            elif name in db_columns:
+                plan.append((name, column_converter(db_columns[name]), True))
+            else:
+                plan.append((name, _attribute_value, False))
+        return plan
+
+    def _serialise_plan(self, request, plan, obj):
+        fields = {}
+        for name, converter, column in plan:
+            if column:
+                data = getattr(obj, name)
+                if converter and data is not None:
+                    data = converter(data)
+            else:
+                data = converter(request, obj, name)
+            if data is not None:
+                if isinstance(data, list):
+                    name = '%s[]' % name
+                fields[name] = data
+        # a json-encodable dict
+        return fields
+
+    def _related_value(self, model, request, obj, name):
+        return self._related_model(request, model, getattr(obj, name))
+
     def _related_model(self, request, model, obj):
         if isinstance(obj, list):
             return [self._related_model(request, model, d) for d in obj]
         else:
             return model.id_repr(request, obj)
 
+    def _do_filters(self, request, query, filters):
+        '''Compile ``filters`` into a single SQL expression
+        '''
+        db_model = self.db_model()
+        clauses = []
+        groups = {}
+        for group, field, op, value in filters:
+            clause = filter_clause(getattr(db_model, field), op, value)
+            if group:
+                groups.setdefault(group, []).append(clause)
+            else:
+                clauses.append(clause)
+        for group in sorted(groups):
+            clauses.append(or_(*groups[group]))
+        return query.filter(and_(*clauses))
+
     def _do_filter(self, request, query, field, op, value):
-        if value == '':
-            value = None
-        odm = request.app.odm()
-        field = getattr(odm[self.name], field)
-        if op == 'eq':
-            query = query.filter(field == value)
-        elif op == 'gt':
-            query = query.filter(field > value)
-        elif op == 'ge':
-            query = query.filter(field >= value)
-        elif op == 'lt':
-            query = query.filter(field < value)
-        elif op == 'le':
-            query = query.filter(field <= value)
-        return query
+        field = getattr(self.db_model(), field)
+        return query.filter(filter_clause(field, op, value))
 
     def _do_sortby(self, request, query, entry, direction):
         columns = self.db_columns()
@@ -284,8 +501,148 @@ class RestModel(rest.RestModel):
             if direction == 'desc':
                 entry = desc(entry)
             return query.order_by(entry)
+        elif entry == SEARCH_RANK:
+            text = self.search_text(request)
+            engine = self.search_engine(query.session) if text else None
+            rank = engine.rank(text) if engine else None
+            if rank is not None:
+                if direction != 'asc':
+                    rank = desc(rank)
+                pkey = getattr(self.db_model(), self.id_field)
+                return query.order_by(rank, pkey)
         return query
 
+    def _do_search(self, request, query, text):
+        engine = self.search_engine(query.session)
+        if engine:
+            query = engine.search(query, text)
+        return query
+
+    def _total_signature(self, request, query):
+        try:
+            compiled = query.statement.compile()
+        except Exception:
+            return
+        params = sorted(((k, repr(v)) for k, v in compiled.params.items()))
+        return '%s%s' % (compiled, params)
+
+    def _estimated_total(self, request, query):
+        '''Estimate the total from the PostgreSQL planner statistics,
+        count rows for other dialects or small estimates
+        '''
+        session = query.session
+        mapper = class_mapper(self.db_model())
+        dialect = session.get_bind(mapper).dialect
+        if dialect.name == 'postgresql':
+            compiled = query.statement.compile(dialect=dialect)
+            plan = session.connection(mapper=mapper).execute(
+                'EXPLAIN (FORMAT JSON) %s' % compiled,
+                compiled.params).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            total = int(plan[0]['Plan']['Plan Rows'])
+            if total >= self.exact_total_below:
+                return total
+        return query.count()
+
+    def _stream_rows(self, query):
+        '''Fetch rows in batches of :attr:`stream_batch` with a server
+        side cursor rather than loading the whole result set
+        '''
+        return iter(query.yield_per(self.stream_batch))
+
+    def cursor_keys(self, request, sortby=None):
+        '''Sort keys are restricted to database columns the user can read,
+        since their values are encoded in the cursor
+        '''
+        keys = super().cursor_keys(request, sortby)
+        columns = self.columns_with_permission(request, rest.READ)
+        columns = set(self.db_columns(self.column_fields(columns)))
+        columns.add(self.id_field)
+        return [key for key in keys if key[0] in columns]
+
+    def _do_cursor(self, request, query, keys, values, before):
+        '''Keyset predicate and ordering for cursor pagination
+
+        ``NULL`` values of nullable sort columns are ordered after all
+        other values, regardless of the database dialect
+        '''
+        db_model = self.db_model()
+        fields = [getattr(db_model, name) for name, _ in keys]
+        nullable = [self._db_columns[name].nullable for name, _ in keys]
+        if values is not None:
+            values = [self._cursor_python(name, value)
+                      for (name, _), value in zip(keys, values)]
+            clauses = []
+            for index, (name, descending) in enumerate(keys):
+                field, value = fields[index], values[index]
+                clause = _cursor_compare(field, value, nullable[index],
+                                         descending == before)
+                equals = [f.is_(None) if v is None else f == v
+                          for f, v in zip(fields[:index], values[:index])]
+                equals.append(clause)
+                clauses.append(and_(*equals))
+            query = query.filter(or_(*clauses))
+        order = []
+        for field, null, (_, descending) in zip(fields, nullable, keys):
+            for expr in ((field.is_(None), field) if null else (field,)):
+                order.append(expr.desc() if descending != before
+                             else expr.asc())
+        return query.order_by(*order)
+
+    def _cursor_value(self, obj, name):
+        '''Encode cursor values with the converters used for serialising
+        '''
+        value = getattr(obj, name)
+        converter = column_converter(self._db_columns[name])
+        if value is not None and converter:
+            value = converter(value)
+        return value
+
+    def _cursor_python(self, name, value):
+        '''Convert a cursor value back to the python type of column
+        ``name``, raising ``BadRequest`` when it cannot be converted
+        '''
+        if value is None:
+            return value
+        col_type = self._db_columns[name].type
+        enum_class = getattr(col_type, 'enum_class', None)
+        if enum_class is None:
+            choices = getattr(col_type, 'choices', None)
+            if isinstance(choices, type) and issubclass(choices, Enum):
+                enum_class = choices
+        try:
+            if enum_class:
+                return enum_class[value]
+            try:
+                python_type = col_type.python_type
+            except NotImplementedError:
+                return value
+            if issubclass(python_type, date):
+                value = parse_date(value)
+                if python_type is date:
+                    value = value.date()
+            elif not isinstance(value, python_type):
+                value = python_type(value)
+        except Exception:
+            raise BadRequest('Invalid pagination cursor')
+        return value
+
+
+def _cursor_compare(field, value, nullable, greater):
+    '''Keyset comparison of ``field`` with a cursor ``value`` where
+    ``NULL`` is greater than any other value
+    '''
+    if greater:
+        if value is None:
+            return false()
+        clause = field > value
+        return or_(clause, field.is_(None)) if nullable else clause
+    elif value is None:
+        return field.isnot(None)
+    else:
+        return field < value
+
 
 class ModelMixin(rest.ModelMixin):
     RestModel = RestModel
@@ -299,6 +656,118 @@ class ModelColumn(RestColumn, ModelMixin):
         self.set_model(model)
 
 
+def filter_clause(field, op, value):
+    '''SQL expression filtering the column ``field`` with operator ``op``
+
+    Multiple values, either as a list or comma separated, are accepted
+    by the ``in`` and ``range`` operators. A list of values for other
+    operators matches all values, or any value for ``eq``.
+    '''
+    clause = FILTERS.get(op)
+    if not clause:
+        raise BadRequest('Unknown filter operator %s' % op)
+    if isinstance(value, list) and op not in MULTI_VALUE_FILTERS:
+        if op == 'eq':
+            return FILTERS['in'](field, value)
+        return and_(*[clause(field, v) for v in value])
+    return clause(field, value)
+
+
+def _values(value):
+    if not isinstance(value, list):
+        value = (value,)
+    return [v for values in value for v in values.split(',')]
+
+
+def _null(value):
+    return None if value == '' else value
+
+
+def _like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _range(field, value):
+    values = _values(value)
+    if len(values) != 2:
+        raise BadRequest('range filter requires two values')
+    lower, upper = values
+    if lower and upper:
+        return field.between(lower, upper)
+    elif lower:
+        return field >= lower
+    elif upper:
+        return field <= upper
+    raise BadRequest('range filter requires at least one bound')
+
+
+FILTERS = {
+    'eq': lambda f, v: f == _null(v),
+    'ne': lambda f, v: f != _null(v),
+    'gt': lambda f, v: f > v,
+    'ge': lambda f, v: f >= v,
+    'lt': lambda f, v: f < v,
+    'le': lambda f, v: f <= v,
+    'in': lambda f, v: f.in_(_values(v)),
+    'startswith': lambda f, v: f.like('%s%%' % _like(v), escape='\\'),
+    'contains': lambda f, v: f.like('%%%s%%' % _like(v), escape='\\'),
+    'isnull': lambda f, v: (f.is_(None) if v.lower() not in FALSE_VALUES else
+                            f.isnot(None)),
+    'range': _range
+}
+MULTI_VALUE_FILTERS = frozenset(('in', 'range'))
+
+
+def column_converter(col):
+    '''Converter of values of a sqlalchemy column ``col`` into
+    JSON-friendly values, ``None`` if values do not require conversion
+    '''
+    type = col.type
+    # Enum types are String subclasses, check them first
+    if isinstance(type, (TypeDecorator, EnumType)):
+        return _to_json
+    elif isinstance(type, DateTime):
+        return _datetime
+    elif isinstance(type, Date):
+        return _date
+    elif isinstance(type, (Integer, Boolean, String)):
+        return None
+    elif isinstance(type, Float) and not type.asdecimal:
+        return None
+    return _to_json
+
+
+def _datetime(value):
+    if not value.tzinfo:
+        value = pytz.utc.localize(value)
+    return value.isoformat()
+
+
+def _date(value):
+    return value.isoformat()
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return _datetime(value)
+    elif isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, Enum):
+        return value.name
+    try:
+        json.dumps(value)
+    except TypeError:
+        value = str(value)
+    return value
+
+
+def _attribute_value(request, obj, name):
+    data = getattr(obj, name)
+    if hasattr(data, '__call__'):
+        data = data()
+    return _to_json(data)
+
+
 def column_info(name, col):
     sortable = True
     filter = True
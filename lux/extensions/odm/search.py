@@ -0,0 +1,287 @@
+'''Full text search for database models.
+
+A model declares its searchable columns via the ``__search__`` attribute,
+either a sequence of column names, in order of importance, or a
+dictionary mapping column names to weights from ``A`` (most important)
+to ``D``::
+
+    class Task(Model):
+        id = Column(Integer, primary_key=True)
+        subject = Column(String(250))
+        description = Column(Text)
+
+        __search__ = ('subject', 'description')
+
+The text in the :setting:`API_SEARCH_KEY` url parameter of collection
+responses is matched by a :class:`.SearchEngine` selected by the database
+dialect:
+
+* :class:`.PostgreSqlSearch` uses ``tsvector`` with a GIN expression index
+* :class:`.SqliteSearch` uses an FTS5 external content table kept in sync
+  with the model table via triggers
+* :class:`.LikeSearch` matches words with ``LIKE`` in any other database
+
+The search structures are created together with the tables (the
+``create_tables`` command) and, for existing databases, by the
+``alembic search`` command which writes a migration calling
+:func:`create_search_index` and :func:`drop_search_index`.
+'''
+import re
+
+from sqlalchemy import (func, or_, false, literal_column, column, table,
+                        event, DDL)
+from sqlalchemy.dialects import postgresql
+
+
+__all__ = ['SearchEngine', 'PostgreSqlSearch', 'SqliteSearch',
+           'LikeSearch', 'register_search_engine', 'search_engine',
+           'search_columns', 'search_ddl', 'create_search_index',
+           'drop_search_index']
+
+
+WEIGHTS = ('A', 'B', 'C', 'D')
+# relative weights of A, B, C and D as in PostgreSQL ts_rank
+RANK_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+
+search_engines = {}
+words = re.compile(r'\w+', re.UNICODE)
+
+
+def register_search_engine(dialect, engine):
+    '''Register a :class:`.SearchEngine` class for a database ``dialect``
+    '''
+    search_engines[dialect] = engine
+
+
+def search_columns(model):
+    '''List of ``(name, weight)`` pairs of searchable columns of ``model``,
+    a declarative model or a table
+    '''
+    tbl = getattr(model, '__table__', model)
+    if 'search' in tbl.info:
+        return tbl.info['search']
+    columns = getattr(model, '__search__', None)
+    if not columns:
+        return []
+    if isinstance(columns, dict):
+        for weight in columns.values():
+            assert weight in WEIGHTS, 'Invalid search weight %s' % weight
+        return sorted(columns.items(), key=lambda c: (c[1], c[0]))
+    return [(name, WEIGHTS[min(n, 3)]) for n, name in enumerate(columns)]
+
+
+def search_engine(model, dialect, language='english'):
+    '''The :class:`.SearchEngine` of ``model`` for a database ``dialect``
+
+    Return ``None`` if ``model`` has no searchable columns
+    '''
+    columns = search_columns(model)
+    if columns:
+        engine = search_engines.get(dialect, LikeSearch)
+        return engine(getattr(model, '__table__', model), columns, language)
+
+
+def search_ddl(model, language='english'):
+    '''Create and drop the search structures of ``model`` together with
+    its table
+    '''
+    tbl = getattr(model, '__table__', model)
+    columns = search_columns(model)
+    if not columns:
+        return
+    tbl.info['search'] = columns
+    for dialect, engine in search_engines.items():
+        engine = engine(tbl, columns, language)
+        for sql in engine.create():
+            event.listen(tbl, 'after_create',
+                         DDL(sql).execute_if(dialect=dialect))
+        for sql in engine.drop():
+            event.listen(tbl, 'before_drop',
+                         DDL(sql).execute_if(dialect=dialect))
+
+
+def create_search_index(name, columns, pkey='id', language='english'):
+    '''Create the search structures of table ``name`` in a migration
+
+    :param name: table name
+    :param columns: list of ``(column name, weight)`` pairs
+    :param pkey: the integer primary key of the table
+    '''
+    from alembic import op
+    engine = _migration_engine(op, name, columns, pkey, language)
+    for sql in engine.create():
+        op.execute(sql)
+
+
+def drop_search_index(name, columns, pkey='id', language='english'):
+    '''Drop the search structures of table ``name`` in a migration
+    '''
+    from alembic import op
+    engine = _migration_engine(op, name, columns, pkey, language)
+    for sql in engine.drop():
+        op.execute(sql)
+
+
+class SearchEngine:
+    '''Base class for full text search backends
+
+    .. attribute:: table
+
+        the table to search
+
+    .. attribute:: columns
+
+        list of ``(name, weight)`` pairs of searchable columns
+
+    .. attribute:: name
+
+        name of the search index or table
+    '''
+    def __init__(self, table, columns, language='english', pkey=None):
+        assert re.match(r'^\w+$', language), 'Invalid language %s' % language
+        self.table = table
+        self.columns = columns
+        self.language = language
+        if pkey is None:
+            pkey, = table.primary_key.columns.keys()
+        self.pkey = pkey
+        self.name = '%s_search' % table.name
+
+    def search(self, query, text):
+        '''Filter ``query`` with rows matching ``text``
+        '''
+        raise NotImplementedError
+
+    def rank(self, text):
+        '''An expression ranking rows matching ``text``, higher values
+        for better matches. ``None`` if ranking is not supported
+        '''
+
+    def create(self):
+        '''List of SQL statements creating the search structures
+        '''
+        return ()
+
+    def drop(self):
+        '''List of SQL statements dropping the search structures
+        '''
+        return ()
+
+
+class PostgreSqlSearch(SearchEngine):
+    '''Search with the ``tsvector`` of the weighted columns
+
+    The ``tsvector`` expression is indexed with a GIN index so that
+    the same expression in queries uses the index.
+    '''
+    def search(self, query, text):
+        return query.filter(self.vector().op('@@')(self.tsquery(text)))
+
+    def rank(self, text):
+        return func.ts_rank(self.vector(), self.tsquery(text))
+
+    def create(self):
+        vector = self.vector(False).compile(
+            dialect=postgresql.dialect(),
+            compile_kwargs={'literal_binds': True})
+        return ('CREATE INDEX %s ON %s USING gin ((%s))' %
+                (self.name, self.table.name, vector),)
+
+    def drop(self):
+        return ('DROP INDEX IF EXISTS %s' % self.name,)
+
+    def config(self):
+        return literal_column("'%s'::regconfig" % self.language)
+
+    def tsquery(self, text):
+        return func.plainto_tsquery(self.config(), text)
+
+    def vector(self, qualified=True):
+        config = self.config()
+        vector = None
+        for name, weight in self.columns:
+            col = self.table.c[name] if qualified else column(name)
+            value = func.setweight(
+                func.to_tsvector(config, func.coalesce(col, '')), weight)
+            vector = value if vector is None else vector.op('||')(value)
+        return vector
+
+
+class SqliteSearch(SearchEngine):
+    '''Search with an FTS5 external content table
+
+    Words are matched as quoted strings so that the FTS5 query syntax
+    is not exposed to clients. Rows are ranked with ``bm25`` and the
+    column weights.
+    '''
+    def search(self, query, text):
+        text = ' '.join(('"%s"' % w for w in words.findall(text)))
+        fts = self.fts()
+        query = query.join(fts, fts.c.rowid == self.table.c[self.pkey])
+        if not text:
+            return query.filter(false())
+        return query.filter(literal_column(self.name).op('MATCH')(text))
+
+    def rank(self, text):
+        return -self.fts().c.rank
+
+    def create(self):
+        names = [name for name, _ in self.columns]
+        cols = ', '.join(names)
+        new = ', '.join(('new.%s' % name for name in names))
+        old = ', '.join(('old.%s' % name for name in names))
+        weights = ', '.join((str(RANK_WEIGHTS[w]) for _, w in self.columns))
+        insert = ('INSERT INTO %s(rowid, %s) VALUES (new.%s, %s);' %
+                  (self.name, cols, self.pkey, new))
+        delete = ("INSERT INTO %s(%s, rowid, %s) VALUES "
+                  "('delete', old.%s, %s);" %
+                  (self.name, self.name, cols, self.pkey, old))
+        trigger = 'CREATE TRIGGER %s_%s AFTER %s ON %s BEGIN %s END'
+        return ("CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', "
+                "content_rowid='%s')" % (self.name, cols, self.table.name,
+                                         self.pkey),
+                "INSERT INTO %s(%s, rank) VALUES ('rank', 'bm25(%s)')" %
+                (self.name, self.name, weights),
+                trigger % (self.name, 'ai', 'INSERT', self.table.name,
+                           insert),
+                trigger % (self.name, 'ad', 'DELETE', self.table.name,
+                           delete),
+                trigger % (self.name, 'au', 'UPDATE', self.table.name,
+                           delete + ' ' + insert),
+                "INSERT INTO %s(%s) VALUES ('rebuild')" %
+                (self.name, self.name))
+
+    def drop(self):
+        return tuple(('DROP TRIGGER IF EXISTS %s_%s' % (self.name, t)
+                      for t in ('ai', 'ad', 'au'))) + (
+            'DROP TABLE IF EXISTS %s' % self.name,)
+
+    def fts(self):
+        return table(self.name, column('rowid'), column('rank'))
+
+
+class LikeSearch(SearchEngine):
+    '''Match each word in any of the searchable columns with ``LIKE``
+
+    Used for databases without a full text search backend, it does not
+    use indexes and does not rank rows.
+    '''
+    def search(self, query, text):
+        columns = [self.table.c[name] for name, _ in self.columns]
+        for word in words.findall(text):
+            word = '%%%s%%' % word.replace('_', '\\_')
+            query = query.filter(or_(*[col.ilike(word, escape='\\')
+                                       for col in columns]))
+        return query
+
+
+register_search_engine('postgresql', PostgreSqlSearch)
+register_search_engine('sqlite', SqliteSearch)
+
+
+def _migration_engine(op, name, columns, pkey, language):
+    dialect = op.get_context().dialect.name
+    names = [c for c, _ in columns]
+    tbl = table(name, *[column(c) for c in names + [pkey]])
+    engine = search_engines.get(dialect, LikeSearch)
+    return engine(tbl, columns, language, pkey)
@@ -1,7 +1,7 @@
-from sqlalchemy.exc import DataError
+from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
-from pulsar import PermissionDenied, MethodNotAllowed, Http404
+from pulsar import PermissionDenied, MethodNotAllowed, Http404, BadRequest
 from pulsar.apps.wsgi import Json
 
 import odm
@@ -12,6 +12,11 @@ from lux.extensions import rest
 from .models import RestModel
 
 
+BULK_ACTIONS = {'create': rest.CREATE,
+                'update': rest.UPDATE,
+                'delete': rest.DELETE}
+
+
 class RestRouter(rest.RestRouter):
     '''A REST Router based on database models
     '''
@@ -104,6 +109,120 @@ class CRUD(RestRouter):
             return Json(meta).http_response(request)
         raise PermissionDenied
 
+    @route('_bulk', method=('post', 'options'))
+    def bulk(self, request):
+        '''Create, update and delete several models in one transaction
+
+        The body is a list of operations. Each operation is a dictionary
+        with the ``action`` (``create``, ``update`` or ``delete``), the
+        ``id`` of the model to update or delete and the ``data`` validated
+        by the model ``form`` or ``updateform``. The response contains
+        the ``status`` and ``result`` of each operation.
+        '''
+        if request.method == 'OPTIONS':
+            request.app.fire('on_preflight', request)
+            return request.response
+
+        model = self.model(request.app)
+        operations, _ = request.data_and_files()
+        if not isinstance(operations, list):
+            raise BadRequest('A list of operations is required')
+        if len(operations) > request.config['API_BULK_LIMIT']:
+            raise BadRequest('Too many operations')
+        actions = set()
+        for op in operations:
+            action = op.get('action') if isinstance(op, dict) else None
+            if action not in BULK_ACTIONS:
+                raise BadRequest('Invalid operation')
+            actions.add(action)
+        if (('create' in actions and not model.form) or
+                ('update' in actions and not model.updateform)):
+            raise MethodNotAllowed
+        for action in actions:
+            self.check_model_permission(request, BULK_ACTIONS[action])
+
+        create_columns = model.column_fields(
+            model.columns_with_permission(request, rest.CREATE), 'name')
+        update_columns = model.column_fields(
+            model.columns_with_permission(request, rest.UPDATE), 'name')
+        results = [None]*len(operations)
+        creates, updates = [], []
+        idcolumn = getattr(model.db_model(), model.id_field)
+        try:
+            with model.session(request) as session:
+                ids = [op.get('id') for op in operations
+                       if op['action'] != 'create']
+                instances = {}
+                if ids:
+                    query = model.query(request, session)
+                    for instance in query.filter(idcolumn.in_(ids)):
+                        pkey = str(getattr(instance, model.id_field))
+                        instances[pkey] = instance
+
+                for index, op in enumerate(operations):
+                    action = op['action']
+                    data = op.get('data') or {}
+                    if action == 'create':
+                        form = model.form(request, data=data)
+                        if form.is_valid():
+                            # As in post, silently drop data for columns
+                            # the user doesn't have access to
+                            creates.append((index, {
+                                k: v for k, v in form.cleaned_data.items()
+                                if k in create_columns}))
+                        else:
+                            results[index] = {'status': 422,
+                                              'result': form.tojson()}
+                        continue
+
+                    instance = instances.get(str(op.get('id')))
+                    if instance is None:
+                        results[index] = {'status': 404}
+                    elif action == 'update':
+                        form = model.updateform(request, data=data,
+                                                previous_state=instance)
+                        if form.is_valid(exclude_missing=True):
+                            updates.append((index, instance, {
+                                k: v for k, v in form.cleaned_data.items()
+                                if k in update_columns}))
+                        else:
+                            results[index] = {'status': 422,
+                                              'result': form.tojson()}
+                    else:
+                        model.delete_model(request, instance)
+                        results[index] = {'status': 204}
+
+                pkeys = model.bulk_create(request,
+                                          [data for _, data in creates],
+                                          session)
+                statuses = [(index, pkey, 201) for (index, _), pkey
+                            in zip(creates, pkeys)]
+                # primary keys before bulk_update expires the instances
+                statuses.extend([(index, getattr(obj, model.id_field), 200)
+                                 for index, obj, _ in updates])
+                model.bulk_update(request,
+                                  [(obj, data) for _, obj, data in updates],
+                                  session)
+                if statuses:
+                    objs = model.query(request, session).filter(
+                        idcolumn.in_([pkey for _, pkey, _ in statuses]))
+                    objs = list(objs)
+                    data = dict(zip((getattr(obj, model.id_field)
+                                     for obj in objs),
+                                    model.serialise(request, objs)))
+                    for index, pkey, status in statuses:
+                        results[index] = {'status': status,
+                                          'result': data.get(pkey)}
+        except (DataError, IntegrityError) as exc:
+            odm.logger.exception('Could not apply bulk operations')
+            request.response.status_code = 422
+            data = {'message': str(exc)}
+        else:
+            # forms with errors set the response status code
+            request.response.status_code = 200
+            data = {'result': results}
+        return Json(data).http_response(request)
+
     @route('<id>', method=('get', 'post', 'put', 'delete', 'head', 'options'))
     def read_update_delete(self, request):
         if request.method == 'OPTIONS':
@@ -111,8 +230,8 @@ class CRUD(RestRouter):
             return request.response
 
         model = self.model(request.app)
-        odm = request.app.odm()
-        with odm.begin() as session:
+        read_only = request.method in ('GET', 'HEAD')
+        with model.session(request, read_only=read_only) as session:
             instance = self.get_instance(request, session=session)
 
             if request.method == 'GET':
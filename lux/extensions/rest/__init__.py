@@ -25,6 +25,7 @@ from lux.core.wrappers import wsgi_request
 from .user import *             # noqa
 from .auth import *             # noqa
 from .models import *           # noqa
+from .models import TOTALS
 from .pagination import *       # noqa
 from .client import ApiClient
 from .views import *            # noqa
@@ -60,6 +61,10 @@ class Extension(MultiAuthBackend):
                   'Python dotted path to module which provides the '
                   '``encrypt`` and, optionally, ``decrypt`` method for '
                   'password and sensitive data encryption/decryption'),
+        Parameter('CRYPT_PROCESS_POOL', 0,
+                  'Number of processes for password hashing, requires '
+                  'GREEN_POOL. When 0 passwords are hashed in the calling '
+                  'thread'),
         Parameter('SECRET_KEY',
                   'secret-key',
                   'A string or bytes used for encrypting data. Must be unique '
@@ -82,6 +87,26 @@ class Extension(MultiAuthBackend):
                   'The query key for full text search'),
         Parameter('API_OFFSET_KEY', 'offset', ''),
         Parameter('API_LIMIT_KEY', 'limit', ''),
+        Parameter('API_CURSOR_KEY', 'cursor',
+                  'The query key for cursor (keyset) pagination'),
+        Parameter('API_TOTAL', 'exact',
+                  'Default strategy for the total number of items in '
+                  'collection responses: exact, cached, estimated or none'),
+        Parameter('API_TOTAL_KEY', 'total',
+                  'The query key for selecting the total strategy'),
+        Parameter('API_TOTAL_CACHE_TIMEOUT', 60,
+                  'Timeout in seconds of totals cached by the cached '
+                  'total strategy'),
+        Parameter('API_FIELDS_KEY', 'fields',
+                  'The query key for a comma separated list of fields '
+                  'to include in responses'),
+        Parameter('API_STREAM_KEY', 'stream',
+                  'The query key for streaming collection responses'),
+        Parameter('API_STREAM_LIMIT', 100000,
+                  'Maximum number of items in a streamed collection '
+                  'response for authenticated users'),
+        Parameter('API_BULK_LIMIT', 1000,
+                  'Maximum number of operations in a bulk request'),
         Parameter('API_LIMIT_DEFAULT', 25,
                   'Default number of items returned when no limit '
                   'API_LIMIT_KEY available in the url'),
@@ -106,6 +131,12 @@ class Extension(MultiAuthBackend):
     def on_config(self, app):
         self.backends = []
 
+        total = app.config['API_TOTAL']
+        if total not in TOTALS:
+            raise ImproperlyConfigured('Unknown API_TOTAL strategy "%s", '
+                                       'must be one of %s'
+                                       % (total, ', '.join(TOTALS)))
+
         url = app.config['API_URL']
         if url is not None and not is_absolute_uri(url):
             app.config['API_URL'] = str(RestRoot(url))
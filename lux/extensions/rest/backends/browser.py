@@ -12,7 +12,7 @@ from .mixins import jwt, SessionBackendMixin
 from .registration import RegistrationMixin
 from .. import (AuthenticationError, AuthBackend, luxrest,
                 User, Session, ModelMixin)
-from ..policy import has_permission
+from ..policy import has_permission, user_policy_set
 from ..htmlviews import ForgotPassword, Login, Logout, SignUp
 
 
@@ -182,8 +182,9 @@ class ApiSessionBackend(SessionBackendMixin,
         if user.is_superuser():
             return True
         else:
-            permissions = getattr(user, 'permissions', None)
-            return has_permission(request, permissions, name, level)
+            policies = user_policy_set(
+                request, lambda: getattr(user, 'permissions', None))
+            return has_permission(request, policies, name, level)
 
     def create_session(self, request, user=None):
         '''Login and return response
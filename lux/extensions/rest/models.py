@@ -1,14 +1,20 @@
 import json
 import logging
+import hashlib
 from copy import copy
+from itertools import islice
 
-from pulsar import PermissionDenied
+from pulsar import PermissionDenied, BadRequest
 from pulsar.utils.html import nicename
 from pulsar.apps.wsgi import Json
 
 from .user import READ, PERMISSION_LEVELS
+from .pagination import encode_cursor, decode_cursor
 
 PERMISSIONS = ['UPDATE', 'CREATE', 'DELETE']
+# Strategies for the total number of items, from the most expensive
+TOTALS = ('exact', 'cached', 'estimated', 'none')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
 
 logger = logging.getLogger('lux.extensions.rest')
 
@@ -179,17 +185,30 @@ class RestModel(ColumnPermissionsMixin):
 
         Optional list of column names which will have the hidden attribute
         set to True in the :class:`.RestColumn` metadata
+
+    .. attribute:: total
+
+        Optional strategy for the total number of items in collection
+        responses, one of ``exact``, ``cached``, ``estimated`` or ``none``.
+        If not provided the :setting:`API_TOTAL` setting is used
+
+    .. attribute:: stream_batch
+
+        Number of items fetched and serialised at once by
+        :meth:`stream_response`
     '''
     remote_options_str = 'item.id as item.name for item in {options}'
     remote_options_str_ui_select = 'item.id as item in {options}'
+    stream_batch = 500
     _app = None
     _loaded = False
 
     def __init__(self, name, form=None, updateform=None, columns=None,
                  url=None, api_name=None, exclude=None,
                  api_url=None, html_url=None, id_field=None,
-                 repr_field=None, hidden=None):
+                 repr_field=None, hidden=None, total=None):
         assert name, 'model name not available'
+        assert total in TOTALS or total is None, 'unknown total %s' % total
         self.name = name
         self.form = form
         self.updateform = updateform
@@ -202,6 +221,7 @@ class RestModel(ColumnPermissionsMixin):
         self._columns = columns
         self._exclude = set(exclude or ())
         self._hidden = set(hidden or ())
+        self._total = total
 
     def __repr__(self):
         return self.name
@@ -219,10 +239,10 @@ class RestModel(ColumnPermissionsMixin):
         '''
         raise NotImplementedError
 
-    def session(self, request):
+    def session(self, request, read_only=False):
         '''Return a session for aggregating a query.
         The retunred object should be context manager and support the query
-        method.
+        method. ``read_only`` sessions are not used for writing.
         '''
         raise NotImplementedError
 
@@ -306,6 +326,25 @@ class RestModel(ColumnPermissionsMixin):
         default = default or ''
         return request.url_data.get(cfg['API_SEARCH_KEY'], default)
 
+    def fields(self, request):
+        '''Set of field names requested via the :setting:`API_FIELDS_KEY`
+        url parameter, ``None`` if not given
+        '''
+        value = request.url_data.get(request.config['API_FIELDS_KEY'])
+        if value:
+            if isinstance(value, list):
+                value = ','.join(value)
+            return frozenset((f.strip() for f in value.split(',')
+                              if f.strip()))
+
+    def select_columns(self, request, columns):
+        '''Restrict ``columns`` to the requested :meth:`fields`
+        '''
+        fields = self.fields(request)
+        if fields is None:
+            return columns
+        return tuple((col for col in columns if col['name'] in fields))
+
     def serialise(self, request, data, **kw):
         if isinstance(data, list):
             kw['in_list'] = True
@@ -320,48 +359,213 @@ class RestModel(ColumnPermissionsMixin):
         params.update(request.url_data)
         limit = params.pop(cfg['API_LIMIT_KEY'], None)
         offset = params.pop(cfg['API_OFFSET_KEY'], None)
-        with self.session(request) as session:
+        cursor = params.pop(cfg['API_CURSOR_KEY'], None)
+        stream = params.pop(cfg['API_STREAM_KEY'], None)
+        params.pop(cfg['API_FIELDS_KEY'], None)
+        params.pop(cfg['API_TOTAL_KEY'], None)
+        if stream and stream not in FALSE_VALUES:
+            return self.stream_response(request, *filters, limit=limit,
+                                        offset=offset,
+                                        ndjson=stream == 'ndjson',
+                                        **params)
+        with self.session(request, read_only=True) as session:
             query = self.query(request, session, *filters)
             return self.query_response(request, query, limit=limit,
-                                       offset=offset, **params)
+                                       offset=offset, cursor=cursor,
+                                       **params)
 
     def query_response(self, request, query, limit=None, offset=None,
-                       text=None, sortby=None, max_limit=None, **params):
+                       text=None, sortby=None, max_limit=None, cursor=None,
+                       **params):
+        '''Response for a list of models from ``query``
+
+        When ``cursor`` is given (an empty string for the first page) the
+        keyset pagination of :meth:`cursor_response` is used rather
+        than ``limit`` and ``offset``.
+        '''
         limit = self.limit(request, limit, max_limit)
-        offset = self.offset(request, offset)
         text = self.search_text(request, text)
         sortby = request.url_data.get('sortby', sortby)
         query = self.filter(request, query, text, params)
-        total = query.count()
+        if cursor is not None:
+            return self.cursor_response(request, query, cursor, limit,
+                                        sortby, **params)
+        offset = self.offset(request, offset)
+        total = self.total(request, query)
         query = self.sortby(request, query, sortby)
-        data = query.limit(limit).offset(offset).all()
+        if total is None:
+            data = query.limit(limit + 1).offset(offset).all()
+            more = len(data) > limit
+            data = self.serialise(request, data[:limit], **params)
+            data = request.app.pagination(request, data, total, limit,
+                                          offset, more=more)
+        else:
+            data = query.limit(limit).offset(offset).all()
+            data = self.serialise(request, data, **params)
+            data = request.app.pagination(request, data, total, limit,
+                                          offset)
+        return Json(data).http_response(request)
+
+    def stream_response(self, request, *filters, limit=None, offset=None,
+                        text=None, sortby=None, ndjson=False, **params):
+        '''Stream a possibly large list of models
+
+        Rows are fetched from the database and serialised in batches of
+        :attr:`stream_batch` items and written to the client as soon
+        as they are available, so that the memory used does not depend
+        on the number of items. The response is either a JSON object
+        with the ``result`` list or, when ``ndjson`` is ``True``,
+        newline delimited JSON with one model per line.
+        Authenticated users can stream up to :setting:`API_STREAM_LIMIT`
+        items, anonymous users are subject to the usual :meth:`limit`.
+        '''
+        max_limit = None
+        if request.cache.user.is_authenticated():
+            max_limit = request.config['API_STREAM_LIMIT']
+            if limit is None:
+                limit = max_limit
+        limit = self.limit(request, limit, max_limit)
+        offset = self.offset(request, offset)
+        text = self.search_text(request, text)
+        sortby = request.url_data.get('sortby', sortby)
+        response = request.response
+        response.content_type = '%s; charset=utf-8' % (
+            'application/x-ndjson' if ndjson else 'application/json')
+        response.content = request.app.stream(
+            self._stream(request, filters, limit, offset, text, sortby,
+                         ndjson, params))
+        return response
+
+    def cursor_response(self, request, query, cursor, limit, sortby=None,
+                        **params):
+        '''Keyset pagination of ``query``.
+
+        Rows are ordered by the ``sortby`` keys followed by the
+        :attr:`id_field` and selected after (or before) the sort key values
+        encoded in the opaque ``cursor``. No offset is used and the total
+        number of items is calculated only when requested via the
+        :setting:`API_TOTAL_KEY` url parameter.
+        '''
+        total = self.total(request, query, 'none')
+        keys = self.cursor_keys(request, sortby)
+        values, before = decode_cursor(cursor) if cursor else (None, False)
+        if values is not None and len(values) != len(keys):
+            raise BadRequest('Invalid pagination cursor')
+        query = self._do_cursor(request, query, keys, values, before)
+        data = query.limit(limit + 1).all()
+        more = len(data) > limit
+        data = data[:limit]
+        next = prev = None
+        if before:
+            data.reverse()
+        if data:
+            first = [self._cursor_value(data[0], name) for name, _ in keys]
+            last = [self._cursor_value(data[-1], name) for name, _ in keys]
+            if more or before:
+                next = encode_cursor(last)
+            if values is not None and (more or not before):
+                prev = encode_cursor(first, True)
         data = self.serialise(request, data, **params)
-        data = request.app.pagination(request, data, total, limit, offset)
+        data = request.app.pagination.cursor(request, data, limit,
+                                             next=next, prev=prev,
+                                             total=total)
         return Json(data).http_response(request)
 
+    def cursor_keys(self, request, sortby=None):
+        '''List of ``(field, descending)`` sort keys for cursor pagination
+
+        The :attr:`id_field` is always the last key so that the ordering
+        is total.
+        '''
+        keys = []
+        for entry, direction in self.sort_entries(sortby):
+            if entry != self.id_field:
+                keys.append((entry, direction == 'desc'))
+        keys.append((self.id_field, False))
+        return keys
+
+    def sort_entries(self, sortby):
+        '''List of ``(field, direction)`` pairs from ``sortby`` entries
+        of the form ``field`` or ``field:direction``.
+
+        Raise :class:`.BadRequest` for an invalid direction
+        '''
+        entries = []
+        if sortby:
+            if not isinstance(sortby, list):
+                sortby = (sortby,)
+            for entry in sortby:
+                direction = None
+                if ':' in entry:
+                    entry, direction = entry.rsplit(':', 1)
+                    if direction not in ('asc', 'desc'):
+                        raise BadRequest('Invalid sort direction')
+                entries.append((entry, direction))
+        return entries
+
+    def total_strategy(self, request, default=None):
+        '''The strategy for calculating the total number of items.
+
+        The strategy is given by the :setting:`API_TOTAL_KEY` url
+        parameter, provided it is not more expensive than the strategy
+        of this model, otherwise by ``default`` or the model strategy.
+        '''
+        cfg = request.config
+        strategy = self._total or cfg['API_TOTAL']
+        value = request.url_data.get(cfg['API_TOTAL_KEY'])
+        if value in TOTALS and TOTALS.index(value) >= TOTALS.index(strategy):
+            return value
+        return default or strategy
+
+    def total(self, request, query, default=None):
+        '''The total number of items in ``query`` or ``None``
+
+        Calculated according to the :meth:`total_strategy`
+        '''
+        strategy = self.total_strategy(request, default)
+        if strategy == 'none':
+            return None
+        elif strategy == 'cached':
+            return self._cached_total(request, query)
+        elif strategy == 'estimated':
+            return self._estimated_total(request, query)
+        return query.count()
+
     def filter(self, request, query, text, params):
-        columns = self.columnsMapping(request.app)
+        if text:
+            query = self._do_search(request, query, text)
+        filters = self.filters(request, params)
+        if filters:
+            query = self._do_filters(request, query, filters)
+        return query
+
+    def filters(self, request, params):
+        '''Parse filters from url ``params``
 
+        A filter is given by a ``field:op=value`` parameter, where the
+        operator defaults to ``eq``. Filters with the same ``group.``
+        prefix, for example ``or.done=1&or.subject:contains=foo``, are
+        combined with OR, all other filters and groups with AND.
+
+        :return: a list of ``(group, field, op, value)`` tuples
+        '''
+        columns = self.columnsMapping(request.app)
+        filters = []
         for key, value in params.items():
+            group = None
+            if '.' in key:
+                group, key = key.split('.', 1)
             bits = key.split(':')
-            field = bits[0]
-            if field in columns:
-                col = columns[field]
+            if bits[0] in columns and len(bits) <= 2:
                 op = bits[1] if len(bits) == 2 else 'eq'
-                field = col.get('field')
+                field = columns[bits[0]].get('field')
                 if field:
-                    query = self._do_filter(request, query, field, op, value)
-        return query
+                    filters.append((group, field, op, value))
+        return filters
 
     def sortby(self, request, query, sortby=None):
-        if sortby:
-            if not isinstance(sortby, list):
-                sortby = (sortby,)
-            for entry in sortby:
-                direction = None
-                if ':' in entry:
-                    entry, direction = entry.split(':')
-                query = self._do_sortby(request, query, entry, direction)
+        for entry, direction in self.sort_entries(sortby):
+            query = self._do_sortby(request, query, entry, direction)
         return query
 
     def meta(self, request, exclude=None):
@@ -401,9 +605,81 @@ class RestModel(ColumnPermissionsMixin):
     def _do_sortby(self, request, query, entry, direction):
         raise NotImplementedError
 
+    def _do_search(self, request, query, text):
+        return query
+
+    def _do_filters(self, request, query, filters):
+        for group, field, op, value in filters:
+            if group:
+                raise BadRequest('Filter groups are not supported')
+            query = self._do_filter(request, query, field, op, value)
+        return query
+
     def _do_filter(self, request, query, field, op, value):
         raise NotImplementedError
 
+    def _cached_total(self, request, query):
+        signature = self._total_signature(request, query)
+        if not signature:
+            return query.count()
+        signature = hashlib.sha1(signature.encode('utf-8')).hexdigest()
+        key = ('%s:total:%s:%s' % (request.config['APP_NAME'], self.name,
+                                   signature)).lower()
+        cache = request.app.cache_server
+        total = cache.get(key)
+        if total is None:
+            total = query.count()
+            cache.set(key, total,
+                      timeout=request.config['API_TOTAL_CACHE_TIMEOUT'])
+        return int(total)
+
+    def _estimated_total(self, request, query):
+        return query.count()
+
+    def _total_signature(self, request, query):
+        '''A string which uniquely identifies the rows in ``query``,
+        used as key by the ``cached`` total strategy
+        '''
+        pass
+
+    def _stream(self, request, filters, limit, offset, text, sortby,
+                ndjson, params):
+        with self.session(request, read_only=True) as session:
+            query = self.query(request, session, *filters)
+            query = self.filter(request, query, text, params)
+            query = self.sortby(request, query, sortby)
+            rows = self._stream_rows(query.limit(limit).offset(offset))
+            sep = b'\n' if ndjson else b','
+            if not ndjson:
+                yield b'{"result":['
+            first = True
+            while True:
+                batch = list(islice(rows, self.stream_batch))
+                if not batch:
+                    break
+                data = self.serialise(request, batch, **params)
+                chunk = sep.join((json.dumps(d).encode('utf-8')
+                                  for d in data))
+                if ndjson:
+                    chunk += sep
+                elif not first:
+                    chunk = sep + chunk
+                first = False
+                yield chunk
+            if not ndjson:
+                yield b']}'
+
+    def _stream_rows(self, query):
+        '''Iterator over the rows of a streamed ``query``
+        '''
+        return iter(query.all())
+
+    def _do_cursor(self, request, query, keys, values, before):
+        raise BadRequest('Cursor pagination not available')
+
+    def _cursor_value(self, obj, name):
+        return getattr(obj, name)
+
     def _add_to_app(self, app):
         model = copy(self)
         model._app = app
@@ -1,7 +1,41 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import date
+
+from pulsar import BadRequest
 from pulsar.utils.httpurl import iri_to_uri
 
 
-__all__ = ['Pagination', 'GithubPagination']
+__all__ = ['Pagination', 'GithubPagination', 'encode_cursor',
+           'decode_cursor']
+
+
+def encode_cursor(values, before=False):
+    '''Encode the sort key ``values`` of a row into an opaque cursor.
+
+    :param values: list of values of the sort keys
+    :param before: if ``True`` the cursor points to the rows before
+        ``values``, otherwise to the rows after
+    '''
+    data = json.dumps([values, 1 if before else 0], default=_json_default,
+                      separators=(',', ':'))
+    return urlsafe_b64encode(data.encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''Decode a cursor created by :func:`encode_cursor`.
+
+    Return a two elements tuple, the list of values and the ``before``
+    flag. Raise :class:`~pulsar.BadRequest` if the cursor is not valid.
+    '''
+    try:
+        cursor = cursor + '=' * (-len(cursor) % 4)
+        values, before = json.loads(
+            urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8'))
+        assert isinstance(values, list)
+    except Exception:
+        raise BadRequest('Invalid pagination cursor')
+    return values, bool(before)
 
 
 class Pagination:
@@ -19,12 +53,19 @@ class Pagination:
             prev_offset = offset - olimit
             return self.link(request, prev_offset, olimit)
 
-    def next_link(self, request, total, limit, offset):
+    def next_link(self, request, total, limit, offset, more=None):
+        '''Link to the next page.
+
+        When the ``total`` is not known, ``more`` indicates if there are
+        items after the current page.
+        '''
         next_offset = offset + limit
-        if total > next_offset:
+        if (more if total is None else total > next_offset):
             return self.link(request, next_offset, limit)
 
     def last_link(self, request, total, limit, offset):
+        if total is None:
+            return
         n = self._count_part(total, limit, offset)
         if n > 0:
             return self.link(request, offset + n*limit, limit)
@@ -37,11 +78,16 @@ class Pagination:
         location = iri_to_uri(request.path, params)
         return request.absolute_uri(location)
 
-    def __call__(self, request, result, total, limit, offset):
-        data = {
-            'total': total,
-            'result': result
-        }
+    def __call__(self, request, result, total, limit, offset, more=None):
+        '''Build the paginated collection response.
+
+        :param total: total number of items or ``None`` if not known.
+        :param more: when the ``total`` is not known, ``True`` if there are
+            more items after this page.
+        '''
+        data = {'result': result}
+        if total is not None:
+            data['total'] = total
         first = self.first_link(request, total, limit, offset)
         if first:
             data['first'] = first
@@ -49,14 +95,46 @@ class Pagination:
             if prev != first:
                 data['prev'] = prev
 
-        next = self.next_link(request, total, limit, offset)
+        next = self.next_link(request, total, limit, offset, more)
         if next:
             last = self.last_link(request, total, limit, offset)
             if last != next:
                 data['next'] = next
-            data['last'] = last
+            if last:
+                data['last'] = last
+        return data
+
+    def cursor(self, request, result, limit, next=None, prev=None,
+               total=None):
+        '''Cursor pagination counterpart of the ``__call__`` method.
+
+        :param next: cursor of the next page or ``None``
+        :param prev: cursor of the previous page or ``None``
+        :param total: optional total number of items
+        '''
+        data = {'result': result}
+        if total is not None:
+            data['total'] = total
+        for name, link in self.cursor_links(request, limit, next, prev):
+            data[name] = link
         return data
 
+    def cursor_links(self, request, limit, next=None, prev=None):
+        if prev:
+            yield 'first', self.cursor_link(request, '', limit)
+            yield 'prev', self.cursor_link(request, prev, limit)
+        if next:
+            yield 'next', self.cursor_link(request, next, limit)
+
+    def cursor_link(self, request, cursor, limit):
+        params = request.url_data.copy()
+        cfg = request.config
+        params.pop(cfg['API_OFFSET_KEY'], None)
+        params.update({cfg['API_CURSOR_KEY']: cursor,
+                       cfg['API_LIMIT_KEY']: limit})
+        location = iri_to_uri(request.path, params)
+        return request.absolute_uri(location)
+
     def _count_part(self, total, limit, offset):
         n = (total - offset) // limit
         # make sure we account for perfect matching
@@ -68,7 +146,7 @@ class Pagination:
 class GithubPagination(Pagination):
     '''Github style pagination
     '''
-    def __call__(self, request, result, total, limit, offset):
+    def __call__(self, request, result, total, limit, offset, more=None):
         links = []
         first = self.first_link(request, total, limit, offset)
         if first:
@@ -76,11 +154,25 @@ class GithubPagination(Pagination):
             prev = self.prev_link(request, total, limit, offset)
             if prev != first:
                 links.append(prev)
-        next = self.next_link(request, total, limit, offset)
+        next = self.next_link(request, total, limit, offset, more)
         if next:
             last = self.last_link(request, total, limit, offset)
             if last != next:
                 links.append(next)
-            links.append(last)
+            if last:
+                links.append(last)
+        request.response['links'] = links
+        return result
+
+    def cursor(self, request, result, limit, next=None, prev=None,
+               total=None):
+        links = [link for _, link in
+                 self.cursor_links(request, limit, next, prev)]
         request.response['links'] = links
         return result
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
@@ -1,3 +1,7 @@
+import json
+import hashlib
+
+from lux import LocalCache
 from lux.forms import ValidationError
 
 from .user import PERMISSION_LEVELS
@@ -52,21 +56,38 @@ def validate_single_policy(policy):
     return p
 
 
-def _check_policies(policies, name, level):
+def policy_set(permissions):
+    """
+    The compiled :class:`.PolicySet` of ``permissions``
+
+    Policy sets are cached by the digest of the permissions, so that
+    the same permissions are compiled once
+    :param permissions: dict of policies or a :class:`.PolicySet`
     """
-    Checks an action against a list of policies
-    :param policies:    dict of policies
-    :param name:        action name
-    :param level:       access level
-    :return:            True if access is granted, False if denied,
-                        None if no specific determination made
+    if isinstance(permissions, PolicySet):
+        return permissions
+    if not isinstance(permissions, dict) or not permissions:
+        return EMPTY_POLICY_SET
+    version = PolicySet.digest(permissions)
+    found, policies = policy_sets.get(version)
+    if not found:
+        policies = PolicySet(permissions, version)
+        policy_sets.set(version, policies)
+    return policies
+
+
+def user_policy_set(request, permissions):
     """
-    if isinstance(policies, dict):
-        for policy in policies.values():
-            permission = _has_permission(policy, name, level)
-            if permission is not None:
-                return permission
-    return None
+    The :class:`.PolicySet` of the request user, compiled once per request
+    :param permissions: callable returning the permissions of the user
+    """
+    cache = request.cache
+    user = cache.user
+    policies = cache.user_policy_set
+    if policies is None or policies[0] is not user:
+        policies = (user, policy_set(permissions()))
+        cache.user_policy_set = policies
+    return policies[1]
 
 
 def _check_default_level(default, level):
@@ -82,26 +103,89 @@ def _check_default_level(default, level):
 
 
 def has_permission(request, permissions, name, level):
+    """
+    Checks the action ``name`` against ``permissions``, from the most
+    specific action to its parents, separated by ``:``
+    :param permissions: dict of policies or a :class:`.PolicySet`
+    :return:            Boolean
+    """
+    policies = policy_set(permissions)
+    defaults = request.config['DEFAULT_PERMISSION_LEVELS']
     action = name
     while action:
-        permission = _check_policies(permissions, action, level)
+        parent = action.rpartition(':')[0]
+        permission = policies.effect(action, parent)
         if permission is not None:
             return permission
         else:
-            default = request.config['DEFAULT_PERMISSION_LEVELS'].get(action)
+            default = defaults.get(action)
             if default is not None:
                 return _check_default_level(default, level)
-        action = action.rpartition(':')[0]
+        action = parent
 
     default = request.config['DEFAULT_PERMISSION_LEVEL']
     return _check_default_level(default, level)
 
 
-def _has_permission(policy, name, level):
-    actions = policy['action']
-    if not isinstance(actions, list):
-        actions = (actions,)
-    for action in actions:
-        if name == action:
-            return EFFECTS[policy.get('effect', 'allow')]
-    return None
+class PolicySet:
+    """
+    Policies compiled into a dictionary mapping actions to effects
+
+    The first policy, in the order of ``permissions``, listing an action
+    determines its effect. An action ending with ``*`` is a wildcard for
+    all the children of the action, ``*`` alone for all actions.
+
+    .. attribute:: version
+
+        the digest of the compiled permissions
+    """
+    def __init__(self, permissions=None, version=None):
+        self.version = version
+        self.effects = {}
+        self.wildcards = False
+        for policy in (permissions or {}).values():
+            if isinstance(policy, dict):
+                policy = (policy,)
+            elif not isinstance(policy, list):
+                continue
+            for single in policy:
+                self._compile(single)
+
+    def __len__(self):
+        return len(self.effects)
+
+    @classmethod
+    def digest(cls, permissions):
+        value = json.dumps(permissions, sort_keys=True, default=str)
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    def effect(self, action, parent=None):
+        """
+        Effect of policies on ``action``, ``parent`` is the parent action
+        :return:            True if access is granted, False if denied,
+                            None if no specific determination made
+        """
+        effect = self.effects.get(action)
+        if effect is None and self.wildcards:
+            wildcard = '%s:*' % parent if parent else '*'
+            effect = self.effects.get(wildcard)
+        return effect
+
+    def _compile(self, policy):
+        if not isinstance(policy, dict) or not policy.get('action'):
+            return
+        effect = EFFECTS.get(policy.get('effect', 'allow'))
+        if effect is None:
+            return
+        actions = policy['action']
+        if not isinstance(actions, list):
+            actions = (actions,)
+        for action in actions:
+            if isinstance(action, str):
+                if action.endswith('*'):
+                    self.wildcards = True
+                self.effects.setdefault(action, effect)
+
+
+EMPTY_POLICY_SET = PolicySet()
+policy_sets = LocalCache(1000)
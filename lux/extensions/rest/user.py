@@ -1,5 +1,8 @@
+from functools import partial
 from importlib import import_module
+from concurrent.futures import ProcessPoolExecutor
 
+from pulsar import ImproperlyConfigured, get_event_loop
 from pulsar.utils.structures import AttributeDictionary
 from pulsar.utils.pep import to_bytes
 from pulsar.apps.wsgi import Json
@@ -161,7 +164,15 @@ class PasswordMixin:
 
     It has two basic methods,
     :meth:`.encrypt` and :meth:`.decrypt`.
+
+    When :setting:`CRYPT_PROCESS_POOL` is positive, :meth:`.encrypt` and
+    :meth:`.crypt_verify` called from the green pool run in a pool of
+    processes, so that hashing does not hold the GIL of the serving
+    process. The greenlet waits for the result without blocking the
+    event loop. The pool is shut down when the application stops.
     '''
+    crypt_pool = None
+
     def on_config(self, app):
         cfg = app.config
         self.encoding = cfg['ENCODING']
@@ -171,6 +182,15 @@ class PasswordMixin:
             ckwargs = dict(module=ckwargs)
         self.ckwargs = ckwargs.copy()
         self.crypt_module = import_module(self.ckwargs.pop('module'))
+        self.crypt_processes = cfg['CRYPT_PROCESS_POOL']
+        if self.crypt_processes and not cfg['GREEN_POOL']:
+            raise ImproperlyConfigured('CRYPT_PROCESS_POOL requires a '
+                                       'GREEN_POOL')
+
+    def on_stop(self, app):
+        if self.crypt_pool is not None:
+            self.crypt_pool.shutdown(wait=False)
+            self.crypt_pool = None
 
     def encrypt(self, string_or_bytes):
         '''Encrypt ``string_or_bytes`` using the algorithm specified
@@ -179,16 +199,14 @@ class PasswordMixin:
         Return an encrypted string
         '''
         b = to_bytes(string_or_bytes, self.encoding)
-        p = self.crypt_module.encrypt(b, self.secret_key, **self.ckwargs)
+        p = self._crypt(self.crypt_module.encrypt, b, self.secret_key)
         return p.decode(self.encoding)
 
     def crypt_verify(self, encrypted, raw):
         '''Verify if the ``raw`` string match the ``encrypted`` string
         '''
-        return self.crypt_module.verify(to_bytes(encrypted),
-                                        to_bytes(raw),
-                                        self.secret_key,
-                                        **self.ckwargs)
+        return self._crypt(self.crypt_module.verify, to_bytes(encrypted),
+                           to_bytes(raw), self.secret_key)
 
     def decrypt(self, string_or_bytes):
         b = to_bytes(string_or_bytes, self.encoding)
@@ -203,6 +221,18 @@ class PasswordMixin:
         else:
             return UNUSABLE_PASSWORD
 
+    def _crypt(self, method, *args):
+        func = partial(method, *args, **self.ckwargs)
+        if self.crypt_processes:
+            from pulsar.apps.greenio import getcurrent, wait
+            if getcurrent().parent:
+                if self.crypt_pool is None:
+                    self.crypt_pool = ProcessPoolExecutor(
+                        self.crypt_processes)
+                loop = get_event_loop()
+                return wait(loop.run_in_executor(self.crypt_pool, func))
+        return func()
+
 
 class User(AttributeDictionary, UserMixin):
     '''A dictionary-based user
@@ -33,11 +33,12 @@ from random import randint
 from hashlib import sha1
 from hashlib import sha256
 from hashlib import sha512
+from hashlib import pbkdf2_hmac
 from base64 import b64encode as _b64encode
 from binascii import b2a_hex as _b2a_hex
 
 
-__all__ = ['PBKDF2', 'crypt', 'encrypt', 'verify']
+__all__ = ['PBKDF2', 'pbkdf2', 'crypt', 'encrypt', 'verify']
 
 
 _0xffffffffL = 0xffffffff
@@ -206,6 +207,31 @@ class PBKDF2(object):
             self.closed = True
 
 
+def pbkdf2(passphrase, salt, iterations=24000, digestmodule=sha256,
+           secret_key=None, dklen=None):
+    """Derive a key of ``dklen`` bytes from ``passphrase`` and ``salt``.
+
+    Same result as reading ``dklen`` bytes from :class:`PBKDF2` but computed
+    by :func:`hashlib.pbkdf2_hmac`, which runs the iterations in C.
+    The ``secret_key`` salting of the pseudorandom function is equivalent
+    to using ``sha1(secret_key + passphrase)`` as the password.
+    Digest modules not supported by hashlib use :class:`PBKDF2`.
+    """
+    name = digestmodule().name.lower()
+    if name not in algorithms:
+        return PBKDF2(passphrase, salt, iterations, digestmodule,
+                      secret_key=secret_key).read(dklen)
+    if isunicode(passphrase):
+        passphrase = passphrase.encode("UTF-8")
+    if isunicode(salt):
+        salt = salt.encode("UTF-8")
+    if secret_key:
+        if isunicode(secret_key):
+            secret_key = secret_key.encode('latin-1')
+        passphrase = sha1(secret_key + passphrase).digest()
+    return pbkdf2_hmac(name, passphrase, salt, iterations, dklen)
+
+
 def crypt(word, salt=None, iterations=24000, digestmodule=sha256,
           secret_key=None):
     """PBKDF2-based unix crypt(3) replacement.
@@ -264,8 +290,8 @@ def crypt(word, salt=None, iterations=24000, digestmodule=sha256,
 
     salt = "$p5k2$%s$%x$%s" % (digest.name.lower(),  iterations, salt)
 
-    rawhash = PBKDF2(word, salt, iterations, digestmodule,
-                     secret_key=secret_key).read(digest.digest_size)
+    rawhash = pbkdf2(word, salt, iterations, digestmodule, secret_key,
+                     digest.digest_size)
     return salt + "$" + b64encode(rawhash, "./")
 
 # Add crypt as a static method of the PBKDF2 class
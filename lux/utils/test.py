@@ -301,6 +301,8 @@ class AppTestCase(unittest.TestCase, TestMixin):
                 if engine.url.database == database:
                     new_url = str(engine.url)
                     for key, url in DATASTORE.items():
+                        if isinstance(url, dict):
+                            url = url['primary']
                         if url == orig_url:
                             datastore[key] = new_url
         cls.app.config['DATASTORE'] = datastore
@@ -1,4 +1,5 @@
 from lux.utils import test
+from lux.extensions.auth.views import UserCRUD, PermissionCRUD
 
 
 class AuthUtils:
@@ -459,3 +460,141 @@ class TestSqlite(test.AppTestCase, AuthUtils):
         self.assertNotEqual(token, badtoken)
         request = yield from self.client.get('/secrets', token=badtoken)
         self.assertEqual(request.response.status_code, 403)
+
+
+class TestPermissionCache(test.AppTestCase):
+    config_file = 'tests.auth'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'CACHE_SERVER': 'memory://'}
+
+    @classmethod
+    def populatedb(cls):
+        odm = cls.app.odm()
+        with odm.begin() as session:
+            group = odm.group(name='cache_test')
+            session.add(group)
+            permission = odm.permission(name='cache read',
+                                        description='Read the cache',
+                                        policy={'action': 'cache'})
+            group.permissions.append(permission)
+
+    @test.green
+    def test_permission_set(self):
+        backend = self.app.auth_backend.backends[0]
+        odm = self.app.odm()
+        with odm.begin() as session:
+            group = session.query(odm.group).filter_by(name='cache_test')
+            group = group.one()
+            table = odm.permission.__table__
+        request = self.app.wsgi_request()
+        perms = backend.get_permission_set(request, [group.id])
+        self.assertEqual(perms, {'cache read': {'action': 'cache'}})
+        # updates bypassing the session signals are not seen
+        with odm.begin() as session:
+            session.execute(table.update().values(policy={'action': 'foo'}))
+        perms = backend.get_permission_set(request, [group.id])
+        self.assertEqual(perms, {'cache read': {'action': 'cache'}})
+        # changes to permissions invalidate the permission sets
+        with odm.begin() as session:
+            permission = session.query(odm.permission).filter_by(
+                name='cache read').one()
+            permission.policy = {'action': 'cache', 'effect': 'deny'}
+        perms = backend.get_permission_set(request, [group.id])
+        self.assertEqual(perms, {'cache read': {'action': 'cache',
+                                                'effect': 'deny'}})
+        self.assertEqual(backend.get_permission_set(request, []), {})
+
+    @test.green
+    def test_permission_set_serializer(self):
+        backend = self.app.auth_backend.backends[0]
+        odm = self.app.odm()
+        with odm.begin() as session:
+            group = session.query(odm.group).filter_by(name='cache_test')
+            group = group.one()
+        request = self.app.wsgi_request()
+        config = self.app.config
+        serializer = config['CACHE_SERIALIZER']
+        # permission sets are stored as JSON whatever the default serializer
+        config['CACHE_SERIALIZER'] = 'bytes'
+        try:
+            self.app.cache_server.invalidate_tags(('permissions',))
+            perms = backend.get_permission_set(request, [group.id])
+            self.assertEqual(perms, backend.get_permission_set(request,
+                                                               [group.id]))
+            self.assertIsInstance(perms, dict)
+        finally:
+            config['CACHE_SERIALIZER'] = serializer
+
+    @test.green
+    def test_user_cache(self):
+        backend = self.app.auth_backend.backends[0]
+        request = self.app.wsgi_request()
+        user = backend.create_user(request, username='cached',
+                                   email='cached@pluto.com',
+                                   password='pluto', active=True)
+        cached = backend.get_user(request, user_id=user.id)
+        self.assertEqual(cached.username, 'cached')
+        self.assertEqual(cached.group_ids, [])
+        # detached snapshot from the cache
+        cached = backend.get_user(request, user_id=user.id)
+        self.assertEqual(cached.id, user.id)
+        self.assertEqual(cached.email, 'cached@pluto.com')
+        self.assertEqual(cached.group_ids, [])
+        live = backend.get_user(request, user_id=user.id, live=True)
+        self.assertFalse(hasattr(live, 'group_ids'))
+        # updates invalidate the cache
+        backend.set_password(request, cached, 'charon')
+        live = backend.get_user(request, user_id=user.id, live=True)
+        self.assertEqual(live.password, cached.password)
+        cached = backend.get_user(request, user_id=user.id)
+        self.assertEqual(cached.password, live.password)
+
+    @test.green
+    def test_bulk_update_groups(self):
+        backend = self.app.auth_backend.backends[0]
+        odm = self.app.odm()
+        request = self.app.wsgi_request()
+        user = backend.create_user(request, username='bulkgroups',
+                                   email='bulkgroups@pluto.com',
+                                   password='pluto', active=True)
+        request.cache.user = backend.get_user(request, user_id=user.id)
+        self.assertEqual(request.cache.user.group_ids, [])
+        self.assertEqual(backend.get_permissions(request), {})
+        model = UserCRUD().model(self.app)
+        with model.session(request) as session:
+            instance = session.query(odm.user).get(user.id)
+            group = session.query(odm.group).filter_by(name='cache_test')
+            group = group.one()
+            group_id = group.id
+            model.bulk_update(request, [(instance, {'groups': [group]})],
+                              session)
+        request = self.app.wsgi_request()
+        request.cache.user = backend.get_user(request, user_id=user.id)
+        self.assertEqual(request.cache.user.group_ids, [group_id])
+        self.assertTrue('cache read' in backend.get_permissions(request))
+
+    @test.green
+    def test_bulk_update_permissions(self):
+        backend = self.app.auth_backend.backends[0]
+        odm = self.app.odm()
+        request = self.app.wsgi_request()
+        with odm.begin() as session:
+            group = odm.group(name='bulk_test')
+            session.add(group)
+            permission = odm.permission(name='bulk read',
+                                        description='Bulk read',
+                                        policy={'action': 'bulk'})
+            group.permissions.append(permission)
+            session.flush()
+            group_id, permission_id = group.id, permission.id
+        perms = backend.get_permission_set(request, [group_id])
+        self.assertEqual(perms, {'bulk read': {'action': 'bulk'}})
+        # bulk_update_mappings bypasses the unit of work
+        model = PermissionCRUD().model(self.app)
+        policy = {'action': 'bulk', 'effect': 'deny'}
+        with model.session(request) as session:
+            instance = session.query(odm.permission).get(permission_id)
+            model.bulk_update(request, [(instance, {'policy': policy})],
+                              session)
+        perms = backend.get_permission_set(request, [group_id])
+        self.assertEqual(perms, {'bulk read': policy})
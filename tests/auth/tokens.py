@@ -0,0 +1,100 @@
+import uuid
+from datetime import datetime, timedelta
+
+from pulsar import ImproperlyConfigured
+
+from lux.utils import test
+
+from . import sqlite
+
+
+class TestStatelessTokens(test.AppTestCase, sqlite.AuthUtils):
+    config_file = 'tests.auth'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'CACHE_SERVER': 'memory://',
+                     'TOKEN_STATELESS': True,
+                     'TOKEN_ACCESS_FLUSH': 3600}
+
+    def backend(self):
+        return self.app.auth_backend.backends[0]
+
+    def test_stateless_token(self):
+        token = yield from self._token()
+        request = yield from self.client.get('/secrets', token=token)
+        self.assertEqual(request.response.status_code, 200)
+        backend = self.backend()
+        token_id = backend.decode_token(request, token)['token_id']
+        self.assertTrue(token_id in backend._token_access)
+        # flush last access
+        odm = self.app.odm()
+        yield from self.app.green_pool.submit(backend.flush_token_access,
+                                              self.app)
+        self.assertFalse(backend._token_access)
+        self.assertFalse(backend.token_revoked(request, token_id))
+
+        # revoke the token
+        def delete_token():
+            with odm.begin() as session:
+                obj = session.query(odm.token).get(uuid.UUID(token_id))
+                session.delete(obj)
+
+        yield from self.app.green_pool.submit(delete_token)
+        self.assertTrue(backend.token_revoked(request, token_id))
+        request = yield from self.client.get('/secrets', token=token)
+        self.assertEqual(request.response.status_code, 403)
+
+    def test_token_access_flushed_on_stop(self):
+        backend = self.backend()
+        request = self.app.wsgi_request()
+        token1 = yield from self._token()
+        token2 = yield from self._token()
+        id1 = backend.decode_token(request, token1)['token_id']
+        id2 = backend.decode_token(request, token2)['token_id']
+        now = datetime.utcnow()
+        backend._token_access = {id1: now - timedelta(hours=1), id2: now}
+        yield from backend.on_stop(self.app)
+        self.assertFalse(backend._token_access)
+        odm = self.app.odm()
+
+        def last_access():
+            with odm.begin() as session:
+                query = session.query(odm.token).filter(
+                    odm.token.id.in_((id1, id2)))
+                return dict(((t.id.hex, t.last_access) for t in query))
+
+        access = yield from self.app.green_pool.submit(last_access)
+        self.assertEqual(access[uuid.UUID(id1).hex],
+                         now - timedelta(hours=1))
+        self.assertEqual(access[uuid.UUID(id2).hex], now)
+
+
+class TestStatelessConfig(test.TestCase):
+    config_file = 'tests.auth'
+    config_params = {'DATASTORE': 'sqlite://'}
+
+    def test_dummy_cache(self):
+        self.assertRaises(ImproperlyConfigured, self.application,
+                          TOKEN_STATELESS=True, CACHE_SERVER='dummy://')
+
+
+class TestTokenBenchmark(test.AppTestCase, sqlite.AuthUtils):
+    '''Authenticated requests with database and stateless tokens'''
+    __benchmark__ = True
+    __number__ = 100
+    config_file = 'tests.auth'
+    config_params = {'DATASTORE': 'sqlite://',
+                     'CACHE_SERVER': 'memory://'}
+    token = None
+
+    def _get(self, stateless):
+        self.app.config['TOKEN_STATELESS'] = stateless
+        if self.token is None:
+            self.__class__.token = yield from self._token()
+        request = yield from self.client.get('/secrets', token=self.token)
+        self.assertEqual(request.response.status_code, 200)
+
+    def test_database_token(self):
+        yield from self._get(False)
+
+    def test_stateless_token(self):
+        yield from self._get(True)
@@ -1,9 +1,11 @@
 import os
 import shutil
 
+from pulsar import BadRequest
+
 from lux.utils import test
 from lux.extensions.rest import UserMixin
-from lux.extensions.content.models import Content, DataError
+from lux.extensions.content.models import Content, DataError, Query
 
 from . import PWD, remove_repo
 
@@ -34,6 +36,32 @@ class TestContentModel(test.TestCase):
         self.assertTrue(os.path.exists(pwd))
         shutil.rmtree(pwd)
 
+    def _query(self):
+        query = Query(None, self.repo)
+        query._data = [{'title': 'foo', 'order': 1},
+                       {'title': 'bar', 'order': 2},
+                       {'order': 3}]
+        return query
+
+    def test_query_filter(self):
+        query = self._query().filter('title', 'startswith', 'f')
+        self.assertEqual(query.all(), [{'title': 'foo', 'order': 1}])
+        query = self._query().filter('title', 'range', 'b,c')
+        self.assertEqual(query.all(), [{'title': 'bar', 'order': 2}])
+        query = self._query().filter('title', 'eq', ['foo', 'bar'])
+        self.assertEqual(query.count(), 2)
+        query = self._query().filter('title', 'isnull', 'true')
+        self.assertEqual(query.all(), [{'order': 3}])
+
+    def test_query_filter_invalid(self):
+        for op, value in (('range', 'a'),
+                          ('range', ','),
+                          ('startswith', 5),
+                          ('in', [1, 2]),
+                          ('foo', 'a')):
+            self.assertRaises(BadRequest, self._query().filter,
+                              'title', op, value)
+
     def test_write(self):
         # no file but trying to open one
         data = {'body': 'Test message', 'name': 'Test'}
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 from unittest import mock
 
 from pulsar import ImproperlyConfigured
@@ -71,3 +74,134 @@ class CommandTests(test.TestCase):
         pubsub = app.pubsub('test')
         self.assertNotEqual(pubsub1, pubsub)
         self.assertEqual(pubsub, app.pubsub('test'))
+
+
+class ContextTests(test.TestCase):
+    config_file = 'tests.core'
+
+    def test_context_layers(self):
+        app = self.application()
+        request = app.wsgi_request()
+        context = app.context(request, {'foo': 'bar'})
+        self.assertEqual(context['foo'], 'bar')
+        self.assertEqual(context['APP_NAME'], app.config['APP_NAME'])
+        context['APP_NAME'] = 'other'
+        self.assertNotEqual(app.config['APP_NAME'], 'other')
+        self.assertEqual(context.maps[-1], app.config)
+
+    def test_cms_context_once(self):
+        app = self.application()
+        request = app.wsgi_request()
+        app.cms.context = mock.MagicMock(return_value={'html_a': 'A'})
+        context = app.context(request)
+        self.assertEqual(context['html_a'], 'A')
+        context = app.context(request, {'html_a': 'B'})
+        self.assertEqual(context['html_a'], 'B')
+        self.assertEqual(app.cms.context.call_count, 1)
+        # the cms partials are computed once per application
+        for _ in range(3):
+            context = app.context(app.wsgi_request())
+            self.assertEqual(context['html_a'], 'A')
+        self.assertEqual(app.cms.context.call_count, 1)
+        self.assertEqual(app.static_context()['html_a'], 'A')
+
+    def test_static_context(self):
+        app = self.application()
+        ext = tuple(app.extensions.values())[0]
+        ext.static_context = mock.MagicMock(return_value={'foo': 'bar'})
+        context = app.context(app.wsgi_request())
+        self.assertEqual(context['foo'], 'bar')
+        context = app.context(app.wsgi_request())
+        self.assertEqual(context['foo'], 'bar')
+        ext.static_context.assert_called_once_with(app)
+        self.assertEqual(app.static_context()['foo'], 'bar')
+
+
+class TemplateTests(test.TestCase):
+    config_file = 'tests.core'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, text, mtime=None):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'w') as file:
+            file.write(text)
+        if mtime:
+            os.utime(filename, (mtime, mtime))
+        return filename
+
+    def test_template_path_cached(self):
+        app = self.application()
+        filename = self.write('page.html', 'Hello $name')
+        self.assertEqual(app.template_full_path(filename), filename)
+        self.assertEqual(app._template_paths[(filename,)], filename)
+        self.assertEqual(app.template_full_path([filename]), filename)
+
+    def test_compiled_template(self):
+        app = self.application()
+        filename = self.write('page.html', 'Hello $name')
+        template = app.compiled_template(filename)
+        self.assertEqual(template({'name': 'luca'}), 'Hello luca')
+        self.assertEqual(app.compiled_template(filename), template)
+        self.assertEqual(app.render_template(filename, {'name': 'pippo'}),
+                         'Hello pippo')
+        # production mode never checks the file system again
+        self.write('page.html', 'Ciao $name', 1)
+        self.assertEqual(app.compiled_template(filename), template)
+
+    def test_compiled_template_debug(self):
+        app = self.application()
+        app.debug = True
+        filename = self.write('page.html', 'Hello $name', 1)
+        template = app.compiled_template(filename)
+        self.assertEqual(app.compiled_template(filename), template)
+        self.write('page.html', 'Ciao $name', 2)
+        template = app.compiled_template(filename)
+        self.assertEqual(template({'name': 'luca'}), 'Ciao luca')
+        self.assertFalse(app._template_paths)
+
+    def test_template_not_found(self):
+        app = self.application()
+        app.logger.error = mock.MagicMock()
+        self.assertEqual(app.compiled_template('xyz.html'), None)
+        self.assertEqual(app.render_template('xyz.html', {'a': 1}), '')
+        self.assertEqual(app.logger.error.call_count, 2)
+
+
+class TemplateBenchmark(test.AppTestCase):
+    '''Html response of a page template with nested partials'''
+    __benchmark__ = True
+    __number__ = 1000
+    config_file = 'tests.core'
+    partials = ('header', 'sidebar', 'article', 'footer')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = tempfile.mkdtemp()
+        for name in cls.partials:
+            with open(os.path.join(cls.path, '%s.html' % name), 'w') as fp:
+                fp.write('<div class="%s">$title %s</div>' % (name, name))
+        with open(os.path.join(cls.path, 'page.html'), 'w') as fp:
+            fp.write(''.join('$html_%s' % name for name in cls.partials))
+        return super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        return super().tearDownClass()
+
+    def test_html_response(self):
+        app = self.app
+        request, _ = self.client.request_start_response(
+            HTTP_ACCEPT='text/html')
+        context = {'title': 'Benchmark'}
+        for name in self.partials:
+            filename = os.path.join(self.path, '%s.html' % name)
+            context['html_%s' % name] = app.render_template(filename, context)
+        page = os.path.join(self.path, 'page.html')
+        response = app.html_response(request, page, context)
+        self.assertEqual(response.status_code, 200)
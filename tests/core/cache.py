@@ -1,3 +1,6 @@
+import time
+import threading
+from datetime import date
 from unittest import skipUnless
 
 try:
@@ -5,11 +8,18 @@ try:
 except ImportError:
     StrictRedis = None
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from pulsar import ImproperlyConfigured
 from pulsar.apps.test import check_server
 from pulsar.apps.data.redis.client import RedisClient
 
+from lux import cached, Cacheable
 from lux.utils import test
+from lux.core.cache import LocalCache, LockError, CacheMetrics
 
 
 REDIS_OK = check_server('redis')
@@ -28,6 +38,9 @@ class TestWrappers(test.TestCase):
         self.assertEqual(cache.hmget('foo'), None)
         cache.set('h', 56)
         self.assertEqual(cache.get('h'), None)
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(cache.get_many(['a', 'b']), [None, None])
+        self.assertEqual(cache.delete_many(['a', 'b']), 0)
 
     def test_bad_url(self):
         app = self.application(CACHE_SERVER='cbjhb://')
@@ -35,6 +48,41 @@ class TestWrappers(test.TestCase):
                           lambda: app.cache_server)
 
 
+class TestLocalCache(test.TestCase):
+
+    def test_lru(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), (True, 1))
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('a'), (True, 1))
+        self.assertEqual(cache.get('c'), (True, 3))
+        self.assertTrue(cache.delete('c'))
+        self.assertFalse(cache.delete('c'))
+
+    def test_timeout(self):
+        cache = LocalCache(timeout=0.05)
+        cache.set('a', 1)
+        cache.set('b', 2, timeout=10)
+        self.assertEqual(cache.get('a'), (True, 1))
+        time.sleep(0.06)
+        self.assertEqual(cache.get('a'), (False, None))
+        self.assertEqual(cache.get('b'), (False, None))
+
+    def test_stats(self):
+        cache = LocalCache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+
 @skipUnless(REDIS_OK, 'Requires a running Redis server')
 class TestRedisCache(test.AppTestCase):
     config_params = {'GREEN_POOL': 20}
@@ -60,6 +108,24 @@ class TestRedisCache(test.AppTestCase):
         self.assertEqual(cache.set_json(key, data), None)
         self.assertEqual(cache.get_json(key), data)
 
+    @test.green
+    def test_many(self):
+        cache = self.app.cache_server
+        keys = [test.randomname() for _ in range(3)]
+        cache.set_many({keys[0]: 'a', keys[1]: 'b'})
+        self.assertEqual(cache.get_many(keys), [b'a', b'b', None])
+        cache.set_many({keys[2]: 'c'}, timeout=10)
+        self.assertEqual(cache.get_many(keys), [b'a', b'b', b'c'])
+        self.assertEqual(cache.delete_many(keys), 3)
+        self.assertEqual(cache.get_many(keys), [None, None, None])
+
+    @test.green
+    def test_hash(self):
+        cache = self.app.cache_server
+        key = test.randomname()
+        cache.hmset(key, {'name': 'pippo', 'age': 4})
+        self.assertEqual(cache.hmget(key, 'name', 'age'), [b'pippo', b'4'])
+
     @test.green
     def test_get_json(self):
         cache = self.app.cache_server
@@ -75,3 +141,436 @@ class TestRedisCache(test.AppTestCase):
 class TestRedisCacheSync(TestRedisCache):
     config_params = {}
     ClientClass = StrictRedis
+
+
+class TestMemoryCache(test.TestCase):
+
+    def cache(self, url='memory://'):
+        return self.application(CACHE_SERVER=url).cache_server
+
+    def test_set_get(self):
+        cache = self.cache()
+        self.assertEqual(cache.name, 'memory')
+        self.assertEqual(cache.get('h'), None)
+        cache.set('h', 56)
+        self.assertEqual(cache.get('h'), b'56')
+        self.assertEqual(cache.delete('h'), 1)
+        self.assertEqual(cache.delete('h'), 0)
+        self.assertEqual(cache.get('h'), None)
+
+    def test_json(self):
+        cache = self.cache()
+        data = {'name': 'pippo', 'age': 4}
+        cache.set_json('foo', data)
+        self.assertEqual(cache.get_json('foo'), data)
+        cache.set('foo', '{bad-json}')
+        self.assertEqual(cache.get_json('foo'), None)
+
+    def test_timeout(self):
+        cache = self.cache()
+        cache.set('foo', 'bla', timeout=0.05)
+        self.assertEqual(cache.get('foo'), b'bla')
+        time.sleep(0.06)
+        self.assertEqual(cache.get('foo'), None)
+
+    def test_many(self):
+        cache = self.cache()
+        self.assertEqual(cache.get_many([]), [])
+        cache.set_many({'a': 1, 'b': 'foo'})
+        self.assertEqual(cache.get_many(['a', 'c', 'b']), [b'1', None, b'foo'])
+        self.assertEqual(cache.delete_many(['a', 'b', 'c']), 2)
+        self.assertEqual(cache.get_many(['a', 'b']), [None, None])
+
+    def test_many_timeout(self):
+        cache = self.cache()
+        cache.set_many([('a', 1), ('b', 2)], timeout=0.05)
+        self.assertEqual(cache.get_many(['a', 'b']), [b'1', b'2'])
+        time.sleep(0.06)
+        self.assertEqual(cache.get_many(['a', 'b']), [None, None])
+
+    def test_hash(self):
+        cache = self.cache()
+        self.assertEqual(cache.hmget('foo'), None)
+        cache.hmset('foo', {'name': 'pippo'})
+        cache.hmset('foo', {'age': 4})
+        self.assertEqual(cache.hmget('foo', 'name', 'age', 'bla'),
+                         [b'pippo', b'4', None])
+        self.assertEqual(cache.hmget('foo'), {'name': b'pippo', 'age': b'4'})
+
+    def test_hash_threads(self):
+        cache = self.cache()
+
+        def hmset(n):
+            for i in range(100):
+                cache.hmset('foo', {'%d:%d' % (n, i): i})
+
+        threads = [threading.Thread(target=hmset, args=(n,))
+                   for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(cache.hmget('foo')), 500)
+
+    def test_eviction(self):
+        cache = self.cache('memory://?max_entries=2&max_bytes=10')
+        cache.set('a', 'x')
+        cache.set('b', 'y')
+        cache.set('c', 'z')
+        self.assertEqual(cache.get('a'), None)
+        cache.set('d', '123456789')
+        self.assertEqual(cache.get('c'), None)
+        self.assertEqual(cache.get('d'), b'123456789')
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_lock(self):
+        cache = self.cache()
+        lock = cache.lock('foo')
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.locked())
+        self.assertFalse(cache.lock('foo').acquire(blocking=False))
+        self.assertFalse(cache.lock('foo', blocking_timeout=0.02).acquire())
+        lock.release()
+        self.assertRaises(LockError, lock.release)
+        with cache.lock('foo') as lock:
+            self.assertTrue(lock.locked())
+        self.assertFalse(lock.locked())
+
+    def test_lock_timeout(self):
+        cache = self.cache()
+        self.assertTrue(cache.lock('foo', timeout=0.05).acquire())
+        self.assertTrue(cache.lock('foo', blocking_timeout=1).acquire())
+
+
+class TestCachedLock(test.TestCase):
+
+    def run_threads(self, target, app, number=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(target(app)))
+                   for _ in range(number)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_flight(self):
+        app = self.application(CACHE_SERVER='memory://')
+        calls = []
+
+        @cached(lock=True)
+        def compute(app):
+            calls.append(1)
+            time.sleep(0.1)
+            return len(calls)
+
+        self.assertEqual(self.run_threads(compute, app), [1, 1, 1, 1, 1])
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_while_revalidate(self):
+        app = self.application(CACHE_SERVER='memory://')
+        calls = []
+
+        @cached(lock=True, stale_while_revalidate=10, timeout=1)
+        def compute(app):
+            calls.append(1)
+            time.sleep(0.1)
+            return len(calls)
+
+        self.assertEqual(compute(app), 1)
+        time.sleep(1.1)
+        results = self.run_threads(compute, app)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(results.count(2), 1)
+        self.assertEqual(results.count(1), 4)
+        self.assertEqual(compute(app), 2)
+
+
+class TestSerializers(test.TestCase):
+
+    def cache(self, **params):
+        return self.application(CACHE_SERVER='memory://',
+                                **params).cache_server
+
+    def test_default(self):
+        cache = self.cache()
+        data = {'name': 'pippo'}
+        cache.set_data('foo', data)
+        self.assertEqual(cache.get('foo'), b'{"name": "pippo"}')
+        self.assertEqual(cache.get_data('foo'), data)
+        self.assertRaises(ImproperlyConfigured, cache.serializer, 'bla')
+
+    def test_pickle(self):
+        cache = self.cache(CACHE_SERIALIZER='pickle')
+        data = {'name': 'pippo', 'date': date.today()}
+        cache.set_data('foo', data)
+        self.assertEqual(cache.get_data('foo'), data)
+        self.assertEqual(cache.get_json('foo'), None)
+
+    def test_raw(self):
+        cache = self.cache()
+        cache.set_data('foo', 'ciao', serializer='text')
+        self.assertEqual(cache.get_data('foo', serializer='text'), 'ciao')
+        self.assertEqual(cache.get_data('foo', serializer='bytes'), b'ciao')
+        self.assertRaises(TypeError, cache.set_data, 'foo', 5,
+                          serializer='bytes')
+
+    @skipUnless(msgpack, 'Requires msgpack-python')
+    def test_msgpack(self):
+        cache = self.cache()
+        data = {'name': 'pippo', 'age': 4, 'data': b'\x00\x01'}
+        cache.set_data('foo', data, serializer='msgpack')
+        self.assertEqual(cache.get_data('foo', serializer='msgpack'), data)
+
+    def test_compression(self):
+        cache = self.cache(CACHE_COMPRESS_MIN_LENGTH=100)
+        short = {'name': 'pippo'}
+        long = {'name': 'pippo'*100}
+        cache.set_data('short', short)
+        cache.set_data('long', long)
+        self.assertEqual(cache.get('short'), b'{"name": "pippo"}')
+        self.assertTrue(len(cache.get('long')) < 100)
+        self.assertEqual(cache.get_data('short'), short)
+        self.assertEqual(cache.get_data('long'), long)
+
+    def test_cached_serializer(self):
+        app = self.application(CACHE_SERVER='memory://')
+        calls = []
+
+        @cached(serializer='pickle')
+        def compute(app):
+            calls.append(1)
+            return {'today': date.today()}
+
+        self.assertEqual(compute(app), {'today': date.today()})
+        self.assertEqual(compute(app), {'today': date.today()})
+        self.assertEqual(len(calls), 1)
+
+
+class TestCacheTags(test.TestCase):
+
+    def test_invalidate_tags(self):
+        app = self.application(CACHE_SERVER='memory://')
+        calls = []
+
+        @cached(tags=('blog', 'content'))
+        def compute(app):
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(compute(app), 1)
+        self.assertEqual(compute(app), 1)
+        app.cache_server.invalidate_tags('content')
+        self.assertEqual(compute(app), 2)
+        self.assertEqual(compute(app), 2)
+        app.cache_server.invalidate_tags('foo')
+        self.assertEqual(compute(app), 2)
+
+    def test_tag_versions(self):
+        cache = self.application(CACHE_SERVER='memory://').cache_server
+        versions = cache.tag_versions(['foo', 'bla'])
+        self.assertEqual(cache.tag_versions(['foo', 'bla']), versions)
+        cache.invalidate_tags('bla')
+        self.assertEqual(cache.tag_versions(['foo']), versions[:1])
+        self.assertEqual(cache.tag_versions(['bla']),
+                         [str(int(versions[1]) + 1)])
+
+    def test_lost_tag_key(self):
+        app = self.application(CACHE_SERVER='memory://')
+        cache = app.cache_server
+        calls = []
+
+        @cached(tags=('blog',))
+        def compute(app):
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(compute(app), 1)
+        # the tag key is evicted and the tag invalidated
+        cache.delete(cache.tag_key('blog'))
+        cache.invalidate_tags('blog')
+        self.assertNotEqual(cache.tag_versions(['blog']), ['1'])
+        self.assertEqual(compute(app), 2)
+        # twice
+        cache.delete(cache.tag_key('blog'))
+        cache.invalidate_tags('blog')
+        self.assertEqual(compute(app), 3)
+
+    def test_no_tags_lookup(self):
+        app = self.application(CACHE_SERVER='memory://')
+        cache = app.cache_server
+        self.assertEqual(cache.tagged_key('foo', ()), 'foo')
+        lookups = []
+        get_many = cache.get_many
+        cache.get_many = lambda keys: lookups.append(keys) or get_many(keys)
+
+        @cached
+        def compute(app):
+            return 1
+
+        self.assertEqual(compute(app), 1)
+        self.assertEqual(compute(app), 1)
+        self.assertEqual(lookups, [])
+
+    def test_cacheable_tags(self):
+        app = self.application(CACHE_SERVER='memory://')
+
+        class Counter(Cacheable):
+            calls = 0
+
+            def __init__(self, app):
+                self.app = app
+
+            def cache_tags(self, app):
+                return ('counter',)
+
+            @cached
+            def count(self, app):
+                self.calls += 1
+                return self.calls
+
+        counter = Counter(app)
+        self.assertEqual(counter.count(app), 1)
+        self.assertEqual(counter.count(app), 1)
+        app.cache_server.invalidate_tags('counter')
+        self.assertEqual(counter.count(app), 2)
+
+
+class TestCacheMetrics(test.TestCase):
+
+    def test_cached_metrics(self):
+        app = self.application(CACHE_SERVER='memory://')
+
+        @cached
+        def compute(app):
+            return {'name': 'pippo'}
+
+        compute(app)
+        compute(app)
+        compute(app)
+        metrics = app.cache_server.metrics.as_dict()
+        family = metrics['%s:compute' % app.config['APP_NAME'].lower()]
+        self.assertEqual(family['hits'], 2)
+        self.assertEqual(family['misses'], 1)
+        self.assertEqual(family['sets'], 1)
+        self.assertEqual(family['bytes'], len('{"name": "pippo"}'))
+        self.assertEqual(family['latency']['get']['count'], 3)
+        self.assertEqual(family['latency']['set']['count'], 1)
+
+    def test_prometheus(self):
+        metrics = CacheMetrics(buckets=(0.1, 1))
+        metrics.count('app:foo', 'hits')
+        metrics.error('app:foo', 'set')
+        metrics.observe('app:foo', 'get', 0.5)
+        metrics.observe('app:foo', 'get', 2)
+        text = metrics.prometheus()
+        self.assertTrue('lux_cache_hits_total{family="app:foo"} 1' in text)
+        self.assertTrue('lux_cache_errors_total{family="app:foo",'
+                        'operation="set"} 1' in text)
+        self.assertTrue('lux_cache_latency_seconds_bucket{family="app:foo",'
+                        'operation="get",le="1"} 1' in text)
+        self.assertTrue('lux_cache_latency_seconds_bucket{family="app:foo",'
+                        'operation="get",le="+Inf"} 2' in text)
+        metrics.reset()
+        self.assertEqual(metrics.as_dict(), {})
+
+
+class TestCacheMetricsRouter(test.AppTestCase):
+    config_params = {'CACHE_SERVER': 'memory://',
+                     'CACHE_METRICS_URL': '/cache-metrics'}
+
+    def test_json(self):
+        self.app.cache_server.metrics.count('app:foo', 'hits')
+        request = yield from self.client.get('/cache-metrics')
+        data = self.json(request.response, 200)
+        self.assertEqual(data['app:foo']['hits'], 1)
+
+    def test_prometheus(self):
+        self.app.cache_server.metrics.count('app:bla', 'misses')
+        request = yield from self.client.get('/cache-metrics',
+                                             HTTP_ACCEPT='text/plain')
+        text = self.text(request.response, 200)
+        self.assertTrue('lux_cache_misses_total{family="app:bla"} 1' in text)
+
+    def test_no_reset(self):
+        self.app.cache_server.metrics.count('app:reset', 'hits')
+        request = yield from self.client.delete('/cache-metrics')
+        self.assertEqual(request.response.status_code, 405)
+        self.assertTrue('app:reset' in self.app.cache_server.metrics.as_dict())
+
+
+class TestSerializersBenchmark(test.AppTestCase):
+    '''Round trip of realistic payloads through the memory cache'''
+    __benchmark__ = True
+    __number__ = 100
+    config_params = {'CACHE_SERVER': 'memory://'}
+    sitemap = [{'url': '/blog/%d' % n,
+                'title': 'A blog post about lux %d' % n,
+                'description': 'Some description of the post ' * 5,
+                'tags': ['python', 'web', 'lux'],
+                'priority': 0.5,
+                'modified': '2015-10-18T12:00:00+00:00'}
+               for n in range(1000)]
+    html = '<div class="row"><p>%s</p></div>' % ('lorem ipsum ' * 5000)
+
+    def roundtrip(self, data, serializer, compress=0):
+        cache = self.app.cache_server
+        self.app.config['CACHE_COMPRESS_MIN_LENGTH'] = compress
+        cache.set_data('bench', data, serializer=serializer)
+        self.assertTrue(cache.get_data('bench', serializer=serializer))
+
+    def test_sitemap_json(self):
+        self.roundtrip(self.sitemap, 'json')
+
+    def test_sitemap_json_zlib(self):
+        self.roundtrip(self.sitemap, 'json', 1024)
+
+    def test_sitemap_pickle(self):
+        self.roundtrip(self.sitemap, 'pickle')
+
+    @skipUnless(msgpack, 'Requires msgpack-python')
+    def test_sitemap_msgpack(self):
+        self.roundtrip(self.sitemap, 'msgpack')
+
+    def test_html_json(self):
+        self.roundtrip(self.html, 'json')
+
+    def test_html_text(self):
+        self.roundtrip(self.html, 'text')
+
+    def test_html_text_zlib(self):
+        self.roundtrip(self.html, 'text', 1024)
+
+
+@skipUnless(REDIS_OK and StrictRedis, ('Requires a running Redis server and '
+                                       'redis python client'))
+class TestLocalRedisCache(test.AppTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        redis = 'local+redis://%s?max_entries=10' % cls.cfg.redis_server
+        cls.config_params = {'CACHE_SERVER': redis}
+        return super().setUpClass()
+
+    def test_local_tier(self):
+        cache = self.app.cache_server
+        self.assertEqual(cache.name, 'local+redis')
+        self.assertEqual(cache.local.max_entries, 10)
+        key = test.randomname()
+        self.assertEqual(cache.get_json(key), None)
+        data = {'name': 'pippo', 'age': 4}
+        cache.set_json(key, data)
+        self.assertEqual(cache.get_json(key), data)
+        self.assertEqual(cache.stats()['hits'], 1)
+        cache.delete(key)
+        self.assertEqual(cache.get_json(key), None)
+
+    def test_invalidation_message(self):
+        cache = self.app.cache_server
+        key = test.randomname()
+        cache.local.set(key, 'foo')
+        message = '{"origin": "%s", "keys": ["%s"]}' % (cache.origin, key)
+        cache.on_message(message)
+        self.assertEqual(cache.local.get(key), (True, 'foo'))
+        cache.on_message('{"origin": "other", "keys": ["%s"]}' % key)
+        self.assertEqual(cache.local.get(key), (False, None))
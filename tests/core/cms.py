@@ -0,0 +1,152 @@
+import json
+
+from pulsar.apps.wsgi import Route
+
+from lux.utils import test
+from lux.core.cms import CMS, RouteIndex
+
+
+def linear_match(sitemap, path):
+    for page in sitemap:
+        matched = Route(page['path']).match(path)
+        if matched is not None and '__remaining__' not in matched:
+            return page
+
+
+class TestRouteIndex(test.TestCase):
+    config_file = 'tests.core'
+    sitemap = [{'path': path} for path in ('/',
+                                           '/bla',
+                                           '/bla/<path:path>',
+                                           '/foo/<id>',
+                                           '/<name>/baz',
+                                           '/foo/bar',
+                                           '/bla/x/',
+                                           '/<int:n>')]
+
+    def test_index(self):
+        index = RouteIndex(self.sitemap)
+        self.assertEqual(len(index), 8)
+        self.assertEqual(len(index.static), 4)
+        self.assertEqual(len(index.dynamic), 2)
+        self.assertEqual(len(index.wildcard), 2)
+
+    def test_same_as_linear(self):
+        index = RouteIndex(self.sitemap)
+        for path in ('', 'bla', 'bla/', 'bla/x', 'bla/x/', 'bla/x/y',
+                     'foo', 'foo/3', 'foo/bar', 'foo/bar/baz', 'q/baz',
+                     '5', 'x'):
+            self.assertEqual(index.match(path),
+                             linear_match(self.sitemap, path))
+        self.assertEqual(index.match('foo/bar')['path'], '/foo/<id>')
+        self.assertEqual(index.match('bla/x/')['path'], '/bla/<path:path>')
+
+    def test_memoized(self):
+        index = RouteIndex(self.sitemap)
+        self.assertEqual(index.match('foo/3')['path'], '/foo/<id>')
+        self.assertEqual(index.match('foo/3')['path'], '/foo/<id>')
+        self.assertEqual(index.match('x'), None)
+        self.assertEqual(index.match('x'), None)
+        self.assertEqual(index.matched.hits, 2)
+        self.assertEqual(index.matched.misses, 2)
+
+    def test_route(self):
+        index = RouteIndex(self.sitemap)
+        page = index.match(Route('/foo/<id>'))
+        self.assertEqual(page['path'], '/foo/<id>')
+        self.assertEqual(index.match(Route('/xxx')), None)
+
+    def test_cms_index(self):
+        app = self.application()
+        cms = app.cms
+        version, sitemap = cms.versioned_site_map(app)
+        self.assertEqual(version, 'templates')
+        index = cms.route_index(sitemap, version)
+        self.assertEqual(cms.route_index(sitemap, version), index)
+        self.assertEqual(cms.match('foo/5')['path'], '/foo/<id>')
+        # indexes are shared by CMS instances with the same key
+        self.assertEqual(CMS(app).route_index(sitemap, version), index)
+        self.assertNotEqual(CMS(app, 'bla').route_index(sitemap, version),
+                            index)
+        # without a version the index is reused for the same object only
+        other = cms.route_index(list(sitemap))
+        self.assertNotEqual(other, index)
+        self.assertEqual(cms.route_index(list(sitemap)).routes[0][1],
+                         index.routes[0][1])
+
+    def test_loaded_sitemap_index(self):
+        app = self.application()
+        data = json.dumps({'version': 'v1', 'pages': self.sitemap})
+
+        class LoadedCMS(CMS):
+
+            def versioned_site_map(self, app):
+                # a new list at every call, as a cached sitemap
+                data_ = json.loads(data)
+                return data_['version'], data_['pages']
+
+        first, second = LoadedCMS(app), LoadedCMS(app)
+        version, sitemap = first.versioned_site_map(app)
+        index = first.route_index(sitemap, version)
+        self.assertEqual(first.match('foo/5')['path'], '/foo/<id>')
+        self.assertEqual(second.match('foo/5')['path'], '/foo/<id>')
+        version, sitemap = second.versioned_site_map(app)
+        self.assertTrue(second.route_index(sitemap, version) is index)
+        self.assertEqual(index.matched.hits, 1)
+
+
+class TestRouteIndexBenchmark(test.TestCase):
+    '''Match paths against a sitemap of 10,000 pages'''
+    __benchmark__ = True
+    __number__ = 1000
+    sitemap = ([{'path': '/blog/post-%d' % n} for n in range(5000)] +
+               [{'path': '/section%d/<id>' % n} for n in range(5000)])
+    index = None
+
+    def setUp(self):
+        if self.index is None:
+            self.__class__.index = RouteIndex(self.sitemap, max_entries=100)
+
+    def test_static(self):
+        self.assertTrue(self.index.match('blog/post-4999'))
+
+    def test_dynamic(self):
+        self.assertTrue(self.index.match('section4999/10'))
+
+    def test_not_found(self):
+        self.assertFalse(self.index.match('section4999/10/foo'))
+
+
+class TestCMSPageBenchmark(test.TestCase):
+    '''CMS.page with a sitemap of 10,000 pages loaded at every request
+    by a new CMS instance'''
+    __benchmark__ = True
+    __number__ = 1000
+    config_file = 'tests.core'
+    data = json.dumps(
+        {'version': 'v1',
+         'pages': ([{'path': '/blog/post-%d' % n} for n in range(5000)] +
+                   [{'path': '/section%d/<id>' % n} for n in range(5000)])})
+    app = None
+
+    def setUp(self):
+        if self.app is None:
+            self.__class__.app = self.application()
+
+    def page(self, versioned):
+
+        class LoadedCMS(CMS):
+
+            def versioned_site_map(self, app):
+                data = json.loads(TestCMSPageBenchmark.data)
+                version = data['version'] if versioned else None
+                return version, data['pages']
+
+        page = LoadedCMS(self.app, 'blog').page('section4999/10')
+        self.assertEqual(page.path, '/section4999/<id>')
+
+    def test_page(self):
+        self.page(True)
+
+    def test_page_rebuild_index(self):
+        self.page(False)
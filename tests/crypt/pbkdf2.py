@@ -1,11 +1,14 @@
 from binascii import unhexlify
 
+from pulsar import ImproperlyConfigured
+
 from lux.utils import test
+from lux.extensions.rest.user import PasswordMixin
 
 from lux.utils.crypt.pbkdf2 import (_0xffffffffL, algorithms,
                                     isbytes, isinteger, callable, binxor,
                                     b64encode, verify, b2a_hex, PBKDF2,
-                                    crypt, _makesalt, encrypt,
+                                    pbkdf2, crypt, _makesalt, encrypt,
                                     sha1, sha256, sha512)
 
 
@@ -395,3 +398,70 @@ class TestPBKDF2(test.TestCase):
         psw = mixin.encrypt(raw)
         self.assertNotEqual(raw, psw)
         self.assertTrue(mixin.crypt_verify(psw, raw))
+
+    def test_pbkdf2_hashlib(self):
+        for digestmodule in (sha1, sha256, sha512):
+            for secret_key in (None, b'secret', 'secret'):
+                expected = PBKDF2('password', 'salt', 100, digestmodule,
+                                  secret_key=secret_key).read(40)
+                result = pbkdf2('password', b'salt', 100, digestmodule,
+                                secret_key, 40)
+                self.assertEqual(result, expected)
+        # Hashes created with the pure python implementation still verify
+        salt = '$p5k2$sha256$3e8$XXXXXXXX'
+        rawhash = PBKDF2('spam', salt, 1000, sha256,
+                         secret_key=b'secret').read(32)
+        hashpass = salt + '$' + b64encode(rawhash, './')
+        self.assertTrue(verify(hashpass, 'spam', b'secret'))
+        self.assertFalse(verify(hashpass, 'spam', b'other'))
+
+    def test_process_pool(self):
+        app = self.application(CRYPT_PROCESS_POOL=1, GREEN_POOL=2)
+        backend = PasswordMixin()
+        backend.on_config(app)
+        self.assertEqual(backend.crypt_processes, 1)
+
+        def check():
+            password = backend.password('spam')
+            self.assertTrue(backend.crypt_pool)
+            self.assertTrue(backend.crypt_verify(password, 'spam'))
+            self.assertFalse(backend.crypt_verify(password, 'spam2'))
+
+        yield from app.green_pool.submit(check)
+        backend.on_stop(app)
+        self.assertEqual(backend.crypt_pool, None)
+
+    def test_process_pool_requires_green_pool(self):
+        app = self.application(CRYPT_PROCESS_POOL=1)
+        backend = PasswordMixin()
+        self.assertRaises(ImproperlyConfigured, backend.on_config, app)
+
+
+class TestPBKDF2Benchmark(test.TestCase):
+    '''Hash a password with 24000 iterations of HMAC-SHA256'''
+    __benchmark__ = True
+    __number__ = 20
+    config_params = dict(CRYPT_ALGORITHM='lux.utils.crypt.pbkdf2',
+                         EXTENSIONS=['lux.extensions.rest'],
+                         CRYPT_PROCESS_POOL=2,
+                         GREEN_POOL=2)
+    backend = None
+
+    def setUp(self):
+        if self.backend is None:
+            app = self.application()
+            backend = PasswordMixin()
+            backend.on_config(app)
+            self.__class__.backend = backend
+            self.__class__.green_pool = app.green_pool
+
+    def test_python(self):
+        PBKDF2('spam', _makesalt(), 24000, sha256).read(32)
+
+    def test_hashlib(self):
+        pbkdf2('spam', _makesalt(), 24000, sha256, None, 32)
+
+    def test_process_pool(self):
+        password = yield from self.green_pool.submit(self.backend.password,
+                                                     'spam')
+        self.assertTrue(password)
@@ -54,6 +54,8 @@ class Task(Model):
     assigned_id = Column(Integer, ForeignKey('person.id'))
     enum_field = Column(ChoiceType(TestEnum), default=TestEnum.opt1)
 
+    __search__ = ('subject',)
+
 
 def person_model():
     return odm.RestModel('person', PersonForm, PersonForm, url='people')
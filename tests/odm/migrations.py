@@ -97,6 +97,17 @@ class TestMigrationsCommands(test.TestCase):
         for value in metadata.values():
             self.assertIsInstance(value, MetaData)
 
+    def test_search_migrations(self):
+        cmd = self.cmd()
+        args = cmd.search_migrations()
+        self.assertEqual(args['default_upgrades'],
+                         "create_search_index('task', [('subject', 'A')], "
+                         "pkey='id', language='english')")
+        self.assertEqual(args['default_downgrades'],
+                         "drop_search_index('task', [('subject', 'A')], "
+                         "pkey='id', language='english')")
+        self.assertFalse('auth_upgrades' in args)
+
     def test_get_lux_template_directory(self):
         cmd = self.cmd()
         template_path = cmd.get_lux_template_directory()
@@ -0,0 +1,45 @@
+from lux.utils import test
+from lux.extensions.rest import encode_cursor
+
+
+class TestPaginationBenchmark(test.AppTestCase):
+    '''Latency of page 1 versus page 10,000 with offset and cursor
+    pagination
+    '''
+    __benchmark__ = True
+    __number__ = 20
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://'}
+    limit = 10
+    pages = 10000
+
+    @classmethod
+    def populatedb(cls):
+        odm = cls.app.odm()
+        table = odm['task'].__table__
+        rows = [{'subject': 'task %d' % n}
+                for n in range(cls.limit*cls.pages)]
+        with odm.begin() as session:
+            session.execute(table.insert(), rows)
+
+    def _get(self, path):
+        request = yield from self.client.get(path)
+        data = self.json(request.response, 200)
+        self.assertEqual(len(data['result']), self.limit)
+        return data
+
+    def test_offset_first_page(self):
+        yield from self._get('/tasks?limit=%d' % self.limit)
+
+    def test_offset_last_page(self):
+        offset = self.limit*(self.pages - 1)
+        yield from self._get('/tasks?limit=%d&offset=%d' % (self.limit,
+                                                            offset))
+
+    def test_cursor_first_page(self):
+        yield from self._get('/tasks?limit=%d&cursor=' % self.limit)
+
+    def test_cursor_last_page(self):
+        cursor = encode_cursor([self.limit*(self.pages - 1)])
+        yield from self._get('/tasks?limit=%d&cursor=%s' % (self.limit,
+                                                            cursor))
@@ -1,6 +1,14 @@
+import json
+from urllib.parse import urlparse
+
 from dateutil.parser import parse
+from sqlalchemy import event
+
+from pulsar import isfuture
 
 from lux.utils import test
+from lux.core.cache import DummyCache
+from lux.extensions.rest.pagination import encode_cursor
 
 
 class TestPostgreSql(test.AppTestCase):
@@ -34,6 +42,10 @@ class TestPostgreSql(test.AppTestCase):
         self.assertTrue('token' in data)
         return data['token']
 
+    def _path(self, url):
+        url = urlparse(url)
+        return '%s?%s' % (url.path, url.query)
+
     def _create_task(self, token, subject='This is a task', person=None,
                      **data):
         data['subject'] = subject
@@ -96,7 +108,9 @@ class TestPostgreSql(test.AppTestCase):
         tables = yield from self.app.odm.tables()
         self.assertTrue(tables)
         self.assertEqual(len(tables), 1)
-        self.assertEqual(len(tables[0][1]), 10)
+        # exclude the sqlite full text search tables
+        names = [t for t in tables[0][1] if not t.startswith('task_search')]
+        self.assertEqual(len(names), 10)
 
     def test_rest_model(self):
         from tests.odm import CRUDTask, CRUDPerson
@@ -223,6 +237,316 @@ class TestPostgreSql(test.AppTestCase):
             dt2 = parse(task2['created'])
             self.assertTrue(dt2 < dt1)
 
+    def test_cursor_pagination(self):
+        token = yield from self._token()
+        for n in range(5):
+            yield from self._create_task(token, 'cursor task %d' % n)
+        request = yield from self.client.get('/tasks?cursor=&limit=2')
+        data = self.json(request.response, 200)
+        self.assertFalse('total' in data)
+        self.assertFalse('prev' in data)
+        ids = [task['id'] for task in data['result']]
+        self.assertEqual(len(ids), 2)
+        while 'next' in data:
+            request = yield from self.client.get(self._path(data['next']))
+            data = self.json(request.response, 200)
+            self.assertTrue('prev' in data)
+            ids.extend((task['id'] for task in data['result']))
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(len(ids) >= 5)
+        #
+        request = yield from self.client.get(self._path(data['prev']))
+        data = self.json(request.response, 200)
+        self.assertTrue('next' in data)
+        self.assertEqual(len(data['result']), 2)
+
+    def test_cursor_pagination_sortby(self):
+        token = yield from self._token()
+        for n in range(3):
+            yield from self._create_task(token, 'sorted cursor task %d' % n)
+        request = yield from self.client.get(
+            '/tasks?cursor=&limit=1&sortby=created:desc')
+        data = self.json(request.response, 200)
+        result = data['result']
+        while 'next' in data:
+            request = yield from self.client.get(self._path(data['next']))
+            data = self.json(request.response, 200)
+            result.extend(data['result'])
+        for task1, task2 in zip(result, result[1:]):
+            self.assertTrue(parse(task1['created']) >= parse(task2['created']))
+
+    def _cursor_ids(self, path):
+        request = yield from self.client.get(path)
+        data = self.json(request.response, 200)
+        ids = [task['id'] for task in data['result']]
+        while 'next' in data:
+            request = yield from self.client.get(self._path(data['next']))
+            data = self.json(request.response, 200)
+            ids.extend((task['id'] for task in data['result']))
+        return ids
+
+    def test_cursor_pagination_nullable(self):
+        token = yield from self._token()
+        person = yield from self._create_person(token, 'cursor_nullable')
+        for n in range(4):
+            yield from self._create_task(token, 'nullable cursor task %d' % n,
+                                         person=person if n % 2 else None)
+        request = yield from self.client.get('/tasks?limit=1000')
+        expected = set(task['id'] for task in self.json(request.response,
+                                                        200)['result'])
+        for sortby in ('assigned_id', 'assigned_id:desc'):
+            ids = yield from self._cursor_ids(
+                '/tasks?cursor=&limit=1&sortby=%s' % sortby)
+            self.assertEqual(len(ids), len(set(ids)))
+            self.assertEqual(set(ids), expected)
+
+    def test_cursor_pagination_enum(self):
+        token = yield from self._token()
+        for option in ('opt1', 'opt2', 'opt1'):
+            yield from self._create_task(token, 'enum cursor task',
+                                         enum_field=option)
+        ids = yield from self._cursor_ids(
+            '/tasks?cursor=&limit=1&sortby=enum_field:desc')
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(len(ids) >= 3)
+        cursor = encode_cursor(['foo', 1])
+        request = yield from self.client.get(
+            '/tasks?cursor=%s&sortby=enum_field' % cursor)
+        self.assertEqual(request.response.status_code, 400)
+
+    def test_total_none(self):
+        token = yield from self._token()
+        yield from self._create_task(token, 'first task without total')
+        yield from self._create_task(token, 'second task without total')
+        request = yield from self.client.get('/tasks?total=none&limit=1')
+        data = self.json(request.response, 200)
+        self.assertFalse('total' in data)
+        self.assertFalse('last' in data)
+        self.assertEqual(len(data['result']), 1)
+        self.assertTrue('next' in data)
+        request = yield from self.client.get('/tasks/metadata?total=none')
+        data = self.json(request.response, 200)
+        self.assertFalse('total' in data)
+
+    def test_total_strategies(self):
+        token = yield from self._token()
+        yield from self._create_task(token, 'a task to count')
+        request = yield from self.client.get('/tasks')
+        total = self.json(request.response, 200)['total']
+        self.assertTrue(total)
+        for strategy in ('cached', 'estimated'):
+            request = yield from self.client.get('/tasks?total=%s' % strategy)
+            data = self.json(request.response, 200)
+            self.assertEqual(data['total'], total)
+        request = yield from self.client.get('/tasks?cursor=&total=exact')
+        data = self.json(request.response, 200)
+        self.assertEqual(data['total'], total)
+
+    def _stream(self, response):
+        chunks = []
+        for chunk in response.content:
+            if isfuture(chunk):
+                chunk = yield from chunk
+            if chunk:
+                chunks.append(chunk)
+        return b''.join(chunks).decode('utf-8')
+
+    def test_stream(self):
+        token = yield from self._token()
+        yield from self._create_task(token, 'first streamed task')
+        yield from self._create_task(token, 'second streamed task')
+        request = yield from self.client.get('/tasks?limit=20&sortby=id')
+        data = self.json(request.response, 200)
+        request = yield from self.client.get(
+            '/tasks?stream=1&limit=20&sortby=id')
+        response = request.response
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type,
+                         'application/json; charset=utf-8')
+        content = yield from self._stream(response)
+        self.assertEqual(json.loads(content)['result'], data['result'])
+
+    def test_stream_ndjson(self):
+        token = yield from self._token()
+        yield from self._create_task(token, 'a streamed task')
+        request = yield from self.client.get('/tasks?limit=1&sortby=id')
+        data = self.json(request.response, 200)
+        request = yield from self.client.get(
+            '/tasks?stream=ndjson&limit=1&sortby=id')
+        response = request.response
+        self.assertEqual(response.content_type,
+                         'application/x-ndjson; charset=utf-8')
+        content = yield from self._stream(response)
+        lines = content.split('\n')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual([json.loads(line) for line in lines[:-1]],
+                         data['result'])
+
+    def test_stream_limit(self):
+        token = yield from self._token()
+        yield from self._create_task(token, 'a limited streamed task')
+        yield from self._create_task(token, 'another limited streamed task')
+        config = self.app.config
+        noauth = config['API_LIMIT_NOAUTH']
+        config['API_LIMIT_NOAUTH'] = 1
+        try:
+            request = yield from self.client.get('/tasks?stream=ndjson')
+            content = yield from self._stream(request.response)
+            self.assertEqual(len(content.split('\n')), 2)
+            request = yield from self.client.get(
+                '/tasks?stream=ndjson&limit=1000')
+            content = yield from self._stream(request.response)
+            self.assertEqual(len(content.split('\n')), 2)
+        finally:
+            config['API_LIMIT_NOAUTH'] = noauth
+        request = yield from self.client.get('/tasks?stream=ndjson',
+                                             token=token)
+        content = yield from self._stream(request.response)
+        self.assertTrue(len(content.split('\n')) > 2)
+
+    def test_bulk(self):
+        token = yield from self._token()
+        person = yield from self._create_person(token, 'bulkperson')
+        task1 = yield from self._create_task(token, 'a task to update')
+        task2 = yield from self._create_task(token, 'a task to delete')
+        operations = [{'action': 'create',
+                       'data': {'subject': 'a bulk task',
+                                'assigned': person['id']}},
+                      {'action': 'create', 'data': {'done': True}},
+                      {'action': 'update', 'id': task1['id'],
+                       'data': {'done': True}},
+                      {'action': 'delete', 'id': task2['id']},
+                      {'action': 'delete', 'id': 10000000}]
+        request = yield from self.client.post(
+            '/tasks/_bulk', body=operations,
+            content_type='application/json')
+        self.assertEqual(request.response.status_code, 403)
+        request = yield from self.client.post(
+            '/tasks/_bulk', body=operations, token=token,
+            content_type='application/json')
+        result = self.json(request.response, 200)['result']
+        self.assertEqual([r['status'] for r in result],
+                         [201, 422, 200, 204, 404])
+        task = result[0]['result']
+        self.assertEqual(task['subject'], 'a bulk task')
+        self.assertEqual(task['assigned']['id'], person['id'])
+        self.assertTrue(task['created'])
+        self.assertEqual(result[2]['result']['done'], True)
+        self.assertEqual(result[2]['result']['subject'], task1['subject'])
+        data = yield from self._get_task(token, task['id'])
+        self.assertEqual(data['subject'], 'a bulk task')
+        request = yield from self.client.get('/tasks/%d' % task2['id'])
+        self.assertEqual(request.response.status_code, 404)
+
+    def test_bulk_invalid(self):
+        token = yield from self._token()
+        for body in ({'action': 'create'}, [{'action': 'foo'}], ['foo']):
+            request = yield from self.client.post(
+                '/tasks/_bulk', body=body, token=token,
+                content_type='application/json')
+            self.assertEqual(request.response.status_code, 400)
+
+    def _queries(self, path, token):
+        engines = self.app.odm().engines()
+        queries = []
+
+        def execute(conn, cursor, statement, *args):
+            queries.append(statement)
+
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', execute)
+        try:
+            request = yield from self.client.get(path, token=token)
+            data = self.json(request.response, 200)
+        finally:
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute', execute)
+        return data, queries
+
+    def test_related_queries(self):
+        token = yield from self._token()
+        person = yield from self._create_person(token, 'eager')
+        for n in range(6):
+            yield from self._create_task(token, 'eager task %d' % n, person)
+        base = '/tasks?assigned=%s&limit=' % person['id']
+        _, q1 = yield from self._queries(base + '1', token)
+        _, q6 = yield from self._queries(base + '6', token)
+        self.assertEqual(len(q1), len(q6))
+        request = yield from self.client.get(base + '6', token=token)
+        data = self.json(request.response, 200)
+        self.assertEqual(len(data['result']), 6)
+        for task in data['result']:
+            self.assertEqual(task['assigned']['id'], person['id'])
+
+    def test_fields(self):
+        token = yield from self._token()
+        person = yield from self._create_person(token, 'sparse')
+        task = yield from self._create_task(token, 'a sparse task', person)
+        data, queries = yield from self._queries(
+            '/tasks?fields=subject,done&limit=5', token)
+        for item in data['result']:
+            self.assertEqual(set(item), set(('subject', 'done')))
+        self.assertFalse([q for q in queries if 'task.created' in q])
+        self.assertFalse([q for q in queries if 'person' in q])
+        data, _ = yield from self._queries(
+            '/tasks?fields=subject,assigned&assigned=%s' % person['id'],
+            token)
+        self.assertEqual(data['result'][0],
+                         {'subject': 'a sparse task',
+                          'assigned': {'id': person['id']}})
+        data, _ = yield from self._queries(
+            '/tasks/%d?fields=id,subject' % task['id'], token)
+        self.assertEqual(data, {'id': task['id'],
+                                'subject': 'a sparse task'})
+        request = yield from self.client.get('/tasks?fields=foo')
+        self.assertEqual(request.response.status_code, 400)
+
+    def test_search(self):
+        token = yield from self._token()
+        task1 = yield from self._create_task(token, 'pineapple and kiwi')
+        task2 = yield from self._create_task(token, 'kiwi pineapples',
+                                             done=True)
+        yield from self._create_task(token, 'a banana')
+        request = yield from self.client.get('/tasks?q=kiwi&sortby=id')
+        data = self.json(request.response, 200)
+        self.assertEqual([t['id'] for t in data['result']],
+                         [task1['id'], task2['id']])
+        self.assertEqual(data['total'], 2)
+        request = yield from self.client.get('/tasks?q=kiwi&done=1')
+        data = self.json(request.response, 200)
+        self.assertEqual([t['id'] for t in data['result']], [task2['id']])
+        request = yield from self.client.get('/tasks?q=kiwi&limit=1')
+        data = self.json(request.response, 200)
+        self.assertEqual(len(data['result']), 1)
+        self.assertEqual(data['total'], 2)
+        request = yield from self.client.get('/tasks?q=*"-')
+        data = self.json(request.response, 200)
+        self.assertEqual(data['result'], [])
+
+    def test_total_cached_dummy_cache(self):
+        self.assertIsInstance(self.app.cache_server, DummyCache)
+        token = yield from self._token()
+        yield from self._create_task(token, 'a task to count in cache')
+        for _ in range(2):
+            request = yield from self.client.get('/tasks?total=cached')
+            data = self.json(request.response, 200)
+            self.assertTrue('total' in data)
+
+    def test_cursor_invalid(self):
+        request = yield from self.client.get('/tasks?cursor=foo')
+        self.assertEqual(request.response.status_code, 400)
+
+    def test_sortby_invalid(self):
+        for path in ('/tasks?sortby=a:b:c',
+                     '/tasks?cursor=&sortby=a:b:c',
+                     '/tasks?cursor=&sortby=created:foo'):
+            request = yield from self.client.get(path)
+            self.assertEqual(request.response.status_code, 400)
+        request = yield from self.client.get(
+            '/tasks?cursor=&sortby=created:desc')
+        self.assertEqual(request.response.status_code, 200)
+
     def test_sortby_non_existent(self):
         token = yield from self._token()
         yield from self._create_task(token, 'a task')
@@ -362,6 +686,56 @@ class TestPostgreSql(test.AppTestCase):
         for task in result:
             self.assertEqual(task['done'], False)
 
+    def test_filter_operators(self):
+        token = yield from self._token()
+        task1 = yield from self._create_task(token, 'opfilter 50% done',
+                                             done=True)
+        task2 = yield from self._create_task(token, 'opfilter_kiwi')
+        task3 = yield from self._create_task(token, 'xopfilter kiwi')
+
+        def ids(query):
+            request = yield from self.client.get('/tasks?sortby=id&%s' %
+                                                 query)
+            data = self.json(request.response, 200)
+            return [t['id'] for t in data['result']]
+
+        result = yield from ids('subject:startswith=opfilter')
+        self.assertEqual(result, [task1['id'], task2['id']])
+        result = yield from ids('subject:startswith=opfilter_')
+        self.assertEqual(result, [task2['id']])
+        result = yield from ids('subject:contains=0%25')
+        self.assertEqual(result, [task1['id']])
+        result = yield from ids('id:in=%s,%s' % (task1['id'], task3['id']))
+        self.assertEqual(result, [task1['id'], task3['id']])
+        result = yield from ids('subject:contains=opfilter&id:ne=%s' %
+                                task2['id'])
+        self.assertEqual(result, [task1['id'], task3['id']])
+        result = yield from ids('id:range=%s,%s' % (task2['id'],
+                                                    task3['id']))
+        self.assertEqual(result, [task2['id'], task3['id']])
+        result = yield from ids('subject:contains=opfilter&id:range=,%s' %
+                                task2['id'])
+        self.assertEqual(result, [task1['id'], task2['id']])
+        result = yield from ids('subject:contains=opfilter'
+                                '&assigned:isnull=1')
+        self.assertEqual(result, [task1['id'], task2['id'], task3['id']])
+        result = yield from ids('subject:contains=opfilter'
+                                '&assigned:isnull=0')
+        self.assertEqual(result, [])
+        # OR group
+        result = yield from ids('subject:contains=opfilter'
+                                '&or.done=1&or.subject:contains=kiwi')
+        self.assertEqual(result, [task1['id'], task2['id'], task3['id']])
+        result = yield from ids('subject:startswith=opfilter'
+                                '&or.done=1&or.id=%s' % task3['id'])
+        self.assertEqual(result, [task1['id']])
+
+    def test_filter_operator_invalid(self):
+        request = yield from self.client.get('/tasks?id:foo=1')
+        self.assertEqual(request.response.status_code, 400)
+        request = yield from self.client.get('/tasks?id:range=1')
+        self.assertEqual(request.response.status_code, 400)
+
     def test_multi_relationship_field(self):
         from lux.extensions.odm import RelationshipField, RestModel
         field = RelationshipField(RestModel('book'), name='test_book',
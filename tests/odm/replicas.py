@@ -0,0 +1,97 @@
+from sqlalchemy import insert
+
+from pulsar import ImproperlyConfigured
+
+from lux.utils import test
+from lux.extensions.odm.mapper import ReplicaSet
+
+
+class TestReadReplicas(test.TestCase):
+    config_file = 'tests.odm'
+    config_params = {
+        'DATASTORE': {
+            'default': {
+                'primary': 'sqlite://',
+                'replicas': ['sqlite://', 'sqlite://']
+            }
+        },
+        'DATASTORE_STICKY_WINDOW': 60,
+        'DATASTORE_STICKY_ENTRIES': 100,
+        'CACHE_SERVER': 'memory://'
+    }
+
+    def mapper(self):
+        app = self.application()
+        return app.odm()
+
+    def test_replicas(self):
+        odm = self.mapper()
+        primary = odm.get_engine()
+        self.assertEqual(len(odm.engines()), 1)
+        replicas = odm.replicas[primary]
+        self.assertIsInstance(replicas, ReplicaSet)
+        self.assertEqual(len(replicas.engines), 2)
+        self.assertEqual(replicas.policy, 'round_robin')
+
+    def test_read_only_session(self):
+        odm = self.mapper()
+        primary = odm.get_engine()
+        replicas = odm.replicas[primary].engines
+        task = odm.task
+        binds = []
+        for _ in range(2):
+            session = odm.session(read_only=True)
+            self.assertTrue(session.read_only)
+            bind = session.get_bind(task)
+            self.assertTrue(bind in replicas)
+            # a session sticks to the same replica
+            self.assertEqual(session.get_bind(task), bind)
+            # writes go to the primary
+            self.assertEqual(session.get_bind(task, insert(task.__table__)),
+                             primary)
+            binds.append(bind)
+        self.assertEqual(set(binds), set(replicas))
+        session = odm.session()
+        self.assertFalse(session.read_only)
+        self.assertEqual(session.get_bind(task), primary)
+
+    def test_sticky(self):
+        odm = self.mapper()
+        primary = odm.get_engine()
+        self.assertFalse(odm.wrote('foo'))
+        odm.sticky.set('foo', True)
+        self.assertTrue(odm.wrote('foo'))
+        session = odm.session(read_only=True, sticky='foo')
+        self.assertFalse(session.read_only)
+        self.assertEqual(session.get_bind(odm.task), primary)
+        session = odm.session(read_only=True, sticky='bla')
+        self.assertTrue(session.read_only)
+
+    def test_sticky_workers(self):
+        odm = self.mapper()
+        self.assertEqual(odm.sticky.max_entries, 100)
+        odm.write('foo')
+        self.assertTrue(odm.wrote('foo'))
+        # writes are visible to other workers via the cache server
+        odm.sticky.clear()
+        self.assertTrue(odm.wrote('foo'))
+        self.assertFalse(odm.wrote('bla'))
+        session = odm.session(read_only=True, sticky='foo')
+        self.assertFalse(session.read_only)
+
+    def test_sticky_recorded_changes(self):
+        odm = self.mapper()
+        with odm.begin(sticky='bulk') as session:
+            # changes of bulk operations are recorded explicitly
+            session.record_changes([odm.task(id=1)], 'insert')
+        self.assertTrue(odm.wrote('bulk'))
+
+    def test_latency_policy(self):
+        odm = self.mapper()
+        engines = odm.replicas[odm.get_engine()].engines
+        replicas = ReplicaSet(engines, 'latency')
+        replicas.latency[engines[0]] = 0.5
+        replicas.latency[engines[1]] = 0.1
+        self.assertEqual(replicas.engine(), engines[1])
+        self.assertEqual(replicas.engine(), engines[1])
+        self.assertRaises(ImproperlyConfigured, ReplicaSet, engines, 'foo')
@@ -0,0 +1,146 @@
+import json
+from copy import copy
+from datetime import date, datetime
+from enum import Enum as PyEnum
+
+import pytz
+from sqlalchemy import Column, Enum, String
+
+from lux.utils import test
+from lux.extensions import odm
+from lux.extensions.odm.models import column_converter, ModelColumn
+
+from tests.odm import TestEnum, CRUDTask
+
+
+class SerializerMixin:
+    config_file = 'tests.odm'
+    config_params = {'DATASTORE': 'sqlite://'}
+
+    def model(self):
+        return CRUDTask().model(self.app)
+
+    def task(self, n=0, **kw):
+        Task = self.app.odm()['task']
+        return Task(id=n, subject='task %d' % n, done=False,
+                    created=datetime(2015, 10, 18, 12), **kw)
+
+
+class TestSerializerPlan(SerializerMixin, test.AppTestCase):
+
+    def test_plan_cached(self):
+        model = self.model()
+        request = yield from self.client.get('/tasks')
+        plan = model.serializer_plan(request, ('done',))
+        self.assertEqual(model.serializer_plan(request, ['done']), plan)
+        self.assertNotEqual(model.serializer_plan(request), plan)
+        names = [entry[0] for entry in plan]
+        self.assertFalse('done' in names)
+        self.assertTrue('subject' in names)
+
+    def test_tojson(self):
+        model = self.model()
+        request = yield from self.client.get('/tasks')
+        data = model.tojson(request, self.task(enum_field=TestEnum.opt2))
+        self.assertEqual(data['subject'], 'task 0')
+        self.assertEqual(data['created'], '2015-10-18T12:00:00+00:00')
+        self.assertEqual(data['enum_field'], 'opt2')
+        self.assertEqual(data['done'], False)
+        self.assertFalse('assigned' in data)
+        self.assertEqual(model.serialise(request, [self.task()]),
+                         [model.serialise(request, self.task())])
+
+    def test_tojson_override(self):
+        class Model(odm.RestModel):
+
+            def tojson(self, request, obj, exclude=None):
+                data = super().tojson(request, obj, exclude)
+                data['custom'] = True
+                return data
+
+        model = copy(self.model())
+        model.__class__ = Model
+        request = yield from self.client.get('/tasks')
+        data = model.serialise(request, [self.task(), self.task(1)])
+        self.assertEqual(len(data), 2)
+        self.assertTrue(data[0]['custom'])
+        self.assertTrue(data[1]['custom'])
+
+    def test_enum_converter(self):
+        converter = column_converter(Column(Enum(TestEnum)))
+        self.assertEqual(converter(TestEnum.opt2), 'opt2')
+        converter = column_converter(Column(Enum('a', 'b')))
+        self.assertEqual(converter('a'), 'a')
+        self.assertEqual(column_converter(Column(String(20))), None)
+
+
+class TestSerializerBenchmark(SerializerMixin, test.AppTestCase):
+    '''Serialise 10,000 rows'''
+    __benchmark__ = True
+    __number__ = 10
+    rows = None
+
+    def setUp(self):
+        if self.rows is None:
+            self.__class__.rows = [self.task(n) for n in range(10000)]
+
+    def test_serialise(self):
+        model = self.model()
+        request = yield from self.client.get('/tasks?limit=1')
+        data = model.serialise(request, self.rows)
+        self.assertEqual(len(data), 10000)
+
+    def test_serialise_model(self):
+        model = self.model()
+        request = yield from self.client.get('/tasks?limit=1')
+        data = [model.serialise_model(request, row) for row in self.rows]
+        self.assertEqual(len(data), 10000)
+
+    def test_serialise_legacy(self):
+        '''The per-row serialisation used before serializer plans'''
+        model = self.model()
+        request = yield from self.client.get('/tasks?limit=1')
+        data = [legacy_tojson(model, request, row) for row in self.rows]
+        self.assertEqual(len(data), 10000)
+        self.assertEqual(data[0], model.tojson(request, self.rows[0]))
+
+
+def legacy_tojson(model, request, obj, exclude=None):
+    '''odm.RestModel.tojson before serializer plans, kept as the
+    baseline of :class:`.TestSerializerBenchmark`
+    '''
+    exclude = set(exclude or ())
+    exclude.update(model._exclude)
+    columns = model.columns(request.app)
+
+    fields = {}
+    for col in columns:
+        name = col['name']
+        restcol = model._rest_columns[name]
+        if name in exclude:
+            continue
+        try:
+            data = obj.__getattribute__(name)
+            if hasattr(data, '__call__'):
+                data = data()
+            if isinstance(data, date):
+                if isinstance(data, datetime) and not data.tzinfo:
+                    data = pytz.utc.localize(data)
+                data = data.isoformat()
+            elif isinstance(data, PyEnum):
+                data = data.name
+            elif isinstance(restcol, ModelColumn):
+                related = restcol.model(request.app)
+                data = model._related_model(request, related, data)
+            else:
+                json.dumps(data)
+        except TypeError:
+            try:
+                data = str(data)
+            except Exception:
+                continue
+        if data is not None:
+            if isinstance(data, list):
+                name = '%s[]' % name
+            fields[name] = data
+    return fields
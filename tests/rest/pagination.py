@@ -1,14 +1,24 @@
+from datetime import datetime
 from urllib.parse import urlparse
 
 from pulsar.apps.wsgi.utils import query_dict
 
+from pulsar import BadRequest, ImproperlyConfigured
+
 from lux.utils import test
-from lux.extensions.rest import Pagination
+from lux.extensions.rest import (Pagination, GithubPagination, RestModel,
+                                 encode_cursor, decode_cursor)
 
 
 class TestUtils(test.TestCase):
     config_file = 'tests.rest'
 
+    def test_unknown_total_strategy(self):
+        self.assertRaises(ImproperlyConfigured, self.application,
+                          API_TOTAL='foo')
+        app = self.application(API_TOTAL='estimated')
+        self.assertEqual(app.config['API_TOTAL'], 'estimated')
+
     def test_last_link(self):
         app = self.application()
         request = app.wsgi_request()
@@ -60,3 +70,93 @@ class TestUtils(test.TestCase):
         query = query_dict(urlparse(pag['prev']).query)
         self.assertEqual(query['offset'], '17')
         self.assertEqual(query['limit'], '5')
+
+    def test_cursor_encoding(self):
+        cursor = encode_cursor([datetime(2015, 10, 1, 12, 30), 5])
+        self.assertFalse('=' in cursor)
+        values, before = decode_cursor(cursor)
+        self.assertEqual(values, ['2015-10-01T12:30:00', 5])
+        self.assertFalse(before)
+        values, before = decode_cursor(encode_cursor(['foo'], True))
+        self.assertEqual(values, ['foo'])
+        self.assertTrue(before)
+        self.assertRaises(BadRequest, decode_cursor, 'xxxxx')
+        self.assertRaises(BadRequest, decode_cursor, encode_cursor('foo'))
+
+    def test_cursor_links(self):
+        app = self.application()
+        request = app.wsgi_request()
+        pagination = Pagination()
+        #
+        pag = pagination.cursor(request, [], 25)
+        self.assertEqual(pag, {'result': []})
+        #
+        pag = pagination.cursor(request, [], 25, next='abc', total=120)
+        self.assertEqual(pag['total'], 120)
+        self.assertFalse('prev' in pag)
+        self.assertFalse('first' in pag)
+        query = query_dict(urlparse(pag['next']).query)
+        self.assertEqual(query['cursor'], 'abc')
+        self.assertEqual(query['limit'], '25')
+        #
+        pag = pagination.cursor(request, [], 25, prev='xyz')
+        self.assertFalse('next' in pag)
+        self.assertFalse('total' in pag)
+        query = query_dict(urlparse(pag['prev']).query)
+        self.assertEqual(query['cursor'], 'xyz')
+        query = query_dict(urlparse(pag['first']).query)
+        self.assertEqual(query['cursor'], '')
+
+    def test_github_cursor_links(self):
+        app = self.application()
+        request = app.wsgi_request()
+        pagination = GithubPagination()
+        result = pagination.cursor(request, [1, 2], 2, next='abc', prev='x')
+        self.assertEqual(result, [1, 2])
+        self.assertEqual(len(request.response['links']), 3)
+
+    def test_unknown_total(self):
+        app = self.application()
+        request = app.wsgi_request()
+        pagination = Pagination()
+        #
+        pag = pagination(request, [], None, 25, 0)
+        self.assertEqual(pag, {'result': []})
+        #
+        pag = pagination(request, [], None, 25, 50, more=True)
+        self.assertFalse('total' in pag)
+        self.assertFalse('last' in pag)
+        query = query_dict(urlparse(pag['next']).query)
+        self.assertEqual(query['offset'], '75')
+        query = query_dict(urlparse(pag['prev']).query)
+        self.assertEqual(query['offset'], '25')
+        query = query_dict(urlparse(pag['first']).query)
+        self.assertEqual(query['offset'], '0')
+        #
+        pag = pagination(request, [], None, 25, 50, more=False)
+        self.assertFalse('next' in pag)
+        self.assertFalse('last' in pag)
+        self.assertTrue('prev' in pag)
+
+    def test_github_unknown_total(self):
+        app = self.application()
+        request = app.wsgi_request()
+        pagination = GithubPagination()
+        pagination(request, [], None, 25, 0, more=True)
+        self.assertEqual(len(request.response['links']), 1)
+
+    def test_total_strategy(self):
+        app = self.application()
+        model = RestModel('foo')
+        request = app.wsgi_request()
+        self.assertEqual(model.total_strategy(request), 'exact')
+        self.assertEqual(model.total_strategy(request, 'none'), 'none')
+        request = app.wsgi_request(path='/?total=none')
+        self.assertEqual(model.total_strategy(request), 'none')
+        self.assertEqual(model.total(request, None), None)
+        model = RestModel('foo', total='estimated')
+        request = app.wsgi_request(path='/?total=exact')
+        self.assertEqual(model.total_strategy(request), 'estimated')
+        request = app.wsgi_request(path='/?total=none')
+        self.assertEqual(model.total_strategy(request), 'none')
+        self.assertRaises(AssertionError, RestModel, 'foo', total='bla')
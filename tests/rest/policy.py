@@ -0,0 +1,94 @@
+from lux.utils import test
+from lux.extensions.rest import READ, UPDATE
+from lux.extensions.rest.policy import (has_permission, policy_set,
+                                        PolicySet)
+
+
+def permissions(policies=200, columns=50):
+    perms = {}
+    for n in range(policies):
+        action = ['model%d:column%d' % (n, c) for c in range(0, columns, 5)]
+        perms['permission%d' % n] = {'action': action,
+                                     'effect': 'deny' if n % 2 else 'allow'}
+    return perms
+
+
+class TestPolicy(test.TestCase):
+    config_params = {'EXTENSIONS': ['lux.extensions.rest']}
+
+    def request(self):
+        app = self.application()
+        return app.wsgi_request()
+
+    def test_compile(self):
+        policies = PolicySet({
+            'a': {'action': ['blog', 'blog:title'], 'effect': 'deny'},
+            'b': {'action': 'blog:title'},
+            'c': [{'action': 'task'}, {'action': 'blog:body'}],
+            'd': {},
+            'e': None})
+        self.assertEqual(len(policies), 4)
+        self.assertEqual(policies.effect('blog'), False)
+        # first policy wins
+        self.assertEqual(policies.effect('blog:title'), False)
+        self.assertEqual(policies.effect('blog:body'), True)
+        self.assertEqual(policies.effect('task'), True)
+        self.assertEqual(policies.effect('foo'), None)
+
+    def test_has_permission(self):
+        request = self.request()
+        perms = {'a': {'action': 'blog', 'effect': 'deny'},
+                 'b': {'action': 'blog:title'}}
+        self.assertFalse(has_permission(request, perms, 'blog', READ))
+        self.assertTrue(has_permission(request, perms, 'blog:title', READ))
+        self.assertFalse(has_permission(request, perms, 'blog:body', READ))
+        # default levels
+        self.assertTrue(has_permission(request, perms, 'task', READ))
+        self.assertFalse(has_permission(request, perms, 'task', UPDATE))
+        self.assertFalse(has_permission(request, perms, 'site:admin', READ))
+        self.assertFalse(has_permission(request, None, 'site:admin', READ))
+
+    def test_wildcard(self):
+        request = self.request()
+        perms = {'a': {'action': 'blog:*', 'effect': 'deny'},
+                 'b': {'action': ['blog:title', '*'], 'effect': 'allow'}}
+        self.assertTrue(has_permission(request, perms, 'blog', UPDATE))
+        self.assertTrue(has_permission(request, perms, 'blog:title', UPDATE))
+        self.assertFalse(has_permission(request, perms, 'blog:body', READ))
+        self.assertFalse(has_permission(request, perms, 'blog:body:x', READ))
+        self.assertTrue(has_permission(request, perms, 'task:x', UPDATE))
+
+    def test_policy_set_cache(self):
+        perms = permissions(10)
+        policies = policy_set(perms)
+        self.assertEqual(policies.version, PolicySet.digest(perms))
+        self.assertEqual(policy_set(permissions(10)), policies)
+        self.assertEqual(policy_set(policies), policies)
+        self.assertNotEqual(policy_set(permissions(11)), policies)
+        self.assertEqual(len(policy_set({})), 0)
+
+
+class TestPolicyBenchmark(test.TestCase):
+    '''Column permissions of a 50 columns model with 200 policies'''
+    __benchmark__ = True
+    __number__ = 1000
+    config_params = {'EXTENSIONS': ['lux.extensions.rest']}
+    columns = ['model100:column%d' % c for c in range(50)]
+    permissions = permissions(200, 50)
+    request = None
+
+    def setUp(self):
+        if self.request is None:
+            app = self.application()
+            self.__class__.request = app.wsgi_request()
+
+    def test_compile(self):
+        policies = PolicySet(self.permissions)
+        self.assertEqual(len(policies), 2000)
+
+    def test_column_permissions(self):
+        policies = policy_set(self.permissions)
+        request = self.request
+        perms = [has_permission(request, policies, column, READ)
+                 for column in self.columns]
+        self.assertEqual(len(perms), 50)